@@ -0,0 +1,196 @@
+# admission.py
+import asyncio
+import math
+import time
+import weakref
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, Optional
+
+from fastapi import HTTPException
+
+
+@dataclass
+class RouteLimit:
+    """Admission limits for one route"""
+    max_concurrency: int = 8
+    max_queue: int = 32
+    timeout: float = 30.0  # Default deadline in seconds when the client sends none
+
+
+class _RouteGate:
+    """Concurrency slots, wait queue and service time estimate for one route"""
+
+    def __init__(self, limit: RouteLimit):
+        self.limit = limit
+        self.slots = asyncio.Semaphore(limit.max_concurrency)
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_deadline = 0
+        self.service_time: Optional[float] = None  # EWMA in seconds
+
+    def expected_wait(self) -> float:
+        """Estimated time until a newly queued request gets a slot"""
+        if self.active < self.limit.max_concurrency or self.service_time is None:
+            return 0.0
+        return (self.waiting + 1) / self.limit.max_concurrency * self.service_time
+
+    def record_service_time(self, seconds: float, alpha: float = 0.2):
+        if self.service_time is None:
+            self.service_time = seconds
+        else:
+            self.service_time = alpha * seconds + (1 - alpha) * self.service_time
+
+
+class AdmissionTicket:
+    """A granted slot, release it when the request's work is done"""
+
+    def __init__(self, gate: _RouteGate, deadline: float):
+        self.gate = gate
+        self.deadline = deadline
+        self.started_at = time.monotonic()
+        self._released = False
+
+    @property
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining <= 0
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self.gate.active -= 1
+        self.gate.record_service_time(time.monotonic() - self.started_at)
+        self.gate.slots.release()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class AdmissionController:
+    """
+    Per-route admission control with a bounded wait queue and deadlines.
+
+    Requests beyond a route's concurrency limit wait in a bounded queue. When
+    the queue is full the request is rejected with 429, and when its deadline
+    cannot be met, either by estimate or after waiting, with 503. Both carry a
+    Retry-After header derived from the route's recent service time.
+    """
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, RouteLimit]] = None,
+        default_limit: Optional[RouteLimit] = None
+    ):
+        """
+        Args:
+            limits: Limits keyed by route path
+            default_limit: Limits for routes without an explicit entry
+        """
+        self.limits = limits or {}
+        self.default_limit = default_limit or RouteLimit()
+        self._gates: Dict[str, _RouteGate] = {}
+
+    def _gate(self, route: str) -> _RouteGate:
+        gate = self._gates.get(route)
+        if gate is None:
+            gate = _RouteGate(self.limits.get(route, self.default_limit))
+            self._gates[route] = gate
+        return gate
+
+    def deadline_for(self, route: str, timeout: Optional[float] = None) -> float:
+        """Absolute monotonic deadline for a request, from the client timeout or the route default"""
+        limit = self.limits.get(route, self.default_limit)
+        if timeout is None or timeout <= 0:
+            timeout = limit.timeout
+        return time.monotonic() + min(timeout, limit.timeout)
+
+    def _retry_after(self, gate: _RouteGate) -> str:
+        estimate = gate.expected_wait() or (gate.service_time or 1.0)
+        return str(max(1, math.ceil(estimate)))
+
+    def _reject(self, gate: _RouteGate, status_code: int, detail: str):
+        if status_code == 429:
+            gate.rejected_queue_full += 1
+        else:
+            gate.rejected_deadline += 1
+        raise HTTPException(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": self._retry_after(gate)}
+        )
+
+    async def acquire(self, route: str, deadline: float) -> AdmissionTicket:
+        """
+        Wait for a slot on the route or raise HTTPException(429/503).
+
+        Args:
+            route: Route path used to select the limits
+            deadline: Absolute time.monotonic() deadline of the request
+        """
+        gate = self._gate(route)
+        remaining = deadline - time.monotonic()
+
+        if gate.active >= gate.limit.max_concurrency:
+            if gate.waiting >= gate.limit.max_queue:
+                self._reject(gate, 429, "Server busy, request queue is full")
+            if gate.expected_wait() > remaining:
+                self._reject(gate, 503, "Request deadline cannot be met")
+        if remaining <= 0:
+            self._reject(gate, 503, "Request deadline already expired")
+
+        gate.waiting += 1
+        try:
+            await asyncio.wait_for(gate.slots.acquire(), timeout=remaining)
+        except asyncio.TimeoutError:
+            self._reject(gate, 503, "Request deadline expired while queued")
+        finally:
+            gate.waiting -= 1
+
+        gate.active += 1
+        gate.admitted += 1
+        return AdmissionTicket(gate, deadline)
+
+    def stats(self) -> Dict[str, Dict]:
+        """Current admission state per route"""
+        return {
+            route: {
+                "active": gate.active,
+                "waiting": gate.waiting,
+                "max_concurrency": gate.limit.max_concurrency,
+                "max_queue": gate.limit.max_queue,
+                "admitted": gate.admitted,
+                "rejected_queue_full": gate.rejected_queue_full,
+                "rejected_deadline": gate.rejected_deadline,
+                "service_time_ms": (gate.service_time or 0.0) * 1000
+            }
+            for route, gate in self._gates.items()
+        }
+
+
+def hold_while_streaming(body: AsyncIterator, ticket: AdmissionTicket) -> AsyncIterator:
+    """
+    Keep an admission ticket for as long as a streaming response body is sent.
+
+    The ticket is released when the body finishes, fails or is closed, and also
+    when it is garbage collected without ever being iterated, which happens if
+    the client disconnects before streaming starts.
+    """
+    async def guarded():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            ticket.release()
+
+    stream = guarded()
+    weakref.finalize(stream, ticket.release)
+    return stream
@@ -1,19 +1,29 @@
 import json
 import asyncio
-from typing import Optional
+import argparse
+from contextlib import aclosing, asynccontextmanager
+from typing import List, Optional
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from llama_stack_client import LlamaStackClient
+from llama_index.core.callbacks import CallbackManager
 from pydantic import BaseModel
+from starlette.routing import Match
 import time
 from restack_ai import Restack
 import uvicorn
-from llama_stack_client.lib.inference.event_logger import EventLogger
+import httpx
 from .data_ingestion import init_database  
-from llama_stack_client import LlamaStackClient
 from .ordinance_db import OrdinanceDBWithTogether
 from .rag import OrdinanceRAG
+from .llm_dispatcher import LLMDispatcher, Priority, DeadlineExceeded
+from .admission import AdmissionController, RouteLimit, hold_while_streaming
+from .streaming import stop_on_disconnect, coalesce_tokens, encode_line
+from .metrics import current_route, clear_snapshots, render_metrics, SnapshotWriter, HTTP_REQUESTS, HTTP_SECONDS
+from .jobs import JobManager, JobStore
+from .chat_memory import ChatMemory, ChatSessionStore
+from .tracing import build_callback_manager, shutdown_tracing, current_request_id, new_request_id
 import json
 import os
 from dotenv import load_dotenv
@@ -26,17 +36,110 @@ class QueryRequest(BaseModel):
     query: str
     count: int
 
-app = FastAPI()
-client = LlamaStackClient(base_url="http://localhost:5050")
-db = init_database(
-        collection_name="combined_ordinances"
-)
+COLLECTION_NAME = "combined_ordinances"
+CHAT_MODEL = "Llama3.1-405B-Instruct"
+CHAT_SYSTEM_PROMPT = "You are a helpful lady. Answer the asked question as faithfully as possible."
 
-# Initialize RAG system
-rag = OrdinanceRAG(
-    ordinance_db=db,
-    llama_client=client
-)
+def build_rag(
+    db: OrdinanceDBWithTogether,
+    dispatcher: LLMDispatcher,
+    callback_manager: Optional[CallbackManager] = None
+) -> OrdinanceRAG:
+    """Create the RAG system with retrieval settings from the environment"""
+    return OrdinanceRAG(
+        ordinance_db=db,
+        dispatcher=dispatcher,
+        callback_manager=callback_manager,
+        adaptive_top_k=os.getenv("RAG_ADAPTIVE_TOP_K", "false").lower() == "true",
+        min_k=int(os.getenv("RAG_MIN_K", "1")),
+        max_k=int(os.getenv("RAG_MAX_K", "10")),
+        score_threshold=float(os.getenv("RAG_SCORE_THRESHOLD", "0.85"))
+    )
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Build the per-worker clients and attach to the ordinance index.
+    
+    Runs once in every worker process after it starts, so each worker gets its
+    own HTTP connection pools. With INGEST_ON_STARTUP=false (set by run_server)
+    workers attach read-only to the index built by the parent process instead
+    of rebuilding it themselves.
+    """
+    # Per-worker connection pool to LlamaStack
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=int(os.getenv("LLAMA_STACK_MAX_CONNECTIONS", "32")),
+            max_keepalive_connections=16
+        ),
+        timeout=httpx.Timeout(600.0, connect=5.0)
+    )
+    client = LlamaStackClient(
+        base_url=os.getenv("LLAMA_STACK_URL", "http://localhost:5050"),
+        http_client=http_client
+    )
+    # All inference goes through the dispatcher so it can queue, batch and cap concurrency
+    llm_dispatcher = LLMDispatcher(client=client)
+
+    if os.getenv("INGEST_ON_STARTUP", "true").lower() == "true":
+        db = init_database(collection_name=COLLECTION_NAME)
+    else:
+        db = OrdinanceDBWithTogether(
+            api_key=os.getenv('TOGETHER_API_KEY'),
+            collection_name=COLLECTION_NAME,
+            read_only=True
+        )
+
+    app.state.llm_dispatcher = llm_dispatcher
+    app.state.db = db
+    # Initialize RAG system
+    # Tracing handler from TRACE_EXPORTER, a no-op manager when unset
+    callback_manager = build_callback_manager()
+    app.state.rag = build_rag(db, llm_dispatcher, callback_manager)
+    # One Restack client per worker, job records are shared through JOBS_DB_PATH
+    app.state.jobs = JobManager(
+        client=Restack(),
+        store=JobStore(os.getenv("JOBS_DB_PATH", "data/jobs.sqlite"))
+    )
+    # Chat sessions are shared by the workers through CHAT_SESSIONS_DB_PATH
+    app.state.chat_memory = ChatMemory(
+        dispatcher=llm_dispatcher,
+        model=os.getenv("CHAT_SUMMARY_MODEL", CHAT_MODEL),
+        store=ChatSessionStore(os.getenv("CHAT_SESSIONS_DB_PATH", "data/chat_sessions.sqlite"))
+    )
+    # Workers share metrics through METRICS_DIR (set by run_server)
+    metrics_writer = None
+    if os.getenv("METRICS_DIR"):
+        metrics_writer = SnapshotWriter(
+            os.getenv("METRICS_DIR"), float(os.getenv("METRICS_SNAPSHOT_SECONDS", "5"))
+        ).start()
+    try:
+        yield
+    finally:
+        if metrics_writer is not None:
+            metrics_writer.stop()
+        await app.state.chat_memory.shutdown()
+        await app.state.jobs.shutdown()
+        shutdown_tracing(callback_manager)
+        http_client.close()
+
+app = FastAPI(lifespan=lifespan)
+
+# Bound concurrent LLM work per route, excess requests wait in a short queue
+admission = AdmissionController(limits={
+    "/query": RouteLimit(max_concurrency=8, max_queue=32, timeout=30.0),
+    "/chat": RouteLimit(max_concurrency=8, max_queue=32, timeout=60.0),
+    # Few long-running bulk batches, each bounds its own LLM concurrency
+    "/query/batch": RouteLimit(max_concurrency=2, max_queue=4, timeout=600.0),
+})
+
+def request_timeout(http_request: Request) -> Optional[float]:
+    """Client deadline in seconds from the X-Request-Timeout header"""
+    value = http_request.headers.get("X-Request-Timeout")
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
 
 class OrdinanceQuery(BaseModel):
     query: str
@@ -44,6 +147,9 @@ class OrdinanceQuery(BaseModel):
     city: Optional[str] = None
     filter_conditions: Optional[dict] = None
     stream: Optional[bool] = False
+    # Streaming chunk coalescing, flush_ms=0 sends every token as its own line
+    flush_ms: Optional[float] = 20.0
+    flush_bytes: Optional[int] = 256
 
 
 # Add CORS middleware
@@ -55,6 +161,42 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def route_template(http_request: Request) -> str:
+    """Path template of the matched route, keeps metric label cardinality bounded"""
+    for route in http_request.app.routes:
+        match, _ = route.matches(http_request.scope)
+        if match == Match.FULL:
+            return getattr(route, "path", http_request.url.path)
+    return "unmatched"
+
+@app.middleware("http")
+async def record_metrics(http_request: Request, call_next):
+    """Tag the request's pipeline stages with its route and time the response"""
+    route = route_template(http_request)
+    token = current_route.set(route)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(http_request)
+        status = response.status_code
+        return response
+    finally:
+        HTTP_SECONDS.observe(time.perf_counter() - start, route=route, method=http_request.method)
+        HTTP_REQUESTS.inc(route=route, method=http_request.method, status=str(status))
+        current_route.reset(token)
+
+@app.middleware("http")
+async def assign_request_id(http_request: Request, call_next):
+    """Correlate traces with the request, honouring a client supplied X-Request-ID"""
+    request_id = http_request.headers.get("X-Request-ID") or new_request_id()
+    token = current_request_id.set(request_id)
+    try:
+        response = await call_next(http_request)
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        current_request_id.reset(token)
+
 @app.get("/")
 async def home():
     return "Welcome to the TogetherAI LlamaIndex FastAPI App!"
@@ -62,135 +204,282 @@ async def home():
 
 class ChatRequest(BaseModel):
     message: str
+    # Continues a conversation, a new session is started when unset or expired
+    session_id: Optional[str] = None
+    # Streaming chunk coalescing, flush_ms=0 sends every token as its own line
+    flush_ms: Optional[float] = 20.0
+    flush_bytes: Optional[int] = 256
 
 
 @app.post("/chat")
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
     user_message = request.message
     # TODO: Do request to RAG
 
-    # Use the provided LlamaStack client code snippet
-    response = client.inference.chat_completion(
-        messages=[
-            {"role": "system", "content": "You are a helpful lady. Answer the asked question as faithfully as possible."},
-            {"role": "user", "content": user_message}
-        ],
-        model="Llama3.1-405B-Instruct",
-        stream=True
+    deadline = admission.deadline_for("/chat", request_timeout(http_request))
+    ticket = await admission.acquire("/chat", deadline)
+
+    llm_dispatcher = http_request.app.state.llm_dispatcher
+    chat_memory = http_request.app.state.chat_memory
+    try:
+        session_id = await chat_memory.open(request.session_id)
+        messages = await chat_memory.build_messages(session_id, CHAT_SYSTEM_PROMPT, user_message)
+    except Exception:
+        ticket.release()
+        raise
+    response = llm_dispatcher.stream(
+        messages=messages,
+        model=CHAT_MODEL,
+        priority=Priority.INTERACTIVE,
+        deadline=deadline
     )
-    # Define an async generator to stream each log message
+    # Define an async generator to stream the coalesced tokens
     async def event_generator():
-        async for log in EventLogger().log(response):
-            if hasattr(log, "content"):
-                yield json.dumps({"content": log.content}) + "\n"
+        yield encode_line({"session_id": session_id})
+        reply = []
+        try:
+            async with aclosing(coalesce_tokens(response, request.flush_ms, request.flush_bytes)) as chunks:
+                async for chunk in chunks:
+                    reply.append(chunk)
+                    yield encode_line({"content": chunk})
+        except DeadlineExceeded as e:
+            yield encode_line({"error": str(e)})
+            return
+        # Only finished exchanges are remembered
+        await chat_memory.record(session_id, user_message, "".join(reply))
 
     # Return the StreamingResponse using the async generator
-    return StreamingResponse(event_generator(), media_type="application/json")
+    return StreamingResponse(
+        hold_while_streaming(stop_on_disconnect(http_request, event_generator()), ticket),
+        media_type="application/json",
+        headers={"X-Session-ID": session_id}
+    )
 
 @app.post("/query")
-async def query_ordinances(request: OrdinanceQuery):
+async def query_ordinances(request: OrdinanceQuery, http_request: Request):
+    rag = http_request.app.state.rag
+    deadline = admission.deadline_for("/query", request_timeout(http_request))
+    ticket = await admission.acquire("/query", deadline)
     try:
         if request.stream:
             # Return streaming response
             async def generate():
-                result = await rag.aquery(
-                    query_str=request.query,
-                    state=request.state,
-                    city=request.city,
-                    filter_conditions=request.filter_conditions,
-                    stream=True
-                )
+                try:
+                    result = await rag.aquery(
+                        query_str=request.query,
+                        state=request.state,
+                        city=request.city,
+                        filter_conditions=request.filter_conditions,
+                        stream=True,
+                        deadline=deadline
+                    )
+                except DeadlineExceeded as e:
+                    yield encode_line({"type": "error", "content": str(e)})
+                    return
                
                 # First yield the sources
-                yield json.dumps({
+                yield encode_line({
                     "type": "sources",
                     "content": result["sources"]
-                }) + "\n"
+                })
                
-                # Then yield the content chunks
-                async for chunk in result["generator"]:
-                    yield json.dumps({
-                        "type": "content",
-                        "content": chunk
-                    }) + "\n"
+                # Then yield the coalesced content chunks
+                try:
+                    async with aclosing(coalesce_tokens(
+                        result["generator"], request.flush_ms, request.flush_bytes
+                    )) as chunks:
+                        async for chunk in chunks:
+                            yield encode_line({
+                                "type": "content",
+                                "content": chunk
+                            })
+                except DeadlineExceeded as e:
+                    yield encode_line({"type": "error", "content": str(e)})
            
             return StreamingResponse(
-                generate(),
+                hold_while_streaming(stop_on_disconnect(http_request, generate()), ticket),
                 media_type="application/json"
             )
         else:
             # Return regular response with sources
-            result = await rag.aquery(
-                query_str=request.query,
-                state=request.state,
-                city=request.city,
-                filter_conditions=request.filter_conditions,
-                stream=False
-            )
+            async with ticket:
+                result = await rag.aquery(
+                    query_str=request.query,
+                    state=request.state,
+                    city=request.city,
+                    filter_conditions=request.filter_conditions,
+                    stream=False,
+                    deadline=deadline
+                )
             return {
                 "response": result["answer"],
                 "sources": result["sources"]
             }
            
+    except DeadlineExceeded as e:
+        ticket.release()
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
+        ticket.release()
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/run_parser")
-async def run_parser():
-    try:
-        client = Restack()
-        workflow_id = f"{int(time.time() * 1000)}-llm_complete_workflow"
+MAX_BATCH_ITEMS = 1000
 
-        runId = await client.schedule_workflow(
-            workflow_name="municode_parser",
-            workflow_id=workflow_id,
-        )
-        print("Scheduled workflow", runId)
+class BatchQueryItem(BaseModel):
+    query: str
+    state: Optional[str] = None
+    city: Optional[str] = None
+    filter_conditions: Optional[dict] = None
 
-        result = await client.get_workflow_result(
-            workflow_id=workflow_id,
-            run_id=runId
-        )
+class BatchQueryRequest(BaseModel):
+    items: List[BatchQueryItem]
+    # LLM calls in flight at once for this batch
+    max_concurrency: int = 8
 
-        return {
-            "result": result,
-            "workflow_id": workflow_id,
-            "run_id": runId
-        }
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+@app.post("/query/batch")
+async def query_batch(request: BatchQueryRequest, http_request: Request):
+    """
+    Answer many queries in one request.
+    
+    Streams one NDJSON line per item as it completes, tagged with the item's
+    index, then a final "done" line with the success and failure counts.
+    """
+    if not request.items:
+        raise HTTPException(status_code=400, detail="No items to query")
+    if len(request.items) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_ITEMS} items per batch")
+    
+    rag = http_request.app.state.rag
+    deadline = admission.deadline_for("/query/batch", request_timeout(http_request))
+    ticket = await admission.acquire("/query/batch", deadline)
+    
+    async def generate():
+        succeeded = failed = 0
+        async with aclosing(rag.aquery_batch(
+            [item.model_dump() for item in request.items],
+            max_concurrency=max(1, min(request.max_concurrency, 32)),
+            deadline=deadline
+        )) as results:
+            async for result in results:
+                if "error" in result:
+                    failed += 1
+                    yield encode_line({"type": "error", **result})
+                else:
+                    succeeded += 1
+                    yield encode_line({"type": "result", **result})
+        yield encode_line({"type": "done", "succeeded": succeeded, "failed": failed})
+    
+    return StreamingResponse(
+        hold_while_streaming(stop_on_disconnect(http_request, generate()), ticket),
+        media_type="application/json"
+    )
 
-@app.post("/api/run_campbellca_parser")
-async def run_parser():
-    try:
-        client = Restack()
-        workflow_id = f"{int(time.time() * 1000)}-llm_complete_workflow"
+class SearchRequest(BaseModel):
+    query: str
+    max_results: int = 5
+    state: Optional[str] = None
+    city: Optional[str] = None
+    filter_conditions: Optional[dict] = None
 
-        runId = await client.schedule_workflow(
-            workflow_name="campbellca_parser",
-            workflow_id=workflow_id,
+@app.post("/search")
+async def search(request: SearchRequest, http_request: Request):
+    """Retrieval only, returns the matching ordinances without calling the LLM"""
+    db = http_request.app.state.db
+    try:
+        results = await asyncio.to_thread(
+            db.search_ordinances,
+            query=request.query,
+            max_results=request.max_results,
+            filter_conditions=request.filter_conditions,
+            state=request.state,
+            city=request.city
         )
-        print("Scheduled workflow", runId)
+        return {"results": results}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        result = await client.get_workflow_result(
-            workflow_id=workflow_id,
-            run_id=runId
-        )
+class JobRequest(BaseModel):
+    workflow: str
+    input: Optional[dict] = None
 
-        return {
-            "result": result,
-            "workflow_id": workflow_id,
-            "run_id": runId
-        }
+# Workflows that may be started through the job API
+JOB_WORKFLOWS = {"municode_parser", "campbellca_parser", "hn_workflow"}
+
+async def start_job(http_request: Request, workflow_name: str, workflow_input: Optional[dict] = None):
+    """Schedule a workflow as a background job and point the client at its status"""
+    try:
+        job = await http_request.app.state.jobs.submit(workflow_name, workflow_input)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(
+        status_code=202,
+        content={
+            "job_id": job["id"],
+            "status": job["status"],
+            "workflow_id": job["workflow_id"],
+            "status_url": f"/api/jobs/{job['id']}",
+            "events_url": f"/api/jobs/{job['id']}/events",
+            "result_url": f"/api/jobs/{job['id']}/result"
+        },
+        headers={"Location": f"/api/jobs/{job['id']}"}
+    )
+
+async def get_job(http_request: Request, job_id: str) -> dict:
+    job = await http_request.app.state.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/api/jobs")
+async def create_job(request: JobRequest, http_request: Request):
+    if request.workflow not in JOB_WORKFLOWS:
+        raise HTTPException(status_code=400, detail=f"Unknown workflow {request.workflow}")
+    return await start_job(http_request, request.workflow, request.input)
+
+@app.get("/api/jobs")
+async def list_jobs(http_request: Request, limit: int = 50):
+    jobs = await http_request.app.state.jobs.list(limit=min(limit, 500))
+    return [{k: v for k, v in job.items() if k != "result"} for job in jobs]
+
+@app.get("/api/jobs/{job_id}")
+async def job_status(job_id: str, http_request: Request):
+    """Status and progress of a job, the result is fetched separately"""
+    job = await get_job(http_request, job_id)
+    return {k: v for k, v in job.items() if k != "result"}
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str, http_request: Request):
+    """Server-sent status events until the job finishes"""
+    await get_job(http_request, job_id)
+    return StreamingResponse(
+        stop_on_disconnect(http_request, http_request.app.state.jobs.events(job_id)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
+@app.get("/api/jobs/{job_id}/result")
+async def job_result(job_id: str, http_request: Request):
+    """The workflow result, 202 while the job is still running"""
+    job = await get_job(http_request, job_id)
+    if job["status"] == "succeeded":
+        return {"job_id": job_id, "status": job["status"], "result": job["result"], "run_id": job["run_id"]}
+    if job["status"] == "failed":
+        return JSONResponse(status_code=500, content={"job_id": job_id, "status": job["status"], "error": job["error"]})
+    return JSONResponse(status_code=202, content={"job_id": job_id, "status": job["status"]})
+
+@app.post("/api/run_parser")
+async def run_parser(http_request: Request):
+    return await start_job(http_request, "municode_parser")
+
+@app.post("/api/run_campbellca_parser")
+async def run_campbellca_parser(http_request: Request):
+    return await start_job(http_request, "campbellca_parser")
 
 
 @app.post("/api/schedule")
-async def schedule_workflow(request: QueryRequest):
+async def schedule_workflow(request: QueryRequest, http_request: Request):
     try:
-        response = client.inference.chat_completion(
+        response = await http_request.app.state.llm_dispatcher.complete(
             messages=[
                 {"role": "system", "content": "You are a helpful assistant."},
                 {"role": "user", "content": "Write a two-sentence poem about llama."}
@@ -199,14 +488,55 @@ async def schedule_workflow(request: QueryRequest):
         )
 
         return {
-            "result": response.completion_message.content
+            "result": response
         }
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.get("/llm/stats")
+async def llm_stats(http_request: Request):
+    """Queue depth, in-flight requests and wait times of the LLM dispatcher"""
+    return http_request.app.state.llm_dispatcher.stats()
+
+@app.get("/admission/stats")
+async def admission_stats():
+    """Active, queued and rejected requests per route"""
+    return admission.stats()
+
+@app.get("/metrics")
+async def metrics():
+    """Per-stage latency histograms and counters in Prometheus text format, summed over workers"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 # Remove Flask-specific run code since FastAPI uses uvicorn
 def run_app():
     uvicorn.run("src.app:app", host="0.0.0.0", port=8000, reload=True)
 
+def run_server():
+    """
+    Production server with several worker processes sharing one index.
+    
+    The index is built once here, before the workers start, unless
+    --skip-ingest is given. Workers then attach to it read-only, so they
+    never race on recreating the collection. Set CHROMA_MODE=persistent and
+    CHROMA_PATH to serve from an on-disk snapshot instead of the Chroma server.
+    """
+    parser = argparse.ArgumentParser(description="Run the API with multiple workers")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("APP_WORKERS", os.cpu_count() or 1)))
+    parser.add_argument("--skip-ingest", action="store_true", help="Serve the existing index as is")
+    args = parser.parse_args()
+
+    if not args.skip_ingest:
+        init_database(collection_name=COLLECTION_NAME)
+
+    # Inherited by the worker processes
+    os.environ["INGEST_ON_STARTUP"] = "false"
+    # Any worker answers /metrics with the totals of all workers
+    os.environ.setdefault("METRICS_DIR", "data/metrics")
+    clear_snapshots(os.environ["METRICS_DIR"])
+    uvicorn.run("src.app:app", host=args.host, port=args.port, workers=args.workers)
+
 if __name__ == '__main__':
     run_app()
@@ -0,0 +1,112 @@
+# bench_streaming.py
+import argparse
+import asyncio
+import json
+import time
+from typing import AsyncIterator, Dict
+
+from fastapi.responses import StreamingResponse
+
+from src.streaming import coalesce_tokens, encode_line, orjson
+
+
+async def token_source(num_tokens: int) -> AsyncIterator[str]:
+    """Synthetic LLM stream of short word tokens"""
+    words = ["The ", "permit ", "shall ", "be ", "issued ", "within ", "thirty ", "days. "]
+    for i in range(num_tokens):
+        yield words[i % len(words)]
+        if i % 64 == 0:
+            await asyncio.sleep(0)
+
+
+async def baseline_body(num_tokens: int):
+    """Previous behaviour: one json.dumps and one chunk per token"""
+    async for token in token_source(num_tokens):
+        yield json.dumps({"type": "content", "content": token}) + "\n"
+
+
+async def optimized_body(num_tokens: int, flush_ms: float, flush_bytes: int):
+    async for chunk in coalesce_tokens(token_source(num_tokens), flush_ms, flush_bytes):
+        yield encode_line({"type": "content", "content": chunk})
+
+
+async def drive(body) -> Dict[str, int]:
+    """Run a StreamingResponse through a minimal ASGI send/receive pair"""
+    counters = {"messages": 0, "bytes": 0}
+    disconnected = asyncio.Event()
+
+    async def receive():
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            counters["messages"] += 1
+            counters["bytes"] += len(message.get("body", b""))
+
+    scope = {"type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "method": "POST", "path": "/query", "headers": []}
+    await StreamingResponse(body, media_type="application/json")(scope, receive, send)
+    disconnected.set()
+    return counters
+
+
+async def run_mode(mode: str, num_tokens: int, concurrency: int, flush_ms: float, flush_bytes: int) -> Dict:
+    def make_body():
+        if mode == "baseline":
+            return baseline_body(num_tokens)
+        return optimized_body(num_tokens, flush_ms, flush_bytes)
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    results = await asyncio.gather(*[drive(make_body()) for _ in range(concurrency)])
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    total_tokens = num_tokens * concurrency
+    return {
+        "mode": mode,
+        "tokens": total_tokens,
+        "asgi_messages": sum(r["messages"] for r in results),
+        "bytes": sum(r["bytes"] for r in results),
+        "wall_s": wall,
+        "cpu_s": cpu,
+        "tokens_per_cpu_sec": total_tokens / cpu if cpu else 0.0
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark NDJSON streaming with and without coalescing")
+    parser.add_argument("--tokens", type=int, default=2000, help="Tokens per stream")
+    parser.add_argument("--concurrency", type=int, default=64, help="Concurrent streams")
+    parser.add_argument("--flush-ms", type=float, default=20.0)
+    parser.add_argument("--flush-bytes", type=int, default=256)
+    parser.add_argument("--output", default=None, help="Optional JSON report path")
+    args = parser.parse_args()
+
+    report = {
+        "config": vars(args),
+        "encoder": "orjson" if orjson is not None else "json",
+        "results": []
+    }
+    for mode in ("baseline", "optimized"):
+        result = await run_mode(mode, args.tokens, args.concurrency, args.flush_ms, args.flush_bytes)
+        report["results"].append(result)
+        print(
+            f"{mode:10} {result['tokens_per_cpu_sec']:>12,.0f} tokens/cpu-sec  "
+            f"{result['asgi_messages']:>8} ASGI sends  {result['bytes']:>10} bytes"
+        )
+
+    baseline, optimized = report["results"]
+    report["speedup"] = (
+        optimized["tokens_per_cpu_sec"] / baseline["tokens_per_cpu_sec"]
+        if baseline["tokens_per_cpu_sec"] else 0.0
+    )
+    print(f"Speedup per core: {report['speedup']:.2f}x (encoder: {report['encoder']})")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
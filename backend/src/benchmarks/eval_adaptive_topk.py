@@ -0,0 +1,187 @@
+# eval_adaptive_topk.py
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+from typing import Dict, List
+
+from dotenv import load_dotenv
+from llama_stack_client import LlamaStackClient
+
+from src.llm_dispatcher import LLMDispatcher
+from src.ordinance_db import OrdinanceDBWithTogether
+from src.rag import OrdinanceRAG
+
+load_dotenv()
+
+# Fixed query set, each with keywords a complete answer is expected to mention
+QUERIES = [
+    {"query": "What are the parking requirements for residential areas?", "state": "CA", "city": None,
+     "keywords": ["parking", "residential", "spaces"]},
+    {"query": "What are the fire safety requirements for new buildings?", "state": "CA", "city": None,
+     "keywords": ["fire", "building", "code"]},
+    {"query": "What are the business license requirements?", "state": "CA", "city": None,
+     "keywords": ["business", "license", "fee"]},
+    {"query": "When is a building permit required?", "state": "CA", "city": None,
+     "keywords": ["permit", "building", "required"]},
+    {"query": "What are the rules for keeping animals within city limits?", "state": "CA", "city": None,
+     "keywords": ["animal", "dog", "license"]},
+    {"query": "What noise levels are allowed at night?", "state": "CA", "city": None,
+     "keywords": ["noise", "hours", "p.m."]},
+    {"query": "How is the city council organized?", "state": "CA", "city": None,
+     "keywords": ["council", "mayor", "meeting"]},
+    {"query": "What are the requirements for swimming pool fences?", "state": "FL", "city": None,
+     "keywords": ["pool", "fence", "barrier"]},
+    {"query": "What are the setback requirements in residential zones?", "state": "FL", "city": None,
+     "keywords": ["setback", "feet", "yard"]},
+    {"query": "How are code violations enforced and fined?", "state": "FL", "city": None,
+     "keywords": ["violation", "fine", "enforcement"]},
+]
+
+
+def _tokens(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9]+", (text or "").lower())
+
+
+def token_f1(prediction: str, reference: str) -> float:
+    """Token overlap F1 between two answers"""
+    pred, ref = _tokens(prediction), _tokens(reference)
+    if not pred or not ref:
+        return 0.0
+    ref_counts: Dict[str, int] = {}
+    for t in ref:
+        ref_counts[t] = ref_counts.get(t, 0) + 1
+    common = 0
+    for t in pred:
+        if ref_counts.get(t, 0) > 0:
+            common += 1
+            ref_counts[t] -= 1
+    if common == 0:
+        return 0.0
+    precision = common / len(pred)
+    recall = common / len(ref)
+    return 2 * precision * recall / (precision + recall)
+
+
+def keyword_recall(answer: str, keywords: List[str]) -> float:
+    """Fraction of expected keywords present in the answer"""
+    if not keywords:
+        return 1.0
+    lowered = (answer or "").lower()
+    return sum(1 for k in keywords if k.lower() in lowered) / len(keywords)
+
+
+async def run_query(rag: OrdinanceRAG, item: Dict) -> Dict:
+    start = time.perf_counter()
+    result = await rag.aquery(
+        query_str=item["query"],
+        state=item["state"],
+        city=item["city"],
+        stream=False
+    )
+    return {
+        "latency_s": time.perf_counter() - start,
+        "prompt_tokens": result["prompt_tokens"],
+        "num_sources": len(result["sources"]),
+        "source_ids": [s["id"] for s in result["sources"]],
+        "answer": result["answer"]
+    }
+
+
+async def evaluate(baseline: OrdinanceRAG, adaptive: OrdinanceRAG, queries: List[Dict]) -> Dict:
+    """Run every query through both systems and compare cost against quality"""
+    per_query = []
+    for item in queries:
+        base = await run_query(baseline, item)
+        adapt = await run_query(adaptive, item)
+        overlap = len(set(adapt["source_ids"]) & set(base["source_ids"]))
+        per_query.append({
+            "query": item["query"],
+            "baseline": {k: v for k, v in base.items() if k != "answer"},
+            "adaptive": {k: v for k, v in adapt.items() if k != "answer"},
+            "answer_f1_vs_baseline": token_f1(adapt["answer"], base["answer"]),
+            "keyword_recall": {
+                "baseline": keyword_recall(base["answer"], item["keywords"]),
+                "adaptive": keyword_recall(adapt["answer"], item["keywords"])
+            },
+            "source_overlap": overlap / max(1, len(adapt["source_ids"]))
+        })
+        print(
+            f"{item['query'][:50]:50} "
+            f"docs {base['num_sources']}->{adapt['num_sources']} "
+            f"tokens {base['prompt_tokens']}->{adapt['prompt_tokens']}"
+        )
+
+    def mean(values):
+        values = list(values)
+        return sum(values) / len(values) if values else 0.0
+
+    base_tokens = sum(q["baseline"]["prompt_tokens"] for q in per_query)
+    adapt_tokens = sum(q["adaptive"]["prompt_tokens"] for q in per_query)
+    base_latency = sum(q["baseline"]["latency_s"] for q in per_query)
+    adapt_latency = sum(q["adaptive"]["latency_s"] for q in per_query)
+    return {
+        "summary": {
+            "queries": len(per_query),
+            "prompt_tokens": {"baseline": base_tokens, "adaptive": adapt_tokens},
+            "prompt_tokens_saved_pct": 100 * (1 - adapt_tokens / base_tokens) if base_tokens else 0.0,
+            "latency_s": {"baseline": base_latency, "adaptive": adapt_latency},
+            "latency_saved_pct": 100 * (1 - adapt_latency / base_latency) if base_latency else 0.0,
+            "mean_docs": {
+                "baseline": mean(q["baseline"]["num_sources"] for q in per_query),
+                "adaptive": mean(q["adaptive"]["num_sources"] for q in per_query)
+            },
+            "mean_answer_f1_vs_baseline": mean(q["answer_f1_vs_baseline"] for q in per_query),
+            "mean_keyword_recall": {
+                "baseline": mean(q["keyword_recall"]["baseline"] for q in per_query),
+                "adaptive": mean(q["keyword_recall"]["adaptive"] for q in per_query)
+            }
+        },
+        "queries": per_query
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Compare fixed top-k against adaptive top-k retrieval")
+    parser.add_argument("--collection", default="combined_ordinances")
+    parser.add_argument("--llama-url", default="http://localhost:5050")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--min-k", type=int, default=1)
+    parser.add_argument("--max-k", type=int, default=10)
+    parser.add_argument("--threshold", type=float, default=0.85)
+    parser.add_argument("--output", default="adaptive_topk_eval.json")
+    args = parser.parse_args()
+
+    db = OrdinanceDBWithTogether(
+        api_key=os.getenv('TOGETHER_API_KEY'),
+        collection_name=args.collection
+    )
+    dispatcher = LLMDispatcher(client=LlamaStackClient(base_url=args.llama_url))
+    baseline = OrdinanceRAG(ordinance_db=db, dispatcher=dispatcher, top_k=args.top_k)
+    adaptive = OrdinanceRAG(
+        ordinance_db=db,
+        dispatcher=dispatcher,
+        adaptive_top_k=True,
+        min_k=args.min_k,
+        max_k=args.max_k,
+        score_threshold=args.threshold
+    )
+
+    report = await evaluate(baseline, adaptive, QUERIES)
+    report["config"] = vars(args)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    summary = report["summary"]
+    print("\n=== Adaptive top-k evaluation ===")
+    print(f"Prompt tokens saved: {summary['prompt_tokens_saved_pct']:.1f}%")
+    print(f"Latency saved: {summary['latency_saved_pct']:.1f}%")
+    print(f"Answer F1 vs baseline: {summary['mean_answer_f1_vs_baseline']:.3f}")
+    print(f"Keyword recall: {summary['mean_keyword_recall']}")
+    print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
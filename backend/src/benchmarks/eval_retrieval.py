@@ -0,0 +1,247 @@
+# eval_retrieval.py
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+from itertools import product
+from typing import Dict, List
+
+from dotenv import load_dotenv
+
+from src.benchmarks.fake_together import FakeTogetherServer
+from src.ordinance_format import SUFFIX, iter_ordinances
+from src.rag import adaptive_cutoff
+
+load_dotenv()
+
+DEFAULT_QUERIES = os.path.join(os.path.dirname(__file__), "retrieval_queries.json")
+COLLECTION_PREFIX = "retrieval_bench"
+FILTERS = ("none", "state", "city")
+MODES = ("vector", "adaptive")
+
+
+def recall_at_k(retrieved: List[str], relevant: List[str], k: int) -> float:
+    """Fraction of the relevant sections found in the first k results"""
+    if not relevant:
+        return 0.0
+    return len(set(retrieved[:k]) & set(relevant)) / len(set(relevant))
+
+
+def reciprocal_rank(retrieved: List[str], relevant: List[str]) -> float:
+    for rank, section in enumerate(retrieved, start=1):
+        if section in relevant:
+            return 1.0 / rank
+    return 0.0
+
+
+def load_corpus(paths: List[str]) -> List[Dict]:
+    """
+    Ordinance sections of Municode Excel exports or of the intermediate files
+    parser.extract_ordinance_metadata writes next to them.
+
+    Excel exports go through parser.open_ordinances, so a corpus parsed
+    before is read back from the parse cache.
+    """
+    ordinances = []
+    for path in paths:
+        if path.endswith(SUFFIX):
+            ordinances.extend(iter_ordinances(path))
+        else:
+            from src.parser import open_ordinances
+
+            parsed, _ = open_ordinances(path)
+            ordinances.extend(parsed)
+    return [o for o in ordinances if o.get("content") and o["metadata"].get("section")]
+
+
+def build_index(db, ordinances: List[Dict], embeddings: List[List[float]], hnsw_m: int, search_ef: int):
+    """One collection per index configuration, sharing precomputed embeddings"""
+    name = f"{COLLECTION_PREFIX}_m{hnsw_m}_ef{search_ef}"
+    try:
+        db.client.delete_collection(name)
+    except Exception:
+        pass
+    collection = db.client.create_collection(
+        name=name,
+        embedding_function=db.embedding_function,
+        metadata={
+            "hnsw:space": "cosine",
+            "hnsw:M": hnsw_m,
+            "hnsw:construction_ef": max(100, search_ef),
+            "hnsw:search_ef": search_ef
+        }
+    )
+    documents = [db._format_document(o) for o in ordinances]
+    for i in range(0, len(ordinances), 100):
+        collection.add(
+            ids=[f"doc-{j}" for j in range(i, min(i + 100, len(ordinances)))],
+            documents=documents[i:i + 100],
+            metadatas=[o["metadata"] for o in ordinances[i:i + 100]],
+            embeddings=embeddings[i:i + 100]
+        )
+    return name
+
+
+def run_config(
+    db,
+    queries: List[Dict],
+    state: str,
+    city: str,
+    top_k: int,
+    filter_name: str,
+    mode: str,
+    max_k: int,
+    score_threshold: float,
+    repeats: int
+) -> Dict:
+    """Recall, MRR and latency of one configuration over the labeled queries"""
+    filters = {
+        "none": {},
+        "state": {"state": state},
+        "city": {"state": state, "city": city},
+    }[filter_name]
+    per_query = []
+    for item in queries:
+        latencies = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            results = db.search_ordinances(
+                query=item["query"],
+                max_results=max_k if mode == "adaptive" else top_k,
+                **filters
+            )
+            if mode == "adaptive":
+                keep = adaptive_cutoff(
+                    [r["relevance_score"] for r in results],
+                    max_k=max_k,
+                    score_threshold=score_threshold
+                )
+                results = results[:keep]
+            latencies.append(time.perf_counter() - start)
+        retrieved = [r["metadata"].get("section") for r in results]
+        per_query.append({
+            "query": item["query"],
+            "retrieved": retrieved,
+            "recall": recall_at_k(retrieved, item["relevant"], len(retrieved)),
+            "reciprocal_rank": reciprocal_rank(retrieved, item["relevant"]),
+            "latency_ms": statistics.median(latencies) * 1000
+        })
+
+    latencies = sorted(q["latency_ms"] for q in per_query)
+    return {
+        "top_k": top_k,
+        "filter": filter_name,
+        "mode": mode,
+        "recall_at_k": statistics.mean(q["recall"] for q in per_query),
+        "mrr": statistics.mean(q["reciprocal_rank"] for q in per_query),
+        "avg_results": statistics.mean(len(q["retrieved"]) for q in per_query),
+        "latency_p50_ms": latencies[len(latencies) // 2],
+        "latency_p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "queries": per_query
+    }
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall versus latency benchmark for ordinance retrieval")
+    parser.add_argument("--queries", default=DEFAULT_QUERIES, help="Labeled query set JSON")
+    parser.add_argument("--extra-corpus", nargs="*", default=[], help="More Excel exports or parsed ordinance files added as distractors")
+    parser.add_argument("--top-k", type=_int_list, default=[1, 3, 5, 10])
+    parser.add_argument("--hnsw-m", type=_int_list, default=[16, 32])
+    parser.add_argument("--search-ef", type=_int_list, default=[10, 50, 100])
+    parser.add_argument("--filters", nargs="*", default=list(FILTERS), choices=FILTERS)
+    parser.add_argument("--modes", nargs="*", default=list(MODES), choices=MODES)
+    parser.add_argument("--max-k", type=int, default=10, help="Candidates fetched in adaptive mode")
+    parser.add_argument("--score-threshold", type=float, default=0.85)
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per query, the median is reported")
+    parser.add_argument("--fake-embeddings", action="store_true", help="Use deterministic local embeddings")
+    parser.add_argument("--use-env-chroma", action="store_true", help="Use CHROMA_MODE/CHROMA_* instead of a temporary index")
+    parser.add_argument("--output", default="retrieval_benchmark.json")
+    args = parser.parse_args()
+
+    with open(args.queries) as f:
+        labeled = json.load(f)
+
+    together = None
+    if args.fake_embeddings:
+        together = FakeTogetherServer(latency=0.0).start()
+        os.environ["TOGETHER_BASE_URL"] = together.base_url
+        os.environ.setdefault("TOGETHER_API_KEY", "fake")
+    chroma_dir = None
+    if not args.use_env_chroma:
+        chroma_dir = tempfile.TemporaryDirectory(prefix="retrieval-bench-")
+        os.environ["CHROMA_MODE"] = "persistent"
+        os.environ["CHROMA_PATH"] = chroma_dir.name
+
+    from src.ordinance_db import OrdinanceDBWithTogether
+
+    try:
+        ordinances = load_corpus([labeled["corpus"]] + args.extra_corpus)
+        loader = OrdinanceDBWithTogether(
+            api_key=os.getenv("TOGETHER_API_KEY"),
+            collection_name=f"{COLLECTION_PREFIX}_loader"
+        )
+        start = time.perf_counter()
+        embeddings = loader.embedding_function([loader._format_document(o) for o in ordinances])
+        print(f"Embedded {len(ordinances)} sections in {time.perf_counter() - start:.1f}s")
+
+        report = {
+            "queries_file": args.queries,
+            "corpus_sections": len(ordinances),
+            "embedding_model": loader.model_name,
+            "fake_embeddings": args.fake_embeddings,
+            "results": []
+        }
+        for hnsw_m, search_ef in product(args.hnsw_m, args.search_ef):
+            name = build_index(loader, ordinances, embeddings, hnsw_m, search_ef)
+            db = OrdinanceDBWithTogether(
+                api_key=os.getenv("TOGETHER_API_KEY"),
+                collection_name=name,
+                read_only=True
+            )
+            # Warm the query embedding cache so latency measures the index, not Together
+            for item in labeled["queries"]:
+                db.search_ordinances(item["query"], max_results=1)
+
+            for mode, filter_name, top_k in product(args.modes, args.filters, args.top_k):
+                if mode == "adaptive" and top_k != args.top_k[0]:
+                    continue  # Adaptive mode picks its own k
+                result = run_config(
+                    db,
+                    labeled["queries"],
+                    labeled["state"],
+                    labeled["city"],
+                    top_k,
+                    filter_name,
+                    mode,
+                    args.max_k,
+                    args.score_threshold,
+                    args.repeats
+                )
+                result.update({"hnsw_m": hnsw_m, "search_ef": search_ef})
+                report["results"].append(result)
+                print(
+                    f"M={hnsw_m:<3} ef={search_ef:<4} {mode:8} filter={filter_name:5} k={top_k if mode == 'vector' else 'auto':<4} "
+                    f"recall {result['recall_at_k']:.3f}  MRR {result['mrr']:.3f}  "
+                    f"p50 {result['latency_p50_ms']:.2f}ms  p95 {result['latency_p95_ms']:.2f}ms"
+                )
+            loader.client.delete_collection(name)
+        loader.delete_collection()
+    finally:
+        if together is not None:
+            together.stop()
+        if chroma_dir is not None:
+            chroma_dir.cleanup()
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(report['results'])} configurations to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+# fake_llama_stack.py
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+WORDS = (
+    "the city council may adopt regulations for parking permits zoning "
+    "setbacks fire safety business licenses and building inspections"
+).split()
+
+
+class FakeLlamaStackServer:
+    """
+    Local stand-in for the LlamaStack inference API.
+
+    Serves /inference/chat_completion (streaming and not) and
+    /batch_inference/chat_completion with a configurable time to first token
+    and token rate, and records how each stream ended so tests can check that
+    cancelled clients stop generation.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        ttft: float = 0.05,
+        tokens_per_sec: float = 200.0,
+        num_tokens: int = 64
+    ):
+        """
+        Args:
+            host: Interface to bind
+            port: Port to bind, 0 picks a free one
+            ttft: Seconds before the first token
+            tokens_per_sec: Streaming rate after the first token
+            num_tokens: Tokens per answer unless sampling_params.max_tokens is lower
+        """
+        self.ttft = ttft
+        self.tokens_per_sec = tokens_per_sec
+        self.num_tokens = num_tokens
+
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.streams_completed = 0
+        self.streams_aborted = 0
+        self.tokens_sent = 0
+        self.abort_times: List[float] = []
+
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeLlamaStackServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "streams_completed": self.streams_completed,
+                "streams_aborted": self.streams_aborted,
+                "tokens_sent": self.tokens_sent
+            }
+
+    def _answer_tokens(self, body: Dict) -> List[str]:
+        count = self.num_tokens
+        max_tokens = (body.get("sampling_params") or {}).get("max_tokens")
+        if max_tokens:
+            count = min(count, int(max_tokens))
+        return [WORDS[i % len(WORDS)] + " " for i in range(count)]
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _read_json(self) -> Dict:
+                length = int(self.headers.get("Content-Length", 0))
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def _send_json(self, payload: Dict, status: int = 200):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _completion(self, tokens: List[str]) -> Dict:
+                return {
+                    "role": "assistant",
+                    "content": "".join(tokens),
+                    "stop_reason": "end_of_turn",
+                    "tool_calls": []
+                }
+
+            def do_POST(self):
+                body = self._read_json()
+                with fake.lock:
+                    fake.requests += 1
+
+                if self.path.endswith("/batch_inference/chat_completion"):
+                    time.sleep(fake.ttft)
+                    batch = [self._completion(fake._answer_tokens(body)) for _ in body.get("messages_batch", [])]
+                    self._send_json({"completion_message_batch": batch})
+                elif self.path.endswith("/inference/chat_completion"):
+                    tokens = fake._answer_tokens(body)
+                    if body.get("stream"):
+                        self._stream(tokens)
+                    else:
+                        time.sleep(fake.ttft + len(tokens) / fake.tokens_per_sec)
+                        self._send_json({"completion_message": self._completion(tokens)})
+                else:
+                    self._send_json({"detail": "Not found"}, status=404)
+
+            def _event(self, event: Dict):
+                data = f"data: {json.dumps({'event': event})}\n\n".encode()
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def _stream(self, tokens: List[str]):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    self._event({"event_type": "start", "delta": ""})
+                    time.sleep(fake.ttft)
+                    for token in tokens:
+                        self._event({"event_type": "progress", "delta": token})
+                        with fake.lock:
+                            fake.tokens_sent += 1
+                        time.sleep(1.0 / fake.tokens_per_sec)
+                    self._event({"event_type": "complete", "delta": "", "stop_reason": "end_of_turn"})
+                    self.wfile.write(b"0\r\n\r\n")
+                    self.wfile.flush()
+                    with fake.lock:
+                        fake.streams_completed += 1
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client went away, stop generating
+                    with fake.lock:
+                        fake.streams_aborted += 1
+                        fake.abort_times.append(time.monotonic())
+                    self.close_connection = True
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake LlamaStack inference server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5050)
+    parser.add_argument("--ttft", type=float, default=0.3, help="Seconds to first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=50.0)
+    parser.add_argument("--num-tokens", type=int, default=256)
+    args = parser.parse_args()
+
+    server = FakeLlamaStackServer(
+        host=args.host,
+        port=args.port,
+        ttft=args.ttft,
+        tokens_per_sec=args.tokens_per_sec,
+        num_tokens=args.num_tokens
+    )
+    print(f"Fake LlamaStack listening on {server.url}")
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
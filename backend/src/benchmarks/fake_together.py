@@ -0,0 +1,157 @@
+# fake_together.py
+import argparse
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+
+def deterministic_embedding(text: str, dim: int = 768) -> List[float]:
+    """
+    Unit vector from hashed word counts.
+
+    The same text always gets the same vector and texts sharing words get
+    similar ones, so retrieval over a synthetic corpus still ranks sensibly.
+    """
+    vector = [0.0] * dim
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        digest = hashlib.blake2b(word.encode(), digest_size=8).digest()
+        index = int.from_bytes(digest[:4], "little") % dim
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector))
+    if norm == 0.0:
+        vector[0] = 1.0
+        return vector
+    return [v / norm for v in vector]
+
+
+class FakeTogetherServer:
+    """
+    Local stand-in for the Together embeddings API.
+
+    Serves POST /v1/embeddings with deterministic vectors and a configurable
+    latency. Point TogetherEmbeddingFunction at it with TOGETHER_BASE_URL.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.02,
+        dim: int = 768
+    ):
+        """
+        Args:
+            host: Interface to bind
+            port: Port to bind, 0 picks a free one
+            latency: Seconds added to every request
+            dim: Embedding dimension
+        """
+        self.latency = latency
+        self.dim = dim
+
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.texts_embedded = 0
+
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def base_url(self) -> str:
+        """Value for TOGETHER_BASE_URL"""
+        return f"{self.url}/v1"
+
+    def start(self) -> "FakeTogetherServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {"requests": self.requests, "texts_embedded": self.texts_embedded}
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, payload: Dict, status: int = 200):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if not self.path.endswith("/embeddings"):
+                    self._send_json({"error": {"message": "Not found"}}, status=404)
+                    return
+
+                texts = body.get("input", [])
+                if isinstance(texts, str):
+                    texts = [texts]
+                time.sleep(fake.latency)
+                with fake.lock:
+                    fake.requests += 1
+                    fake.texts_embedded += len(texts)
+                self._send_json({
+                    "id": f"fake-{fake.requests}",
+                    "object": "list",
+                    "model": body.get("model", ""),
+                    "data": [
+                        {"index": i, "object": "embedding", "embedding": deterministic_embedding(text, fake.dim)}
+                        for i, text in enumerate(texts)
+                    ]
+                })
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake Together embeddings server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5060)
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds per request")
+    parser.add_argument("--dim", type=int, default=768)
+    args = parser.parse_args()
+
+    server = FakeTogetherServer(host=args.host, port=args.port, latency=args.latency, dim=args.dim)
+    print(f"Fake Together listening on {server.url}, set TOGETHER_BASE_URL={server.base_url}")
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+# load_test.py
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from src.benchmarks.fake_llama_stack import FakeLlamaStackServer
+from src.benchmarks.fake_together import FakeTogetherServer
+
+COLLECTION_NAME = "combined_ordinances"
+
+CITIES = [("CA", "California City"), ("CA", "Campbell"), ("FL", "Miami"), ("TX", "Austin")]
+TOPICS = [
+    ("Parking", "Residential parking", "Each dwelling unit shall provide two off-street parking spaces in a garage or carport."),
+    ("Fire", "Fire safety", "New buildings shall install automatic fire sprinklers and keep fire lanes clear at all times."),
+    ("Business", "Business licenses", "No person shall conduct a business in the city without a business license and annual fee."),
+    ("Building", "Building permits", "A building permit is required before constructing, altering or demolishing any structure."),
+    ("Animals", "Animal control", "Every dog over four months old shall be licensed and kept on a leash off the owner's premises."),
+    ("Noise", "Noise control", "Amplified sound above fifty decibels is prohibited between ten p.m. and seven a.m."),
+    ("Zoning", "Setbacks", "Residential structures shall maintain a front yard setback of twenty feet and side yards of five feet."),
+    ("Pools", "Swimming pools", "Swimming pools shall be enclosed by a barrier or fence at least five feet high with a self-latching gate."),
+]
+
+QUERIES = [
+    "What are the parking requirements for residential areas?",
+    "What are the fire safety requirements for new buildings?",
+    "Do I need a business license?",
+    "When is a building permit required?",
+    "Do dogs need to be licensed?",
+    "What noise levels are allowed at night?",
+    "What are the setback requirements in residential zones?",
+    "What fence is required around a swimming pool?",
+]
+
+
+def synthetic_ordinances(sections_per_topic: int = 5) -> List[Dict]:
+    """Small ordinance corpus with the metadata fields the index expects"""
+    ordinances = []
+    for state, city in CITIES:
+        for chapter, (title, subtitle, text) in enumerate(TOPICS, start=1):
+            for n in range(1, sections_per_topic + 1):
+                section = f"{chapter}.{n:02d}"
+                ordinances.append({
+                    "content": f"{text} Section {section} applies in {city}.",
+                    "metadata": {
+                        "state": state,
+                        "city": city,
+                        "title": title,
+                        "chapter": str(chapter),
+                        "section": section,
+                        "subtitle": subtitle,
+                        "url": f"https://example.org/{state}/{city.replace(' ', '')}/{section}"
+                    }
+                })
+    return ordinances
+
+
+def seed_index(chroma_path: str, sections_per_topic: int):
+    """Build the local Chroma index the app attaches to, using the fake embeddings"""
+    from src.ordinance_db import OrdinanceDBWithTogether
+
+    db = OrdinanceDBWithTogether(
+        api_key=os.environ["TOGETHER_API_KEY"],
+        collection_name=COLLECTION_NAME,
+        force_recreate=True
+    )
+    db.add_ordinances(synthetic_ordinances(sections_per_topic))
+    print(f"Seeded {db.collection.count()} sections into {chroma_path}")
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile, None for no samples"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(samples: List[Dict], duration: float) -> Dict:
+    """Latency, time to first token and errors for one route"""
+    ok = [s for s in samples if not s["error"]]
+    latencies = [s["latency"] for s in ok]
+    ttfts = [s["ttft"] for s in ok if s["ttft"] is not None]
+    errors: Dict[str, int] = {}
+    for s in samples:
+        if s["error"]:
+            errors[s["error"]] = errors.get(s["error"], 0) + 1
+    summary = {
+        "requests": len(samples),
+        "achieved_rps": len(samples) / duration if duration else 0.0,
+        "errors": errors,
+        "error_rate": (len(samples) - len(ok)) / len(samples) if samples else 0.0,
+    }
+    for name, values in (("latency", latencies), ("ttft", ttfts)):
+        for q in (50, 95, 99):
+            value = percentile(values, q)
+            summary[f"{name}_p{q}_ms"] = value * 1000 if value is not None else None
+    return summary
+
+
+async def timed_stream(client: httpx.AsyncClient, route: str, payload: Dict, timeout: float) -> Dict:
+    """Send one streaming request, recording total latency and time to first content line"""
+    start = time.perf_counter()
+    sample = {"route": route, "latency": None, "ttft": None, "error": None}
+    try:
+        async with client.stream("POST", route, json=payload, timeout=timeout) as response:
+            if response.status_code != 200:
+                sample["error"] = f"http_{response.status_code}"
+                await response.aread()
+                return sample
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                message = json.loads(line)
+                if message.get("type") == "error" or "error" in message:
+                    sample["error"] = "stream_error"
+                elif sample["ttft"] is None and message.get("type", "content") == "content" and "content" in message:
+                    sample["ttft"] = time.perf_counter() - start
+        sample["latency"] = time.perf_counter() - start
+    except httpx.TimeoutException:
+        sample["error"] = "timeout"
+    except Exception as e:
+        sample["error"] = type(e).__name__
+    return sample
+
+
+async def generate_load(
+    app_url: str,
+    rps: float,
+    duration: float,
+    chat_ratio: float,
+    timeout: float,
+    seed: int = 0
+) -> Dict:
+    """
+    Open-loop load at a fixed arrival rate.
+
+    Requests are started on schedule whether or not earlier ones finished, so
+    a slow server shows up as growing latency instead of a lower send rate.
+    """
+    rng = random.Random(seed)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=256)
+    async with httpx.AsyncClient(base_url=app_url, limits=limits) as client:
+        tasks = []
+        start = time.perf_counter()
+        for i in range(int(rps * duration)):
+            delay = start + i / rps - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            query = rng.choice(QUERIES)
+            if rng.random() < chat_ratio:
+                coro = timed_stream(client, "/chat", {"message": query}, timeout)
+            else:
+                state, _ = rng.choice(CITIES)
+                coro = timed_stream(client, "/query", {"query": query, "state": state, "stream": True}, timeout)
+            tasks.append(asyncio.create_task(coro))
+        samples = await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+    return {
+        route: summarize([s for s in samples if s["route"] == route], elapsed)
+        for route in ("/query", "/chat")
+    }
+
+
+GATED_METRICS = ("latency_p95_ms", "latency_p99_ms", "ttft_p95_ms")
+
+
+def check_regressions(results: Dict, baseline: Dict, max_regression: float, max_error_rate: float) -> List[str]:
+    """Failures of the results against a baseline report, empty when the gate passes"""
+    failures = []
+    for route, summary in results.items():
+        if summary["requests"] == 0:
+            continue
+        if summary["error_rate"] > max_error_rate:
+            failures.append(f"{route} error rate {summary['error_rate']:.1%} above {max_error_rate:.1%}")
+        reference = baseline.get("results", {}).get(route)
+        if not reference:
+            continue
+        for metric in GATED_METRICS:
+            current, previous = summary.get(metric), reference.get(metric)
+            if current is None or not previous:
+                continue
+            if current > previous * (1 + max_regression):
+                failures.append(
+                    f"{route} {metric} {current:.1f}ms is {current / previous - 1:.0%} above baseline {previous:.1f}ms"
+                )
+    return failures
+
+
+def wait_until_ready(app_url: str, process: subprocess.Popen, timeout: float = 120.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"App exited during startup with code {process.returncode}")
+        try:
+            if httpx.get(f"{app_url}/", timeout=1.0).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"App not ready after {timeout:.0f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test /query and /chat against local LlamaStack, Together and Chroma stand-ins"
+    )
+    parser.add_argument("--app-url", default=None, help="Target a running app instead of starting one")
+    parser.add_argument("--port", type=int, default=8010, help="Port of the app started by the harness")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--rps", type=float, default=20.0, help="Target requests per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of load")
+    parser.add_argument("--chat-ratio", type=float, default=0.3, help="Fraction of requests sent to /chat")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per request timeout in seconds")
+    parser.add_argument("--ttft", type=float, default=0.3, help="Fake LlamaStack seconds to first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=50.0)
+    parser.add_argument("--num-tokens", type=int, default=128)
+    parser.add_argument("--embed-latency", type=float, default=0.02, help="Fake Together seconds per request")
+    parser.add_argument("--sections-per-topic", type=int, default=5)
+    parser.add_argument("--output", default=None, help="JSON report path")
+    parser.add_argument("--baseline", default=None, help="Report of a previous release to gate against")
+    parser.add_argument("--max-regression", type=float, default=0.15, help="Allowed relative p95/p99 increase")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    args = parser.parse_args()
+
+    llama_stack = FakeLlamaStackServer(
+        ttft=args.ttft,
+        tokens_per_sec=args.tokens_per_sec,
+        num_tokens=args.num_tokens
+    ).start()
+    together = FakeTogetherServer(latency=args.embed_latency).start()
+    chroma_dir = tempfile.TemporaryDirectory(prefix="bench-chroma-")
+    process = None
+    try:
+        app_url = args.app_url
+        if app_url is None:
+            env = dict(
+                os.environ,
+                TOGETHER_API_KEY="fake",
+                TOGETHER_BASE_URL=together.base_url,
+                LLAMA_STACK_URL=llama_stack.url,
+                CHROMA_MODE="persistent",
+                CHROMA_PATH=chroma_dir.name,
+                INGEST_ON_STARTUP="false"
+            )
+            os.environ.update(env)
+            seed_index(chroma_dir.name, args.sections_per_topic)
+            process = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "src.app:app",
+                 "--host", "127.0.0.1", "--port", str(args.port),
+                 "--workers", str(args.workers), "--log-level", "warning"],
+                env=env
+            )
+            app_url = f"http://127.0.0.1:{args.port}"
+            wait_until_ready(app_url, process)
+
+        print(f"Driving {app_url} at {args.rps:g} req/s for {args.duration:g}s")
+        results = asyncio.run(generate_load(app_url, args.rps, args.duration, args.chat_ratio, args.timeout))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        llama_stack.stop()
+        together.stop()
+        chroma_dir.cleanup()
+
+    report = {
+        "config": vars(args),
+        "results": results,
+        "fake_llama_stack": llama_stack.stats(),
+        "fake_together": together.stats()
+    }
+    for route, summary in results.items():
+        print(
+            f"{route:7} {summary['requests']:>6} req  "
+            f"p50 {summary['latency_p50_ms'] or 0:>8.1f}ms  p95 {summary['latency_p95_ms'] or 0:>8.1f}ms  "
+            f"p99 {summary['latency_p99_ms'] or 0:>8.1f}ms  ttft p95 {summary['ttft_p95_ms'] or 0:>8.1f}ms  "
+            f"errors {summary['error_rate']:.1%}"
+        )
+
+    failures = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        failures = check_regressions(results, baseline, args.max_regression, args.max_error_rate)
+        report["regressions"] = failures
+        for failure in failures:
+            print(f"REGRESSION: {failure}")
+        if not failures:
+            print("No regressions against baseline")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
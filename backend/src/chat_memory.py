@@ -0,0 +1,284 @@
+# chat_memory.py
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Set
+
+from .llm_dispatcher import LLMDispatcher, Priority
+from .utils import estimate_tokens
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You maintain the running summary of a conversation between a user and an assistant. "
+    "Merge the new turns into the summary. Keep facts, names, places, numbers, decisions and "
+    "open questions, drop pleasantries. Answer with the summary only, at most {words} words."
+)
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to about max_tokens, on the same four characters per token as estimate_tokens"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    return text[:max_tokens * 4].rsplit(" ", 1)[0] + " ..."
+
+
+class ChatSessionStore:
+    """
+    Chat sessions in a small SQLite file shared by the server workers.
+
+    Requests of one conversation may reach any worker, so the summary and
+    the turns not summarized yet are kept on disk like job records. Only the
+    turns since the last compaction are stored, a session stays small
+    however long the conversation runs.
+    """
+
+    def __init__(self, path: str = "data/chat_sessions.sqlite"):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id TEXT PRIMARY KEY,
+                    summary TEXT NOT NULL DEFAULT '',
+                    summarized_seq INTEGER NOT NULL DEFAULT 0,
+                    compacting_until REAL NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS sessions_last_used ON sessions (last_used);
+                CREATE TABLE IF NOT EXISTS turns (
+                    session_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    tokens INTEGER NOT NULL,
+                    PRIMARY KEY (session_id, seq)
+                );
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10.0)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def open(self, session_id: Optional[str], ttl_seconds: float) -> str:
+        """ID of a live session, a new one when session_id is unknown or expired"""
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            if session_id:
+                updated = conn.execute(
+                    "UPDATE sessions SET last_used = ? WHERE id = ? AND last_used >= ?",
+                    (now, session_id, now - ttl_seconds)
+                ).rowcount
+                if updated:
+                    return session_id
+            session_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO sessions (id, created_at, last_used) VALUES (?, ?, ?)",
+                (session_id, now, now)
+            )
+        return session_id
+
+    def load(self, session_id: str) -> Dict:
+        """Summary and the turns after it, oldest first"""
+        with self._connect() as conn:
+            session = conn.execute("SELECT * FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if session is None:
+                return {"summary": "", "turns": []}
+            turns = conn.execute(
+                "SELECT seq, role, content, tokens FROM turns WHERE session_id = ? AND seq > ? ORDER BY seq",
+                (session_id, session["summarized_seq"])
+            ).fetchall()
+        return {"summary": session["summary"], "turns": [dict(turn) for turn in turns]}
+
+    def append(self, session_id: str, turns: List[Dict]) -> bool:
+        """Add turns to a session, False when it was evicted since it was opened"""
+        with self._lock, self._connect() as conn:
+            # Other workers may append to the same session, number the turns atomically
+            conn.execute("BEGIN IMMEDIATE")
+            summarized = conn.execute(
+                "SELECT summarized_seq FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+            if summarized is None:
+                # Turns without their session would never be read or evicted
+                return False
+            last = conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM turns WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+            seq = max(last, summarized[0])
+            conn.executemany(
+                "INSERT INTO turns VALUES (?, ?, ?, ?, ?)",
+                [(session_id, seq + i + 1, t["role"], t["content"], estimate_tokens(t["content"])) for i, t in enumerate(turns)]
+            )
+            return True
+
+    def claim_compaction(self, session_id: str, lease_seconds: float) -> bool:
+        """Take the session's compaction, False while another worker holds it"""
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            return conn.execute(
+                "UPDATE sessions SET compacting_until = ? WHERE id = ? AND compacting_until < ?",
+                (now + lease_seconds, session_id, now)
+            ).rowcount == 1
+
+    def finish_compaction(self, session_id: str, summary: Optional[str], summarized_seq: int):
+        """Store the new summary and drop the turns it covers, or only release the claim"""
+        with self._lock, self._connect() as conn:
+            if summary is not None:
+                conn.execute(
+                    "UPDATE sessions SET summary = ?, summarized_seq = ? WHERE id = ?",
+                    (summary, summarized_seq, session_id)
+                )
+                conn.execute(
+                    "DELETE FROM turns WHERE session_id = ? AND seq <= ?", (session_id, summarized_seq)
+                )
+            conn.execute("UPDATE sessions SET compacting_until = 0 WHERE id = ?", (session_id,))
+
+    def evict(self, ttl_seconds: float, max_sessions: int) -> int:
+        """Delete expired sessions and the least recently used beyond max_sessions, with their turns"""
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            stale = [row[0] for row in conn.execute(
+                "SELECT id FROM sessions WHERE last_used < ? "
+                "UNION SELECT id FROM sessions WHERE id NOT IN "
+                "(SELECT id FROM sessions ORDER BY last_used DESC LIMIT ?)",
+                (now - ttl_seconds, max_sessions)
+            )]
+            conn.executemany("DELETE FROM sessions WHERE id = ?", [(s,) for s in stale])
+            # Also turns left by stores from before append checked the session
+            conn.execute("DELETE FROM turns WHERE session_id NOT IN (SELECT id FROM sessions)")
+        return len(stale)
+
+
+class ChatMemory:
+    """
+    Bounded conversation memory for /chat.
+
+    A prompt is the system prompt, the rolling summary of older turns, as
+    many recent turns verbatim as fit the history budget, and the new
+    message. The summary and the history both have a fixed token budget, so
+    the prompt stays the same size however long the conversation runs.
+
+    Once more than keep_turns turns are unsummarized, the older ones are
+    merged into the summary by a background completion at BACKGROUND
+    priority, which never delays interactive requests. Until it finishes
+    the turns that do not fit the budget are left out of prompts.
+    """
+
+    def __init__(
+        self,
+        dispatcher: LLMDispatcher,
+        model: str,
+        store: Optional[ChatSessionStore] = None,
+        history_tokens: int = int(os.getenv("CHAT_HISTORY_TOKENS", "1500")),
+        summary_tokens: int = int(os.getenv("CHAT_SUMMARY_TOKENS", "400")),
+        keep_turns: int = int(os.getenv("CHAT_KEEP_TURNS", "6")),
+        ttl_seconds: float = float(os.getenv("CHAT_SESSION_TTL", "3600")),
+        max_sessions: int = int(os.getenv("CHAT_MAX_SESSIONS", "10000")),
+        summary_timeout: float = 120.0
+    ):
+        """
+        Args:
+            dispatcher: Runs the summary completions
+            model: Model writing the summaries
+            store: Where sessions are kept, shared by the server workers
+            history_tokens: Budget of the verbatim turns in a prompt
+            summary_tokens: Budget of the summary in a prompt
+            keep_turns: Newest turns kept verbatim when compacting
+            ttl_seconds: Idle time after which a session expires
+            max_sessions: Most sessions kept, the least recently used go first
+            summary_timeout: Seconds a summary may take before the turns are
+                left for the next compaction
+        """
+        self.dispatcher = dispatcher
+        self.model = model
+        self.store = store or ChatSessionStore()
+        self.history_tokens = history_tokens
+        self.summary_tokens = summary_tokens
+        self.keep_turns = keep_turns
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.summary_timeout = summary_timeout
+        self._tasks: Set[asyncio.Task] = set()
+        self._last_eviction = 0.0
+
+    async def open(self, session_id: Optional[str]) -> str:
+        """Resume a session or start a new one"""
+        if time.monotonic() - self._last_eviction > 60.0:
+            self._last_eviction = time.monotonic()
+            await asyncio.to_thread(self.store.evict, self.ttl_seconds, self.max_sessions)
+        return await asyncio.to_thread(self.store.open, session_id, self.ttl_seconds)
+
+    async def build_messages(self, session_id: str, system_prompt: str, message: str) -> List[Dict]:
+        """Prompt for the next turn, within the summary and history budgets"""
+        session = await asyncio.to_thread(self.store.load, session_id)
+        messages = [{"role": "system", "content": system_prompt}]
+        if session["summary"]:
+            summary = truncate_tokens(session["summary"], self.summary_tokens)
+            messages.append({"role": "system", "content": f"Summary of the conversation so far:\n{summary}"})
+
+        recent = []
+        budget = self.history_tokens
+        for turn in reversed(session["turns"]):
+            if turn["tokens"] > budget:
+                break
+            budget -= turn["tokens"]
+            recent.append({"role": turn["role"], "content": turn["content"]})
+        messages.extend(reversed(recent))
+        messages.append({"role": "user", "content": message})
+        return messages
+
+    async def record(self, session_id: str, message: str, reply: str):
+        """Store a finished exchange and compact in the background when due"""
+        if not await asyncio.to_thread(self.store.append, session_id, [
+            {"role": "user", "content": message},
+            {"role": "assistant", "content": reply}
+        ]):
+            print(f"Chat session {session_id} was evicted, exchange not stored")
+            return
+        session = await asyncio.to_thread(self.store.load, session_id)
+        if len(session["turns"]) > self.keep_turns:
+            task = asyncio.create_task(self._compact(session_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _compact(self, session_id: str):
+        if not await asyncio.to_thread(self.store.claim_compaction, session_id, self.summary_timeout):
+            return  # Another worker is already summarizing this session
+        summary, summarized_seq = None, 0
+        try:
+            session = await asyncio.to_thread(self.store.load, session_id)
+            old = session["turns"][:-self.keep_turns]
+            if not old:
+                return
+            transcript = "\n".join(f"{t['role'].capitalize()}: {t['content']}" for t in old)
+            words = max(50, self.summary_tokens * 3 // 4)
+            summary = await self.dispatcher.complete(
+                messages=[
+                    {"role": "system", "content": SUMMARY_SYSTEM_PROMPT.format(words=words)},
+                    {"role": "user", "content": f"Summary so far:\n{session['summary'] or '(empty)'}\n\nNew turns:\n{transcript}"}
+                ],
+                model=self.model,
+                priority=Priority.BACKGROUND,
+                deadline=time.monotonic() + self.summary_timeout
+            )
+            summary = truncate_tokens(summary.strip(), self.summary_tokens)
+            summarized_seq = old[-1]["seq"]
+        except Exception as e:
+            # The turns stay and are summarized with the next exchange
+            print(f"Error compacting chat session {session_id}: {str(e)}")
+            summary = None
+        finally:
+            await asyncio.to_thread(self.store.finish_compaction, session_id, summary, summarized_seq)
+
+    async def shutdown(self):
+        """Stop pending compactions, their turns are summarized after the next exchange"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,351 @@
+# collection_versions.py
+import argparse
+import json
+import re
+import time
+from typing import Callable, Dict, List, Optional
+
+from .dedup import forget_collection
+from .sharding import delete_collection
+
+REGISTRY_COLLECTION = "collection_aliases"
+DEFAULT_GRACE_SECONDS = 3600.0
+# Builds still unfinished after this long are assumed abandoned
+STALE_BUILD_SECONDS = 24 * 3600.0
+
+
+def version_name(alias: str, version: int) -> str:
+    return f"{alias}_v{version}"
+
+
+class AliasRegistry:
+    """
+    Stable collection names pointing at versioned Chroma collections.
+
+    Chroma has no aliases, so they are kept as records of a small registry
+    collection next to the data. Moving an alias is a single-record upsert,
+    which readers see either before or after, never half done. Every version
+    built for an alias also gets a record, used to find the next version
+    number and to garbage-collect retired versions.
+    """
+
+    def __init__(self, client, create: bool = True):
+        """
+        Args:
+            client: Chroma client shared with the versioned collections
+            create: Create the registry collection if missing, readers pass
+                False and see no aliases until the first rebuild
+        """
+        self.client = client
+        self._collection = None
+        if create:
+            self._collection = client.get_or_create_collection(name=REGISTRY_COLLECTION, embedding_function=None)
+
+    def _registry(self):
+        if self._collection is None:
+            try:
+                self._collection = self.client.get_collection(name=REGISTRY_COLLECTION, embedding_function=None)
+            except Exception:
+                return None
+        return self._collection
+
+    def put_record(self, record_id: str, metadata: Dict):
+        """Create or replace a record"""
+        # The registry is looked up by ID only, the embedding is a placeholder
+        self._registry().upsert(ids=[record_id], embeddings=[[0.0]], metadatas=[metadata])
+
+    def get_record(self, record_id: str) -> Optional[Dict]:
+        """Metadata of a record, None if it does not exist"""
+        registry = self._registry()
+        if registry is None:
+            return None
+        records = registry.get(ids=[record_id])
+        if not records["ids"]:
+            return None
+        return records["metadatas"][0]
+
+    def delete_record(self, record_id: str):
+        registry = self._registry()
+        if registry is not None:
+            registry.delete(ids=[record_id])
+
+    def resolve(self, alias: str) -> Optional[str]:
+        """Collection the alias points at, None if it was never published"""
+        record = self.get_record(f"alias:{alias}")
+        return record["target"] if record else None
+
+    def aliases(self) -> List[str]:
+        """Every alias with a version in the registry"""
+        registry = self._registry()
+        if registry is None:
+            return []
+        return sorted({r["alias"] for r in registry.get(where={"kind": "version"})["metadatas"]})
+
+    def versions(self, alias: str) -> List[Dict]:
+        """Version records of an alias, oldest first"""
+        registry = self._registry()
+        if registry is None:
+            return []
+        records = registry.get(where={"$and": [{"kind": "version"}, {"alias": alias}]})
+        return sorted(records["metadatas"], key=lambda r: r["version"])
+
+    def next_version(self, alias: str) -> int:
+        """Number after every version in the registry or already in Chroma"""
+        pattern = re.compile(rf"^{re.escape(alias)}_v(\d+)$")
+        numbers = [r["version"] for r in self.versions(alias)]
+        for collection in self.client.list_collections():
+            name = collection if isinstance(collection, str) else collection.name
+            match = pattern.match(name)
+            if match:
+                numbers.append(int(match.group(1)))
+        return max(numbers, default=0) + 1
+
+    def record_version(self, alias: str, version: int, status: str, build_id: str = ""):
+        """Register a new version as it starts building"""
+        name = version_name(alias, version)
+        self.put_record(f"version:{name}", {
+            "kind": "version",
+            "alias": alias,
+            "version": version,
+            "collection": name,
+            "status": status,
+            "build_id": build_id,
+            "created_at": time.time(),
+            "retired_at": 0.0,
+        })
+
+    def mark(self, collection: str, alias: str, **fields):
+        """Update the version record of a collection, creating it for unversioned ones"""
+        metadata = self.get_record(f"version:{collection}")
+        if metadata is None:
+            # A collection from before aliases were used, tracked as version 0
+            metadata = {
+                "kind": "version", "alias": alias, "version": 0, "collection": collection,
+                "status": "live", "created_at": 0.0, "retired_at": 0.0
+            }
+        metadata.update(fields)
+        self.put_record(f"version:{collection}", metadata)
+
+    def swap(self, alias: str, target: str) -> Optional[str]:
+        """Point the alias at target, returns the collection it pointed at before"""
+        previous = self.resolve(alias)
+        self.put_record(f"alias:{alias}", {"kind": "alias", "alias": alias, "target": target, "updated_at": time.time()})
+        return previous
+
+
+def validate_version(db, expected_count: int, smoke_query: Optional[str] = None, min_count: int = 1) -> List[str]:
+    """
+    Checks a freshly built collection must pass before it goes live.
+
+    Args:
+        db: OrdinanceDBWithTogether opened on the new version
+        expected_count: Documents the build reported writing
+        smoke_query: Search that must return results, skipped when None
+        min_count: Fewest documents a usable index can have
+
+    Returns:
+        Failure messages, empty when the version is valid
+    """
+    failures = []
+    count = db.collection.count()
+    if count != expected_count:
+        failures.append(f"{db.name} has {count} documents, the build wrote {expected_count}")
+    if count < min_count:
+        failures.append(f"{db.name} has {count} documents, at least {min_count} required")
+    if smoke_query and count:
+        results = db.search_ordinances(smoke_query, max_results=1)
+        if not results:
+            failures.append(f"Smoke query {smoke_query!r} returned no results from {db.name}")
+    return failures
+
+
+def publish_version(registry: AliasRegistry, alias: str, version: int) -> Optional[str]:
+    """Move the alias to a validated version and retire the one it replaces"""
+    target = version_name(alias, version)
+    previous = registry.swap(alias, target)
+    registry.mark(target, alias, status="live", published_at=time.time())
+    print(f"Alias {alias} now points at {target} (was {previous or 'unset'})")
+    if previous is None and any(
+        (c if isinstance(c, str) else c.name) == alias for c in registry.client.list_collections()
+    ):
+        # First publish over a collection built before aliases, readers still use it
+        previous = alias
+    if previous and previous != target:
+        registry.mark(previous, alias, status="retired", retired_at=time.time())
+    return previous
+
+
+def collect_garbage(registry: AliasRegistry, alias: str, grace_seconds: float = DEFAULT_GRACE_SECONDS) -> List[str]:
+    """
+    Delete versions retired for longer than the grace period.
+
+    Readers re-resolve the alias periodically, the grace period must be
+    longer than that interval so nobody still queries a deleted version.
+    Failed builds are deleted right away, they were never live, and so are
+    builds abandoned for longer than STALE_BUILD_SECONDS.
+
+    Runs after every build, and on a schedule through
+    `python -m src.collection_versions gc` so retired versions do not wait
+    for the next rebuild.
+
+    Returns:
+        Names of the deleted collections
+    """
+    deleted = []
+    live = registry.resolve(alias)
+    now = time.time()
+    for record in registry.versions(alias):
+        name = record["collection"]
+        expired = (
+            record["status"] == "failed"
+            or (record["status"] == "retired" and now - record["retired_at"] >= grace_seconds)
+            or (record["status"] == "building" and now - record["created_at"] >= STALE_BUILD_SECONDS)
+        )
+        if name == live or not expired:
+            continue
+        try:
+            delete_collection(registry.client, name)
+            forget_collection(name)
+        except Exception as e:
+            print(f"Error deleting collection {name}: {str(e)}")
+        registry.mark(name, alias, status="deleted", deleted_at=now)
+        deleted.append(name)
+        print(f"Garbage-collected {name}")
+    return deleted
+
+
+def begin_version(registry: AliasRegistry, alias: str, build_id: Optional[str] = None) -> int:
+    """
+    Reserve the next version number of an alias for a build.
+
+    With a build_id, such as a workflow run ID, a retried call returns the
+    version already reserved for that build instead of reserving another.
+    """
+    if build_id:
+        for record in registry.versions(alias):
+            if record.get("build_id") == build_id and record["status"] == "building":
+                return record["version"]
+    version = registry.next_version(alias)
+    registry.record_version(alias, version, "building", build_id or "")
+    print(f"Building {version_name(alias, version)} for alias {alias}")
+    return version
+
+
+def finish_version(
+    db,
+    registry: AliasRegistry,
+    alias: str,
+    version: int,
+    written: int,
+    smoke_query: Optional[str] = None,
+    min_count: int = 1,
+    grace_seconds: float = DEFAULT_GRACE_SECONDS
+) -> Optional[str]:
+    """
+    Validate a built version, publish it and collect expired versions.
+
+    A version failing validation is deleted and the alias stays where it was.
+
+    Returns:
+        The collection the alias pointed at before
+
+    Raises:
+        RuntimeError: The version failed validation
+    """
+    failures = validate_version(db, written, smoke_query, min_count)
+    if failures:
+        fail_version(registry, alias, version, failures)
+    previous = publish_version(registry, alias, version)
+    collect_garbage(registry, alias, grace_seconds)
+    return previous
+
+
+def discard_version(registry: AliasRegistry, alias: str, version: int, failures: List[str]):
+    """Record a failed build and delete it, the alias stays where it is"""
+    registry.mark(version_name(alias, version), alias, status="failed", error="; ".join(failures))
+    collect_garbage(registry, alias)
+
+
+def fail_version(registry: AliasRegistry, alias: str, version: int, failures: List[str]):
+    """Record a failed build, delete it and raise"""
+    discard_version(registry, alias, version, failures)
+    raise RuntimeError(f"Not publishing {version_name(alias, version)}: {'; '.join(failures)}")
+
+
+def rebuild_collection(
+    alias: str,
+    load: Callable[..., int],
+    api_key: str,
+    smoke_query: Optional[str] = None,
+    min_count: int = 1,
+    grace_seconds: float = DEFAULT_GRACE_SECONDS,
+    **db_kwargs
+):
+    """
+    Build a new version of a collection and switch the alias to it.
+
+    The live version keeps serving queries during the build, and the new
+    version goes live only after it passes validate_version.
+
+    Args:
+        alias: Stable name readers open
+        load: Called with the new version's OrdinanceDBWithTogether, fills it
+            and returns the number of documents written
+        api_key: Together AI API key
+        smoke_query: Search the new version must answer before going live
+        min_count: Fewest documents the new version must have
+        grace_seconds: How long replaced versions are kept for readers to move
+        db_kwargs: More OrdinanceDBWithTogether arguments
+
+    Returns:
+        The OrdinanceDBWithTogether of the published version
+    """
+    from .db import create_chroma_client
+    from .ordinance_db import OrdinanceDBWithTogether
+
+    registry = AliasRegistry(create_chroma_client())
+    version = begin_version(registry, alias)
+    name = version_name(alias, version)
+
+    started = time.perf_counter()
+    try:
+        db = OrdinanceDBWithTogether(
+            api_key=api_key, collection_name=name, force_recreate=True, **db_kwargs
+        )
+        written = load(db)
+    except Exception as e:
+        fail_version(registry, alias, version, [f"Build failed: {str(e)}"])
+
+    print(f"Built {name} with {written} documents in {time.perf_counter() - started:.1f}s")
+    finish_version(db, registry, alias, version, written, smoke_query, min_count, grace_seconds)
+    return db
+
+
+def main():
+    from .db import create_chroma_client
+
+    parser = argparse.ArgumentParser(description="Delete collection versions retired for longer than the grace period")
+    parser.add_argument("command", choices=["gc", "status"])
+    parser.add_argument("--alias", action="append", help="Alias to collect, every alias when omitted")
+    parser.add_argument("--grace-seconds", type=float, default=DEFAULT_GRACE_SECONDS)
+    parser.add_argument("--every", type=float, default=0.0, help="Keep collecting every this many seconds")
+    args = parser.parse_args()
+
+    registry = AliasRegistry(create_chroma_client(), create=False)
+    if args.command == "status":
+        aliases = args.alias or registry.aliases()
+        print(json.dumps({
+            alias: {"live": registry.resolve(alias), "versions": registry.versions(alias)} for alias in aliases
+        }, indent=2))
+        return
+    while True:
+        for alias in args.alias or registry.aliases():
+            deleted = collect_garbage(registry, alias, args.grace_seconds)
+            print(json.dumps({"alias": alias, "deleted": deleted}))
+        if not args.every:
+            break
+        time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    main()
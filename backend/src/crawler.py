@@ -0,0 +1,294 @@
+# crawler.py
+import asyncio
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from .pdf_extraction import iter_pages
+
+USER_AGENT = "ordinance-crawler/0.1"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+@dataclass
+class FetchResult:
+    """A fetched document, served from the network or revalidated from the cache"""
+    url: str
+    status: int
+    content: bytes = b""
+    content_type: str = ""
+    from_cache: bool = False
+    elapsed: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and 200 <= self.status < 300
+
+    @property
+    def is_pdf(self) -> bool:
+        return "application/pdf" in self.content_type or self.content[:5] == b"%PDF-"
+
+
+class ResponseCache:
+    """
+    On-disk cache of response bodies and their validators.
+
+    Each URL is stored as a body file plus a small JSON file with the ETag,
+    Last-Modified and content type used to revalidate it. Files are written
+    to a temporary name and renamed, so concurrent crawls never see partial
+    entries.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, url: str):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        base = os.path.join(self.directory, key)
+        return base + ".json", base + ".body"
+
+    def load(self, url: str) -> Optional[Dict]:
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path) as f:
+                entry = json.load(f)
+            with open(body_path, "rb") as f:
+                entry["content"] = f.read()
+            return entry
+        except (OSError, ValueError):
+            return None
+
+    def store(self, url: str, content: bytes, headers: httpx.Headers):
+        meta_path, body_path = self._paths(url)
+        entry = {
+            "url": url,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "content_type": headers.get("Content-Type", ""),
+            "fetched_at": time.time(),
+        }
+        for path, data, mode in ((body_path, content, "wb"), (meta_path, json.dumps(entry), "w")):
+            tmp_path = f"{path}.{os.getpid()}.{id(data)}.tmp"
+            with open(tmp_path, mode) as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+
+class _HostLimiter:
+    """Concurrency slots and a minimum interval between requests to one host"""
+
+    def __init__(self, concurrency: int, rate: float):
+        self.slots = asyncio.Semaphore(concurrency)
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_start = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait_turn(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next_start - now
+            self._next_start = max(now, self._next_start) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class Crawler:
+    """
+    Async crawler for city document centers.
+
+    One pooled HTTP client is shared by all requests. Each host gets its own
+    concurrency limit and request rate, responses are cached on disk and
+    revalidated with conditional GETs, and bodies stay in memory.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        max_connections: int = 32,
+        per_host_concurrency: int = 4,
+        per_host_rate: float = 5.0,
+        timeout: float = 30.0,
+        max_bytes: int = 50 * 1024 * 1024,
+        max_retries: int = 2
+    ):
+        """
+        Args:
+            cache_dir: Directory of the response cache, None disables caching
+            max_connections: Connections kept by the shared client across hosts
+            per_host_concurrency: Requests in flight at once to one host
+            per_host_rate: Requests started per second to one host
+            timeout: Seconds per request
+            max_bytes: Larger responses are rejected
+            max_retries: Retries after timeouts, connection errors, 429 and 5xx
+        """
+        self.cache = ResponseCache(cache_dir) if cache_dir else None
+        self.per_host_concurrency = per_host_concurrency
+        self.per_host_rate = per_host_rate
+        self.max_bytes = max_bytes
+        self.max_retries = max_retries
+        self._hosts: Dict[str, _HostLimiter] = {}
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 10.0)),
+            follow_redirects=True,
+            headers={"User-Agent": USER_AGENT}
+        )
+
+    async def __aenter__(self) -> "Crawler":
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    def _limiter(self, url: str) -> _HostLimiter:
+        host = urlsplit(url).netloc
+        limiter = self._hosts.get(host)
+        if limiter is None:
+            limiter = _HostLimiter(self.per_host_concurrency, self.per_host_rate)
+            self._hosts[host] = limiter
+        return limiter
+
+    async def _get(self, url: str, headers: Dict[str, str]):
+        """GET with a size cap, returns the response and its body"""
+        async with self._client.stream("GET", url, headers=headers) as response:
+            length = response.headers.get("Content-Length")
+            if length and int(length) > self.max_bytes:
+                raise ValueError(f"Response of {length} bytes exceeds the {self.max_bytes} byte limit")
+            body = bytearray()
+            async for chunk in response.aiter_bytes():
+                body.extend(chunk)
+                if len(body) > self.max_bytes:
+                    raise ValueError(f"Response exceeds the {self.max_bytes} byte limit")
+            return response, bytes(body)
+
+    async def fetch(self, url: str) -> FetchResult:
+        """Fetch one URL, failures are returned in FetchResult.error instead of raised"""
+        start = time.perf_counter()
+        cached = await asyncio.to_thread(self.cache.load, url) if self.cache else None
+        headers = {}
+        if cached:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        limiter = self._limiter(url)
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await asyncio.sleep(min(0.5 * 2 ** (attempt - 1), 5.0))
+            try:
+                async with limiter.slots:
+                    await limiter.wait_turn()
+                    response, body = await self._get(url, headers)
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                last_error = f"{type(e).__name__}: {str(e)}"
+                continue
+            except Exception as e:
+                return FetchResult(url=url, status=0, elapsed=time.perf_counter() - start, error=str(e))
+
+            if response.status_code == 304 and cached:
+                return FetchResult(
+                    url=url,
+                    status=200,
+                    content=cached["content"],
+                    content_type=cached.get("content_type", ""),
+                    from_cache=True,
+                    elapsed=time.perf_counter() - start
+                )
+            if response.status_code in RETRY_STATUSES:
+                last_error = f"HTTP {response.status_code}"
+                continue
+            if response.status_code >= 400:
+                return FetchResult(
+                    url=url,
+                    status=response.status_code,
+                    elapsed=time.perf_counter() - start,
+                    error=f"HTTP {response.status_code}"
+                )
+
+            if self.cache:
+                await asyncio.to_thread(self.cache.store, url, body, response.headers)
+            return FetchResult(
+                url=url,
+                status=response.status_code,
+                content=body,
+                content_type=response.headers.get("Content-Type", ""),
+                elapsed=time.perf_counter() - start
+            )
+
+        return FetchResult(url=url, status=0, elapsed=time.perf_counter() - start, error=last_error)
+
+    async def fetch_all(self, urls: List[str], deadline: Optional[float] = None) -> List[FetchResult]:
+        """
+        Fetch many URLs concurrently within the per-host limits, in input order.
+
+        Request timeouts apply per read, so a trickling host can hold a fetch
+        far longer. With a deadline in seconds, fetches still running then
+        are cancelled and returned as failed, the others are kept.
+        """
+        tasks = [asyncio.ensure_future(self.fetch(url)) for url in urls]
+        if not tasks:
+            return []
+        _, pending = await asyncio.wait(tasks, timeout=deadline)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        return [
+            FetchResult(url=url, status=0, elapsed=deadline, error=f"Not finished within the {deadline:g}s deadline")
+            if task.cancelled() else task.result()
+            for url, task in zip(urls, tasks)
+        ]
+
+
+_shared: Dict[int, Crawler] = {}
+
+
+def shared_crawler() -> Crawler:
+    """
+    Crawler reused by every function run on the current event loop.
+
+    Sized for ordinary web pages, the limits come from CRAWL_PER_HOST_CONCURRENCY,
+    CRAWL_PER_HOST_RATE, CRAWL_TIMEOUT and CRAWL_MAX_BYTES.
+    """
+    loop = asyncio.get_running_loop()
+    crawler = _shared.get(id(loop))
+    if crawler is None:
+        crawler = Crawler(
+            cache_dir=os.getenv("CRAWL_CACHE_DIR", "data/crawl_cache"),
+            per_host_concurrency=int(os.getenv("CRAWL_PER_HOST_CONCURRENCY", "4")),
+            per_host_rate=float(os.getenv("CRAWL_PER_HOST_RATE", "2.0")),
+            timeout=float(os.getenv("CRAWL_TIMEOUT", "15")),
+            max_bytes=int(os.getenv("CRAWL_MAX_BYTES", str(5 * 1024 * 1024))),
+            max_retries=1
+        )
+        _shared[id(loop)] = crawler
+    return crawler
+
+
+def extract_text(result: FetchResult) -> str:
+    """
+    Text of a fetched document.
+
+    PDFs are parsed straight from the response bytes, everything else as
+    HTML. CPU bound, run it in a thread from async code.
+    """
+    if result.is_pdf:
+        return "\n".join(page.text for page in iter_pages(result.content))
+
+    from bs4 import BeautifulSoup
+
+    return BeautifulSoup(result.content, "html.parser").get_text()
@@ -1,6 +1,8 @@
 from dotenv import load_dotenv
 import os
 from .ordinance_db import OrdinanceDBWithTogether
+from .collection_versions import rebuild_collection
+from .parser import open_ordinances
 from typing import List
 from pathlib import Path
 
@@ -35,37 +37,41 @@ def get_files_under_dir(directory: str) -> List[str]:
         print(f"Error reading directory {directory}: {str(e)}")
         raise
 
-def init_database(collection_name: str = "ordinances_collection"):
+def init_database(collection_name: str = "ordinances_collection", smoke_query: str = "building permit"):
+    """
+    Rebuild the ordinance index from the Excel exports in data/raw_files.
+    
+    collection_name is an alias: a new version of the collection is built
+    next to the live one, validated, and only then published, so queries
+    keep seeing the complete previous corpus during the rebuild.
+    """
     load_dotenv()
 
     try:
         directory = "data/raw_files"
-        excel_paths = get_files_under_dir(directory)
+        excel_paths = get_excel_files(directory)
         print("Initializing database...")
-        # Initialize database with first file then interate over the other files and add them to the database
-        first_file = directory + "/CaliforniaCityCACodeofOrdinancesEXPORT20220511.xlsx"
-        db = OrdinanceDBWithTogether.from_excel(
-            excel_path=first_file,
+
+        def load(db: OrdinanceDBWithTogether) -> int:
+            written = 0
+            for excel_path in excel_paths:
+                print(f"\nProcessing file: {excel_path}")
+                try:
+                    ordinances, cached = open_ordinances(excel_path)
+                    print(f"{'Using cached parse' if cached else 'Parsed'}: {excel_path}")
+                    written += db.upsert_ordinances(ordinances, batch_size=100)
+                except Exception as e:
+                    # Without this file the version would replace the live corpus with a partial one
+                    raise RuntimeError(f"Error processing {excel_path}: {str(e)}") from e
+            return written
+
+        db = rebuild_collection(
+            alias=collection_name,
+            load=load,
             api_key=os.getenv('TOGETHER_API_KEY'),
-            collection_name=collection_name,
-            force_recreate=True  # Create fresh database for first file
+            smoke_query=smoke_query
         )
         
-        # Add remaining files to the existing database
-        for excel_path in excel_paths[1:]:
-            print(f"\nProcessing file: {excel_path}")
-            try:
-                # Use update_collection to add new documents
-                ordinances = db.extract_ordinance_metadata(excel_path)
-                db.update_collection(
-                    new_documents=ordinances,
-                    batch_size=100,
-                    skip_duplicates=True
-                )
-            except Exception as e:
-                print(f"Error processing {excel_path}: {str(e)}")
-                continue
-        
         # Verify the data was loaded
         info = db.get_collection_info()
         print("\n=== Final Database Information ===")
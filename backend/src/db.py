@@ -1,20 +1,35 @@
+import os
 from abc import ABC, abstractmethod
 import chromadb
 from chromadb.api.types import EmbeddingFunction
 from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
 from typing import List, Dict, Union
 
+def create_chroma_client():
+    """
+    Create a ChromaDB client from the environment.
+    
+    CHROMA_MODE=http (default) connects to the server from docker-compose.yaml
+    at CHROMA_HOST/CHROMA_PORT. CHROMA_MODE=persistent opens the on-disk index
+    at CHROMA_PATH directly, which lets several server workers share one
+    index snapshot without a separate database process.
+    """
+    mode = os.getenv("CHROMA_MODE", "http")
+    if mode == "persistent":
+        return chromadb.PersistentClient(path=os.getenv("CHROMA_PATH", "data/chroma"))
+    return chromadb.HttpClient(
+        host=os.getenv("CHROMA_HOST", "localhost"),
+        port=int(os.getenv("CHROMA_PORT", "8001"))  # This matches the port in docker-compose.yaml
+    )
+
 class ChromaDb(ABC):
     def __init__(
         self,
         embedding_function: EmbeddingFunction = DefaultEmbeddingFunction()
     ):
         self.embedding_function = embedding_function
-        # Connect to ChromaDB running in Docker
-        self.client = chromadb.HttpClient(
-            host="localhost",
-            port=8001  # This matches the port in docker-compose.yaml
-        )
+        # Connect to ChromaDB, by default the one running in Docker
+        self.client = create_chroma_client()
         self.name = None
     
     def create_or_get_collection(self, collection_name: str):
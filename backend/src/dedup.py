@@ -0,0 +1,328 @@
+# dedup.py
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+NUM_PERM = 64
+BANDS = 16
+SHINGLE_WORDS = 5
+_MASK = np.uint64(0xFFFFFFFF)
+
+# Fixed permutations, signatures stay comparable across processes and runs
+_rng = np.random.default_rng(20220511)
+_PERM_A = _rng.integers(1, 2**32, size=NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_PERM_B = _rng.integers(0, 2**32, size=NUM_PERM, dtype=np.uint64)
+
+
+def shingles(text: str, size: int = SHINGLE_WORDS) -> np.ndarray:
+    """Hashes of the overlapping word n-grams of the normalized text"""
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        grams = [" ".join(words)]
+    else:
+        grams = [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+    return np.fromiter((zlib.crc32(g.encode()) for g in set(grams)), dtype=np.uint64)
+
+
+def minhash(text: str) -> np.ndarray:
+    """MinHash signature, the share of equal positions estimates the Jaccard similarity"""
+    hashes = shingles(text)
+    permuted = (hashes[:, None] * _PERM_A + _PERM_B) & _MASK
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.count_nonzero(a == b)) / len(a)
+
+
+def _band_keys(signature: np.ndarray) -> List[str]:
+    rows = NUM_PERM // BANDS
+    return [
+        hashlib.blake2b(signature[i * rows:(i + 1) * rows].tobytes(), digest_size=8).hexdigest()
+        for i in range(BANDS)
+    ]
+
+
+def copy_flags(metadata: Dict) -> Dict:
+    """Keys marking a canonical section as present in a state and a city"""
+    flags = {}
+    if metadata.get("state"):
+        flags[f"state__{metadata['state']}"] = True
+    if metadata.get("city"):
+        flags[f"city__{metadata['city']}"] = True
+    return flags
+
+
+class DedupIndex:
+    """
+    Near-duplicate sections of one collection, found with MinHash and LSH.
+
+    Many cities adopt the same model codes, so their exports repeat whole
+    chapters almost word for word. The first copy of a section becomes the
+    canonical one and is embedded and stored, later copies whose estimated
+    Jaccard similarity with it reaches the threshold are only recorded as
+    references to it, with their own metadata.
+
+    Signatures are split into BANDS bands, sections sharing any band are
+    candidates and are then compared on the whole signature. The index is a
+    SQLite file next to the data so ingestion runs in separate processes and
+    later re-ingestions see the same canonical sections.
+    """
+
+    def __init__(self, collection: str, path: Optional[str] = None, threshold: float = 0.9):
+        """
+        Args:
+            collection: Collection the sections are stored in
+            path: SQLite file, defaults to DEDUP_DB
+            threshold: Estimated Jaccard similarity from which sections are duplicates
+        """
+        self.collection = collection
+        self.path = path or os.getenv("DEDUP_DB", "data/dedup.sqlite")
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS canonicals (
+                    collection TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    signature BLOB NOT NULL,
+                    metadata TEXT NOT NULL,
+                    stored INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (collection, id)
+                );
+                CREATE TABLE IF NOT EXISTS bands (
+                    collection TEXT NOT NULL,
+                    band INTEGER NOT NULL,
+                    key TEXT NOT NULL,
+                    id TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS bands_lookup ON bands (collection, band, key);
+                CREATE TABLE IF NOT EXISTS refs (
+                    collection TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    canonical_id TEXT NOT NULL,
+                    metadata TEXT NOT NULL,
+                    tokens INTEGER NOT NULL,
+                    bytes INTEGER NOT NULL,
+                    content TEXT,
+                    PRIMARY KEY (collection, id)
+                );
+                CREATE INDEX IF NOT EXISTS refs_canonical ON refs (collection, canonical_id);
+            """)
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(refs)")]
+            if "content" not in columns:
+                # Indexes written before references kept their own text
+                conn.execute("ALTER TABLE refs ADD COLUMN content TEXT")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30.0)
+
+    def assign(
+        self,
+        section_id: str,
+        text: str,
+        metadata: Dict,
+        tokens: int,
+        size: int
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Record a section, as a reference when a near-duplicate is already stored.
+
+        A section kept before as canonical stays canonical, its signature is
+        refreshed. A section referenced before is matched again, its text may
+        have changed.
+
+        Args:
+            section_id: Stable ID of the section
+            text: Section text compared between copies, kept for references
+            metadata: Metadata of this copy
+            tokens: Estimated embedding tokens a reference saves
+            size: Document bytes a reference saves
+
+        Returns:
+            (ID of the canonical section it duplicates or None when it is
+            stored itself, the canonical it referenced before if any)
+        """
+        signature = minhash(text)
+        keys = _band_keys(signature)
+        with self._lock, self._connect() as conn:
+            previous = conn.execute(
+                "SELECT canonical_id FROM refs WHERE collection = ? AND id = ?", (self.collection, section_id)
+            ).fetchone()
+            previous = previous[0] if previous else None
+            conn.execute("DELETE FROM refs WHERE collection = ? AND id = ?", (self.collection, section_id))
+            is_canonical = conn.execute(
+                "SELECT 1 FROM canonicals WHERE collection = ? AND id = ?", (self.collection, section_id)
+            ).fetchone()
+            if not is_canonical:
+                canonical_id = self._match(conn, signature, keys, section_id)
+                if canonical_id is not None:
+                    conn.execute(
+                        "INSERT INTO refs (collection, id, canonical_id, metadata, tokens, bytes, content) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (self.collection, section_id, canonical_id, json.dumps(metadata), tokens, size, text)
+                    )
+                    return canonical_id, previous
+
+            conn.execute("DELETE FROM bands WHERE collection = ? AND id = ?", (self.collection, section_id))
+            conn.execute(
+                "INSERT INTO canonicals VALUES (?, ?, ?, ?, 0) ON CONFLICT (collection, id) "
+                "DO UPDATE SET signature = excluded.signature, metadata = excluded.metadata",
+                (self.collection, section_id, signature.tobytes(), json.dumps(metadata))
+            )
+            conn.executemany(
+                "INSERT INTO bands VALUES (?, ?, ?, ?)",
+                [(self.collection, band, key, section_id) for band, key in enumerate(keys)]
+            )
+            return None, previous
+
+    def _match(self, conn: sqlite3.Connection, signature: np.ndarray, keys: List[str], section_id: str) -> Optional[str]:
+        candidates = set()
+        for band, key in enumerate(keys):
+            rows = conn.execute(
+                "SELECT id FROM bands WHERE collection = ? AND band = ? AND key = ?", (self.collection, band, key)
+            ).fetchall()
+            candidates.update(row[0] for row in rows)
+        candidates.discard(section_id)
+        best, best_score = None, self.threshold
+        for candidate in sorted(candidates):
+            row = conn.execute(
+                "SELECT signature FROM canonicals WHERE collection = ? AND id = ? AND stored = 1",
+                (self.collection, candidate)
+            ).fetchone()
+            if row is None:
+                continue  # Still being embedded by another writer, not referenceable yet
+            score = similarity(signature, np.frombuffer(row[0], dtype=np.uint32))
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best
+
+    def mark_stored(self, section_ids: List[str]):
+        """Canonical sections written to the collection, later copies may now reference them"""
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "UPDATE canonicals SET stored = 1 WHERE collection = ? AND id = ?",
+                [(self.collection, id_) for id_ in section_ids]
+            )
+
+    def canonical_metadata(self, canonical_id: str) -> Dict:
+        """
+        Metadata stored with a canonical section.
+
+        Its own metadata and a flag for every state and city holding a copy,
+        so filters on any copy's jurisdiction match. The copies themselves
+        stay in the index, see references.
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT metadata FROM canonicals WHERE collection = ? AND id = ?", (self.collection, canonical_id)
+            ).fetchone()
+            refs = conn.execute(
+                "SELECT metadata FROM refs WHERE collection = ? AND canonical_id = ?",
+                (self.collection, canonical_id)
+            ).fetchall()
+        metadata = json.loads(row[0])
+        result = dict(metadata)
+        for copy in [metadata] + [json.loads(ref[0]) for ref in refs]:
+            result.update(copy_flags(copy))
+        return result
+
+    def references(self, canonical_ids: List[str]) -> Dict[str, List[Dict]]:
+        """
+        Copies referencing each canonical section, in ID order.
+
+        Returns:
+            Per canonical ID, dicts with the "id", "metadata" and "content"
+            of each copy, content is None for copies indexed before their
+            text was kept
+        """
+        if not canonical_ids:
+            return {}
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT canonical_id, id, metadata, content FROM refs WHERE collection = ? "
+                f"AND canonical_id IN ({', '.join('?' * len(canonical_ids))}) ORDER BY id",
+                (self.collection, *canonical_ids)
+            ).fetchall()
+        copies: Dict[str, List[Dict]] = {}
+        for canonical_id, id_, metadata, content in rows:
+            copies.setdefault(canonical_id, []).append({"id": id_, "metadata": json.loads(metadata), "content": content})
+        return copies
+
+    def report(self, embedding_dim: int = 768) -> Dict:
+        """
+        What deduplication saved in this collection.
+
+        Args:
+            embedding_dim: Dimension of the collection's embeddings, for the
+                estimate of the vector bytes not stored
+
+        Returns:
+            Section counts, embedding tokens not spent and index bytes not stored
+        """
+        with self._connect() as conn:
+            canonical = conn.execute(
+                "SELECT COUNT(*) FROM canonicals WHERE collection = ?", (self.collection,)
+            ).fetchone()[0]
+            references, tokens, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(tokens), 0), COALESCE(SUM(bytes), 0) FROM refs WHERE collection = ?",
+                (self.collection,)
+            ).fetchone()
+        sections = canonical + references
+        return {
+            "collection": self.collection,
+            "sections": sections,
+            "stored": canonical,
+            "references": references,
+            "duplicate_ratio": references / sections if sections else 0.0,
+            "embedding_tokens_saved": tokens,
+            "index_bytes_saved": size + references * embedding_dim * 4
+        }
+
+    def copy_to(self, collection: str):
+        """Copy the index to a collection holding the same sections, such as a migrated version"""
+        with self._lock, self._connect() as conn:
+            for table in ("canonicals", "bands", "refs"):
+                conn.execute(f"DELETE FROM {table} WHERE collection = ?", (collection,))
+                columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")][1:]
+                conn.execute(
+                    f"INSERT INTO {table} SELECT ?, {', '.join(columns)} FROM {table} WHERE collection = ?",
+                    (collection, self.collection)
+                )
+
+
+def forget_collection(collection: str, path: Optional[str] = None):
+    """Drop the index of a deleted collection, nothing to do if no index was ever written"""
+    path = path or os.getenv("DEDUP_DB", "data/dedup.sqlite")
+    if not os.path.exists(path):
+        return
+    with sqlite3.connect(path, timeout=30.0) as conn:
+        for table in ("canonicals", "bands", "refs"):
+            try:
+                conn.execute(f"DELETE FROM {table} WHERE collection = ?", (collection,))
+            except sqlite3.OperationalError:
+                return  # Tables not created yet
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Report what near-duplicate detection saved")
+    parser.add_argument("collection")
+    parser.add_argument("--embedding-dim", type=int, default=768)
+    args = parser.parse_args()
+    print(json.dumps(DedupIndex(args.collection).report(args.embedding_dim), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+# embedding_migration.py
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from .collection_versions import (
+    DEFAULT_GRACE_SECONDS, AliasRegistry, begin_version, collect_garbage,
+    publish_version, version_name
+)
+from .dedup import DedupIndex
+from .embeddings import TogetherEmbeddingFunction
+from .rate_limit import AdaptiveRateLimiter
+from .sharding import create_collection, open_collection
+from .utils import estimate_tokens
+
+load_dotenv()
+
+MAX_EMBED_RETRIES = 5
+
+
+def migration_record_id(alias: str) -> str:
+    return f"migration:{alias}"
+
+
+def top_k_overlap(served_ids: List[str], shadow_ids: List[str]) -> float:
+    """Share of the served results the other index also returned, 1.0 for an empty result"""
+    if not served_ids:
+        return 1.0
+    return len(set(served_ids) & set(shadow_ids)) / len(served_ids)
+
+
+def _collection_names(client) -> List[str]:
+    return [c if isinstance(c, str) else c.name for c in client.list_collections()]
+
+
+def start_migration(registry: AliasRegistry, alias: str, model_name: str, api_key: str) -> Dict:
+    """
+    Create the next version of an alias for a new embedding model.
+
+    The version is empty until backfill fills it. From the moment the
+    migration record exists, writers that pick it up also write every batch
+    to the new version, and readers keep serving the live one.
+
+    Returns:
+        The migration record
+
+    Raises:
+        ValueError: The alias has no collection or a migration is already running
+    """
+    if registry.get_record(migration_record_id(alias)) is not None:
+        raise ValueError(f"A migration of {alias} is already running, finish or abort it first")
+    source = registry.resolve(alias)
+    if source is None:
+        if alias not in _collection_names(registry.client):
+            raise ValueError(f"No collection to migrate for {alias}")
+        source = alias  # Built before aliases, published on cutover like a rebuild
+
+    version = begin_version(registry, alias)
+    target = version_name(alias, version)
+    # The new version keeps the shard layout and deduplication of the live one
+    source_metadata = open_collection(registry.client, source).metadata or {}
+    create_collection(
+        registry.client,
+        target,
+        TogetherEmbeddingFunction(api_key=api_key, model_name=model_name),
+        metadata={"hnsw:space": "cosine", "embedding_model": model_name, "dedup": bool(source_metadata.get("dedup"))},
+        shard_by=source_metadata.get("shard_by")
+    )
+    record = {
+        "kind": "migration",
+        "alias": alias,
+        "source": source,
+        "target": target,
+        "version": version,
+        "model": model_name,
+        "status": "backfilling",
+        "backfilled": 0,
+        "started_at": time.time(),
+    }
+    registry.put_record(migration_record_id(alias), record)
+    print(f"Migrating {source} to {model_name} in {target}")
+    return record
+
+
+def _require_migration(registry: AliasRegistry, alias: str) -> Dict:
+    record = registry.get_record(migration_record_id(alias))
+    if record is None:
+        raise ValueError(f"No migration of {alias} is running")
+    return record
+
+
+async def _embed_with_retry(
+    embedding_function: TogetherEmbeddingFunction,
+    limiter: AdaptiveRateLimiter,
+    documents: List[str]
+) -> List[List[float]]:
+    tokens = sum(estimate_tokens(d) for d in documents)
+    for attempt in range(MAX_EMBED_RETRIES + 1):
+        await limiter.acquire(tokens)
+        try:
+            embeddings = await asyncio.to_thread(embedding_function, documents)
+        except Exception as e:
+            if attempt == MAX_EMBED_RETRIES:
+                raise
+            delay = limiter.on_rate_limited()
+            print(f"Embedding failed ({str(e)}), retrying in {delay:.1f}s at {limiter.requests_per_second:.2f} req/s")
+            continue
+        limiter.on_success()
+        return embeddings
+
+
+async def _copy_page(
+    target,
+    embedding_function: TogetherEmbeddingFunction,
+    limiter: AdaptiveRateLimiter,
+    page: Dict
+):
+    embeddings = await _embed_with_retry(embedding_function, limiter, page["documents"])
+    await asyncio.to_thread(
+        target.upsert,
+        ids=page["ids"],
+        documents=page["documents"],
+        metadatas=page["metadatas"],
+        embeddings=embeddings
+    )
+
+
+async def reconcile(
+    registry: AliasRegistry,
+    alias: str,
+    api_key: str,
+    limiter: AdaptiveRateLimiter,
+    page_size: int = 256
+) -> int:
+    """
+    Copy sections the target is missing or holds a different version of.
+
+    Covers writes that landed before a writer noticed the migration, or that
+    raced with the backfill of their page. Only the differing sections are
+    embedded again.
+
+    Returns:
+        Number of sections copied
+    """
+    record = _require_migration(registry, alias)
+    source = open_collection(registry.client, record["source"])
+    target = open_collection(registry.client, record["target"])
+    embedding_function = TogetherEmbeddingFunction(api_key=api_key, model_name=record["model"], raise_on_error=True)
+
+    copied = 0
+    offset = 0
+    while True:
+        page = await asyncio.to_thread(source.get, limit=page_size, offset=offset, include=["documents", "metadatas"])
+        if not page["ids"]:
+            break
+        offset += len(page["ids"])
+        existing = await asyncio.to_thread(target.get, ids=page["ids"], include=["documents", "metadatas"])
+        current = {id_: (d, m) for id_, d, m in zip(existing["ids"], existing["documents"], existing["metadatas"])}
+        stale, relabel = [], []
+        for i, id_ in enumerate(page["ids"]):
+            document, metadata = current.get(id_, (None, None))
+            if document != page["documents"][i]:
+                stale.append(i)
+            elif metadata != page["metadatas"][i]:
+                relabel.append(i)
+        if relabel:
+            # Only the metadata differs, such as references added to a deduplicated section
+            await asyncio.to_thread(
+                target.update,
+                ids=[page["ids"][i] for i in relabel],
+                metadatas=[page["metadatas"][i] for i in relabel]
+            )
+        if not stale:
+            continue
+        await _copy_page(target, embedding_function, limiter, {
+            "ids": [page["ids"][i] for i in stale],
+            "documents": [page["documents"][i] for i in stale],
+            "metadatas": [page["metadatas"][i] for i in stale],
+        })
+        copied += len(stale)
+    return copied
+
+
+async def backfill(
+    registry: AliasRegistry,
+    alias: str,
+    api_key: str,
+    tokens_per_minute: float = float(os.getenv("MIGRATION_TOKENS_PER_MINUTE", "60000")),
+    requests_per_second: float = float(os.getenv("MIGRATION_REQUESTS_PER_SECOND", "2")),
+    page_size: int = 64
+) -> Dict:
+    """
+    Embed every section of the live version with the new model.
+
+    Runs outside the serving processes with its own rate limiter, so the
+    budget given here is all the backfill takes from the account's quota
+    and queries keep their latency. Progress is saved after every page, an
+    interrupted backfill resumes where it stopped. When the pages are done
+    a reconcile pass picks up anything written meanwhile and the migration
+    is marked ready for cutover.
+
+    Args:
+        registry: Registry of the alias
+        alias: Alias being migrated
+        api_key: Together AI API key
+        tokens_per_minute: Embedding token budget of the backfill
+        requests_per_second: Embedding request budget of the backfill
+        page_size: Sections read and embedded per request
+
+    Returns:
+        The updated migration record
+    """
+    record = _require_migration(registry, alias)
+    limiter = AdaptiveRateLimiter(requests_per_second=requests_per_second, tokens_per_minute=tokens_per_minute)
+    source = open_collection(registry.client, record["source"])
+    target = open_collection(registry.client, record["target"])
+    embedding_function = TogetherEmbeddingFunction(api_key=api_key, model_name=record["model"], raise_on_error=True)
+
+    started = time.perf_counter()
+    offset = int(record["backfilled"])
+    total = source.count()
+    while True:
+        page = await asyncio.to_thread(source.get, limit=page_size, offset=offset, include=["documents", "metadatas"])
+        if not page["ids"]:
+            break
+        await _copy_page(target, embedding_function, limiter, page)
+        offset += len(page["ids"])
+        record["backfilled"] = offset
+        registry.put_record(migration_record_id(alias), record)
+        print(f"Backfilled {offset}/{total} sections of {record['target']}")
+
+    copied = await reconcile(registry, alias, api_key, limiter, page_size)
+    record["status"] = "ready"
+    record["backfilled_at"] = time.time()
+    registry.put_record(migration_record_id(alias), record)
+    print(f"Backfill of {record['target']} complete in {time.perf_counter() - started:.1f}s, {copied} sections reconciled")
+    return record
+
+
+def migration_status(registry: AliasRegistry, alias: str) -> Dict:
+    """Migration record with the document counts of both collections"""
+    record = _require_migration(registry, alias)
+    source = open_collection(registry.client, record["source"])
+    target = open_collection(registry.client, record["target"])
+    return {**record, "source_count": source.count(), "target_count": target.count()}
+
+
+def compare(registry: AliasRegistry, alias: str, api_key: str, queries: List[str], k: int = 5) -> Dict:
+    """
+    Top-k overlap of the live and migrated versions on a set of queries.
+
+    Returns:
+        Mean overlap and the overlap of every query
+    """
+    from .ordinance_db import DEFAULT_EMBEDDING_MODEL
+
+    record = _require_migration(registry, alias)
+    source = open_collection(registry.client, record["source"])
+    # Collections from before models were recorded use the configured model
+    source_model = (source.metadata or {}).get("embedding_model", os.getenv("EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL))
+    source = open_collection(
+        registry.client, record["source"], TogetherEmbeddingFunction(api_key=api_key, model_name=source_model)
+    )
+    target = open_collection(
+        registry.client, record["target"], TogetherEmbeddingFunction(api_key=api_key, model_name=record["model"])
+    )
+    overlaps = {}
+    for query in queries:
+        served = source.query(query_texts=[query], n_results=k)["ids"][0]
+        shadow = target.query(query_texts=[query], n_results=k)["ids"][0]
+        overlaps[query] = top_k_overlap(served, shadow)
+    mean = sum(overlaps.values()) / len(overlaps) if overlaps else 1.0
+    return {"source_model": source_model, "target_model": record["model"], "mean_overlap": mean, "queries": overlaps}
+
+
+def cut_over(
+    registry: AliasRegistry,
+    alias: str,
+    api_key: str,
+    grace_seconds: float = DEFAULT_GRACE_SECONDS
+) -> Optional[str]:
+    """
+    Switch the alias to the migrated version.
+
+    A last reconcile pass copies anything written since the backfill, then
+    the alias moves like after a rebuild: readers switch collection and
+    query embedding model together on their next alias check, and the old
+    version is deleted after the grace period.
+
+    Returns:
+        The collection the alias pointed at before
+
+    Raises:
+        RuntimeError: The backfill is not complete or the target is short of documents
+    """
+    record = _require_migration(registry, alias)
+    if record["status"] != "ready":
+        raise RuntimeError(f"Backfill of {record['target']} is not complete ({record['backfilled']} sections)")
+    limiter = AdaptiveRateLimiter(
+        requests_per_second=float(os.getenv("MIGRATION_REQUESTS_PER_SECOND", "2")),
+        tokens_per_minute=float(os.getenv("MIGRATION_TOKENS_PER_MINUTE", "60000"))
+    )
+    asyncio.run(reconcile(registry, alias, api_key, limiter))
+
+    status = migration_status(registry, alias)
+    if status["target_count"] < status["source_count"]:
+        raise RuntimeError(
+            f"{record['target']} has {status['target_count']} documents, {record['source']} has {status['source_count']}"
+        )
+    if (open_collection(registry.client, record["source"]).metadata or {}).get("dedup"):
+        # Later ingestion into the new version must find the same canonical sections
+        DedupIndex(record["source"]).copy_to(record["target"])
+    previous = publish_version(registry, alias, int(record["version"]))
+    registry.delete_record(migration_record_id(alias))
+    collect_garbage(registry, alias, grace_seconds)
+    return previous
+
+
+def abort(registry: AliasRegistry, alias: str):
+    """Stop a migration and delete its version, the alias is left untouched"""
+    record = _require_migration(registry, alias)
+    registry.delete_record(migration_record_id(alias))
+    registry.mark(record["target"], alias, status="failed", error="Migration aborted")
+    collect_garbage(registry, alias)
+    print(f"Aborted migration of {alias}, deleted {record['target']}")
+
+
+def main():
+    from .db import create_chroma_client
+
+    parser = argparse.ArgumentParser(description="Move an ordinance collection to a new embedding model without downtime")
+    parser.add_argument("command", choices=["start", "backfill", "status", "compare", "cutover", "abort"])
+    parser.add_argument("--alias", default="combined_ordinances")
+    parser.add_argument("--model", help="New embedding model, required by start")
+    parser.add_argument("--queries", nargs="*", default=[], help="Queries compared by compare")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--tokens-per-minute", type=float, default=float(os.getenv("MIGRATION_TOKENS_PER_MINUTE", "60000")))
+    parser.add_argument("--requests-per-second", type=float, default=float(os.getenv("MIGRATION_REQUESTS_PER_SECOND", "2")))
+    args = parser.parse_args()
+
+    api_key = os.getenv("TOGETHER_API_KEY")
+    if not api_key:
+        raise ValueError("TOGETHER_API_KEY environment variable is not set")
+    registry = AliasRegistry(create_chroma_client())
+
+    if args.command == "start":
+        if not args.model:
+            parser.error("start requires --model")
+        result = start_migration(registry, args.alias, args.model, api_key)
+    elif args.command == "backfill":
+        result = asyncio.run(backfill(
+            registry, args.alias, api_key,
+            tokens_per_minute=args.tokens_per_minute,
+            requests_per_second=args.requests_per_second
+        ))
+    elif args.command == "status":
+        result = migration_status(registry, args.alias)
+    elif args.command == "compare":
+        result = compare(registry, args.alias, api_key, args.queries, args.k)
+    elif args.command == "cutover":
+        result = {"previous": cut_over(registry, args.alias, api_key)}
+    else:
+        abort(registry, args.alias)
+        result = {"aborted": args.alias}
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,18 @@
+import os
 from chromadb.api.types import Documents, EmbeddingFunction
-from typing import List
+from typing import List, Optional
 from together import Together
 import numpy as np
+from .metrics import stage_timer
 
 class TogetherEmbeddingFunction(EmbeddingFunction):
     def __init__(
         self, 
         api_key: str,
         model_name: str = "togethercomputer/m2-bert-80M-32k-retrieval",
-        batch_size: int = 32  # Together might have rate limits, so we batch
+        batch_size: int = 32,  # Together might have rate limits, so we batch
+        base_url: Optional[str] = None,
+        raise_on_error: bool = False
     ):
         """
         Initialize Together AI embedding function
@@ -17,10 +21,15 @@ class TogetherEmbeddingFunction(EmbeddingFunction):
             api_key: Together AI API key
             model_name: Model to use for embeddings
             batch_size: Number of texts to embed at once
+            base_url: API base URL, defaults to TOGETHER_BASE_URL or the
+                public endpoint, benchmarks point it at a local stand-in
+            raise_on_error: Raise failed requests instead of returning zero
+                vectors, for callers that retry such as migration backfills
         """
-        self.client = Together(api_key=api_key)
+        self.client = Together(api_key=api_key, base_url=base_url or os.getenv("TOGETHER_BASE_URL"))
         self.model_name = model_name
         self.batch_size = batch_size
+        self.raise_on_error = raise_on_error
     
     def _batch_embed(self, texts: List[str]) -> List[List[float]]:
         """
@@ -43,6 +52,8 @@ class TogetherEmbeddingFunction(EmbeddingFunction):
             
         except Exception as e:
             print(f"Error in batch embedding: {str(e)}")
+            if self.raise_on_error:
+                raise
             # Return zero embeddings in case of error
             # You might want to handle this differently based on your needs
             dim = 1024  # Together model dimension
@@ -61,9 +72,10 @@ class TogetherEmbeddingFunction(EmbeddingFunction):
         all_embeddings = []
         
         # Process in batches
-        for i in range(0, len(texts), self.batch_size):
-            batch = texts[i:i + self.batch_size]
-            batch_embeddings = self._batch_embed(batch)
-            all_embeddings.extend(batch_embeddings)
+        with stage_timer("embed", model=self.model_name, cache="miss"):
+            for i in range(0, len(texts), self.batch_size):
+                batch = texts[i:i + self.batch_size]
+                batch_embeddings = self._batch_embed(batch)
+                all_embeddings.extend(batch_embeddings)
         
         return all_embeddings
\ No newline at end of file
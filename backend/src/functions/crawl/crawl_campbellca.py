@@ -1,67 +1,77 @@
 import asyncio
+import os
+from typing import Dict, List, Optional
 
-from bs4 import BeautifulSoup
 from restack_ai.function import function, log
-import requests
-import pdfplumber
-import json
+from pydantic import BaseModel, Field
 
-@function.defn(name="crawl_campbellca")
-async def crawl_campbellca():
-    try:
-        url = 'https://www.campbellca.gov/DocumentCenter/View/6775/Smoke-Alarms-and-Carbon-Monoxide-Alarms--Plan-Submittal'
-        # Send a GET request to the URL
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an error for bad responses
-
-        # Define metadata
-        metadata = {
-            "title": "Smoke and Carbon Monoxide Alarms",
-            "chapter": "1",
-            "section": "1",
-            "state": "CA",
-            "city": "Campbell",
-            "subtitle": "Adoption.",
-            "url": url
-        }
+from src.crawler import Crawler, extract_text
+from src.pdf_extraction import extract_sections
 
-        # Check if the content is a PDF
-        if "application/pdf" in response.headers.get("Content-Type", ""):
-            with open("document.pdf", "wb") as f:
-                f.write(response.content)
-            
-            # Use pdfplumber to extract text from the PDF
-            content = ""
-            with pdfplumber.open("document.pdf") as pdf:
-                for page in pdf.pages:
-                    content += page.extract_text() + "\n"
+DEFAULT_URLS = [
+    'https://www.campbellca.gov/DocumentCenter/View/6775/Smoke-Alarms-and-Carbon-Monoxide-Alarms--Plan-Submittal'
+]
 
-            # Structure the output as a JSON object
-            output = {
-                "metadata": metadata,
-                "content": content
-            }
+# Known documents, other URLs get a title from their slug
+DOCUMENT_METADATA = {
+    DEFAULT_URLS[0]: {
+        "title": "Smoke and Carbon Monoxide Alarms",
+        "chapter": "1",
+        "section": "1",
+        "subtitle": "Adoption."
+    }
+}
 
-            log.info("crawl_campbellca", extra={"output": output})
-            return json.dumps(output)  # Convert the dictionary to a JSON string
+class CrawlCampbellcaInputParams(BaseModel):
+    urls: List[str] = Field(default_factory=lambda: list(DEFAULT_URLS), description="Document center URLs to crawl")
 
-        else:
-            # If it's not a PDF, use BeautifulSoup as a fallback
-            soup = BeautifulSoup(response.content, 'html.parser')
-            content = soup.get_text()
+def document_metadata(url: str, index: int) -> Dict:
+    metadata = {
+        "title": url.rstrip('/').rsplit('/', 1)[-1].replace('-', ' ').strip(),
+        "chapter": "1",
+        "section": str(index + 1),
+        "subtitle": "",
+        **DOCUMENT_METADATA.get(url, {})
+    }
+    metadata.update({"state": "CA", "city": "Campbell", "url": url})
+    return metadata
 
-            # Structure the output as a JSON object
-            output = {
-                "metadata": metadata,
-                "content": content
-            }
+@function.defn(name="crawl_campbellca")
+async def crawl_campbellca(input: Optional[CrawlCampbellcaInputParams] = None):
+    urls = input.urls if input else list(DEFAULT_URLS)
+    async with Crawler(
+        cache_dir=os.getenv("CRAWL_CACHE_DIR", "data/crawl_cache"),
+        per_host_concurrency=int(os.getenv("CRAWL_PER_HOST_CONCURRENCY", "4")),
+        per_host_rate=float(os.getenv("CRAWL_PER_HOST_RATE", "2.0"))
+    ) as crawler:
+        results = await crawler.fetch_all(urls)
 
-            log.info("crawl_campbellca", extra={"output": output})
-            return output
+    documents = []
+    for index, result in enumerate(results):
+        if not result.ok:
+            log.error("crawl_campbellca fetch failed", url=result.url, error=result.error)
+            continue
+        metadata = document_metadata(result.url, index)
+        try:
+            if result.is_pdf:
+                # Pages are extracted in parallel from the in-memory bytes and split into sections
+                records, report = await asyncio.to_thread(extract_sections, result.content, metadata)
+                log.info("crawl_campbellca extracted pdf", url=result.url, pages=report.pages,
+                         sections=len(records), wall_seconds=report.wall_seconds,
+                         slowest_pages=report.slowest_pages, empty_pages=report.empty_pages)
+                documents.extend(records)
+            else:
+                content = await asyncio.to_thread(extract_text, result)
+                documents.append({"metadata": metadata, "content": content})
+        except Exception as e:
+            log.error("An error occurred while processing the document", url=result.url, error=e)
+            continue
 
-    except requests.exceptions.RequestException as e:
-        log.error("crawl_campbellca function failed", error=e)
-        raise e
-    except Exception as e:
-        log.error("An error occurred while processing the PDF", error=e)
-        raise e
+    log.info("crawl_campbellca", extra={
+        "fetched": len(results),
+        "from_cache": sum(r.from_cache for r in results),
+        "documents": len(documents)
+    })
+    if results and not documents:
+        raise RuntimeError(f"No document could be crawled from {len(results)} URLs")
+    return documents
@@ -0,0 +1,50 @@
+import asyncio
+import re
+from typing import List
+
+from restack_ai.function import function, log
+from pydantic import BaseModel, Field
+
+from src.crawler import shared_crawler, extract_text
+
+
+class CrawlUrlsInput(BaseModel):
+    urls: List[str] = Field(default_factory=list, description="Pages to crawl")
+    max_chars: int = Field(default=8000, description="Text kept per page, bounds the summary prompt")
+    deadline_seconds: float = Field(default=45.0, description="Pages not fetched by then are skipped, keep it below the step timeout")
+
+
+def page_text(result, max_chars: int) -> str:
+    text = re.sub(r"\s+", " ", extract_text(result)).strip()
+    return text[:max_chars]
+
+
+@function.defn(name="crawl_urls")
+async def crawl_urls(input: CrawlUrlsInput):
+    """
+    Fetch all pages at once through the worker's shared crawler.
+
+    Pages that fail to download or parse, or are still downloading when
+    the deadline passes, are left out. The result lists the text of the
+    others as {"url", "content"}.
+    """
+    results = await shared_crawler().fetch_all(input.urls, deadline=input.deadline_seconds)
+
+    async def to_page(result):
+        if not result.ok:
+            log.error("crawl_urls fetch failed", url=result.url, error=result.error)
+            return None
+        try:
+            content = await asyncio.to_thread(page_text, result, input.max_chars)
+        except Exception as e:
+            log.error("crawl_urls could not extract text", url=result.url, error=e)
+            return None
+        return {"url": result.url, "content": content} if content else None
+
+    pages = [page for page in await asyncio.gather(*[to_page(r) for r in results]) if page]
+    log.info("crawl_urls", extra={
+        "requested": len(input.urls),
+        "crawled": len(pages),
+        "slowest_seconds": max((r.elapsed for r in results), default=0.0)
+    })
+    return pages
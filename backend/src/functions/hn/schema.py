@@ -1,5 +1,12 @@
+from typing import Dict, List
+
 from pydantic import BaseModel, Field
 
 class HnSearchInput(BaseModel):
     query: str = Field(default=None, description="The query for search")
-    count: int = Field(default=5, description="The number of results to return")
\ No newline at end of file
+    count: int = Field(default=5, description="The number of results to return")
+    only_new: bool = Field(default=True, description="Leave out stories marked seen by earlier runs")
+
+class HnMarkSeenInput(BaseModel):
+    query: str = Field(default=None, description="The query the stories were found with")
+    hits: List[Dict] = Field(default_factory=list, description="Handled stories, their objectID and created_at_i")
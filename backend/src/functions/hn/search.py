@@ -1,18 +1,45 @@
-import requests
+import asyncio
+import os
+from typing import Optional
 from restack_ai.function import function, log
-from src.functions.hn.schema import HnSearchInput
+from src.functions.hn.schema import HnMarkSeenInput, HnSearchInput
+from src.hn_client import HnClient
+
+_client: Optional[HnClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_hn_client() -> HnClient:
+    """The worker's shared client, its cache lives as long as the event loop"""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:
+        _client = HnClient(cache_ttl=float(os.getenv("HN_CACHE_TTL", "300")))
+        _client_loop = loop
+    return _client
 
 @function.defn(name="hn_search")
 async def hn_search(input: HnSearchInput):
     try:
-        # Fetch the latest stories IDs
-        response = requests.get(
-            f"https://hn.algolia.com/api/v1/search_by_date?tags=show_hn&query={input.query}&hitsPerPage={input.count}&numericFilters=points>2"
-        )
-        data = response.json()
+        client = get_hn_client()
+        if input.only_new:
+            data = await client.search_new(input.query, input.count)
+        else:
+            data = await client.search(input.query, input.count)
 
-        log.info("hnSearch", extra={"data": data})
+        log.info("hnSearch", extra={"hits": len(data.get("hits", [])), "skipped": data.get("skippedHits", 0)})
         return data
     except Exception as error:
         log.error("hn_search function failed", error=error)
-        raise error
\ No newline at end of file
+        raise error
+
+@function.defn(name="hn_mark_seen")
+async def hn_mark_seen(input: HnMarkSeenInput):
+    """Leave stories out of later only_new searches, run after the workflow has handled them"""
+    try:
+        await get_hn_client().mark_seen(input.query, input.hits)
+        log.info("hnMarkSeen", extra={"hits": len(input.hits)})
+        return len(input.hits)
+    except Exception as error:
+        log.error("hn_mark_seen function failed", error=error)
+        raise error
@@ -0,0 +1,90 @@
+from restack_ai.function import function, log, FunctionFailure
+import asyncio
+import os
+from typing import List, Optional
+from pydantic import BaseModel
+from dotenv import load_dotenv
+
+from src.collection_versions import (
+    AliasRegistry, begin_version, discard_version, finish_version, version_name, DEFAULT_GRACE_SECONDS
+)
+from src.db import create_chroma_client
+from src.ordinance_db import OrdinanceDBWithTogether
+
+load_dotenv()
+
+
+class BeginCollectionVersionInputParams(BaseModel):
+    alias: str
+    # Retries with the same build_id get the version reserved by the first attempt
+    build_id: Optional[str] = None
+
+
+class PublishCollectionVersionInputParams(BaseModel):
+    alias: str
+    version: int
+    written: int
+    smoke_query: Optional[str] = None
+    min_count: int = 1
+    grace_seconds: float = DEFAULT_GRACE_SECONDS
+
+
+class DiscardCollectionVersionInputParams(BaseModel):
+    alias: str
+    version: int
+    failures: List[str]
+
+
+def _begin(alias: str, build_id: Optional[str] = None) -> dict:
+    registry = AliasRegistry(create_chroma_client())
+    version = begin_version(registry, alias, build_id)
+    name = version_name(alias, version)
+    # Create it empty so the ingestion steps upsert into an existing collection
+    OrdinanceDBWithTogether(api_key=os.getenv('TOGETHER_API_KEY'), collection_name=name, force_recreate=True)
+    return {"version": version, "collection_name": name}
+
+
+def _publish(input: PublishCollectionVersionInputParams) -> dict:
+    name = version_name(input.alias, input.version)
+    db = OrdinanceDBWithTogether(api_key=os.getenv('TOGETHER_API_KEY'), collection_name=name)
+    previous = finish_version(
+        db, AliasRegistry(db.client), input.alias, input.version, input.written,
+        input.smoke_query, input.min_count, input.grace_seconds
+    )
+    return {"alias": input.alias, "collection_name": name, "previous": previous}
+
+
+def _discard(input: DiscardCollectionVersionInputParams) -> dict:
+    discard_version(AliasRegistry(create_chroma_client()), input.alias, input.version, input.failures)
+    return {"alias": input.alias, "collection_name": version_name(input.alias, input.version)}
+
+
+@function.defn(name="begin_collection_version")
+async def begin_collection_version(input: BeginCollectionVersionInputParams):
+    try:
+        return await asyncio.to_thread(_begin, input.alias, input.build_id)
+    except Exception as e:
+        log.error(f"Error creating a version of {input.alias}: {e}")
+        raise FunctionFailure(f"Error creating a version of {input.alias}: {e}", non_retryable=False)
+
+
+@function.defn(name="publish_collection_version")
+async def publish_collection_version(input: PublishCollectionVersionInputParams):
+    try:
+        return await asyncio.to_thread(_publish, input)
+    except RuntimeError as e:
+        # Validation failed, the version was discarded and the alias did not move
+        log.error(str(e))
+        raise FunctionFailure(str(e), non_retryable=True)
+    except Exception as e:
+        log.error(f"Error publishing {input.alias}: {e}")
+        raise FunctionFailure(f"Error publishing {input.alias}: {e}", non_retryable=False)
+
+
+@function.defn(name="discard_collection_version")
+async def discard_collection_version(input: DiscardCollectionVersionInputParams):
+    try:
+        return await asyncio.to_thread(_discard, input)
+    except Exception as e:
+        log.error(f"Error discarding a version of {input.alias}: {e}")
+        raise FunctionFailure(f"Error discarding a version of {input.alias}: {e}", non_retryable=False)
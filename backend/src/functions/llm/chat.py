@@ -1,38 +1,107 @@
-from llama_index.llms.together import TogetherLLM
 from restack_ai.function import function, log, FunctionFailure
-from llama_index.core.llms import ChatMessage, MessageRole
+import asyncio
 import os
+from typing import Optional
+import httpx
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
+from src.rate_limit import AdaptiveRateLimiter
+from src.utils import estimate_tokens
+
 load_dotenv()
 
+MODEL = "meta-llama/Llama-3.2-11B-Vision-Instruct-Turbo"
+MAX_TOKENS = 1024
+MAX_RATE_LIMIT_RETRIES = 5
+
 class FunctionInputParams(BaseModel):
     system_prompt: str
     user_prompt: str
 
-@function.defn(name="llm_chat")
-async def llm_chat(input: FunctionInputParams):
-    try:
+
+class TogetherChatClient:
+    """
+    Chat completions client shared by every llm_chat run of a worker.
+
+    Calls reuse one pooled HTTP connection to Together's OpenAI compatible
+    API and pass through one AdaptiveRateLimiter, so the queue can run many
+    calls at once without exceeding the account's quota. The raw HTTP
+    response gives the limiter the 429s and rate-limit headers it adapts to.
+    """
+
+    def __init__(self, api_key: str, base_url: Optional[str] = None, limiter: Optional[AdaptiveRateLimiter] = None):
+        self.limiter = limiter or AdaptiveRateLimiter(
+            requests_per_second=float(os.getenv("TOGETHER_REQUESTS_PER_SECOND", "10")),
+            tokens_per_minute=float(os.getenv("TOGETHER_TOKENS_PER_MINUTE", "180000"))
+        )
+        max_connections = int(os.getenv("LLM_CHAT_CONCURRENCY", "16"))
+        self._client = httpx.AsyncClient(
+            base_url=(base_url or os.getenv("TOGETHER_BASE_URL") or "https://api.together.xyz/v1").rstrip("/"),
+            headers={"Authorization": f"Bearer {api_key}"},
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(120.0, connect=10.0)
+        )
+
+    async def chat(self, system_prompt: str, user_prompt: str, max_tokens: int = MAX_TOKENS) -> str:
+        payload = {
+            "model": MODEL,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            "max_tokens": max_tokens
+        }
+        # Reserve the worst case, the difference is returned once usage is known
+        estimated = estimate_tokens(system_prompt) + estimate_tokens(user_prompt) + max_tokens
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            await self.limiter.acquire(estimated)
+            response = await self._client.post("/chat/completions", json=payload)
+            if response.status_code == 429:
+                delay = self.limiter.on_rate_limited(response.headers)
+                self.limiter.reconcile(estimated, 0)
+                log.info(f"Together rate limited, retrying in {delay:.1f}s ({self.limiter.requests_per_second:.2f} req/s)")
+                continue
+            response.raise_for_status()
+            self.limiter.on_success(response.headers)
+            body = response.json()
+            usage = body.get("usage") or {}
+            if usage.get("total_tokens") is not None:
+                self.limiter.reconcile(estimated, usage["total_tokens"])
+            return body["choices"][0]["message"]["content"]
+        raise RuntimeError(f"Still rate limited after {MAX_RATE_LIMIT_RETRIES} retries")
+
+
+_chat_client: Optional[TogetherChatClient] = None
+_chat_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_chat_client() -> TogetherChatClient:
+    """The worker's shared client, rebuilt only if the event loop changed"""
+    global _chat_client, _chat_client_loop
+    loop = asyncio.get_running_loop()
+    if _chat_client is None or _chat_client_loop is not loop:
         api_key = os.getenv("TOGETHER_API_KEY")
         if not api_key:
             log.error("TOGETHER_API_KEY environment variable is not set.")
             raise ValueError("TOGETHER_API_KEY environment variable is required.")
-    
-        llm = TogetherLLM(
-            model="meta-llama/Llama-3.2-11B-Vision-Instruct-Turbo", api_key=api_key
-        )
-        messages = [
-            ChatMessage(
-                role=MessageRole.SYSTEM, content=input.system_prompt
-            ),
-            ChatMessage(
-                role=MessageRole.USER, content=input.user_prompt
-            ),
-        ]
-        resp = llm.chat(messages)
-        return resp.message.content
-    except Exception as e:
+        _chat_client = TogetherChatClient(api_key=api_key)
+        _chat_client_loop = loop
+    return _chat_client
+
+
+@function.defn(name="llm_chat")
+async def llm_chat(input: FunctionInputParams):
+    try:
+        return await get_chat_client().chat(input.system_prompt, input.user_prompt)
+    except httpx.HTTPStatusError as e:
+        log.error(f"Error interacting with llm: {e}")
+        # Rejected requests fail the same way on retry, server errors may not
+        raise FunctionFailure(f"Error interacting with llm: {e}", non_retryable=e.response.status_code < 500)
+    except ValueError as e:
         log.error(f"Error interacting with llm: {e}")
         raise FunctionFailure(f"Error interacting with llm: {e}", non_retryable=True)
-  
\ No newline at end of file
+    except Exception as e:
+        # Timeouts and persistent rate limiting, the step's retry policy tries again
+        log.error(f"Error interacting with llm: {e}")
+        raise FunctionFailure(f"Error interacting with llm: {e}", non_retryable=False)
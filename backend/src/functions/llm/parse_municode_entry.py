@@ -1,25 +1,55 @@
 from restack_ai.function import function, log, FunctionFailure
+import asyncio
 import os
+import time
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
 from src.ordinance_db import OrdinanceDBWithTogether
+from src.parser import open_ordinances
 
 load_dotenv()
 
 
 class ParseMunicodeEntryInputParams(BaseModel):
     path: str
+    collection_name: str = "california_city_ordinances"
+
+
+def _parse_and_upsert(path: str, collection_name: str) -> dict:
+    """Parse one Excel export and upsert its sections, timing both phases"""
+    started = time.perf_counter()
+    # Streams the cached records instead when this export was parsed before
+    ordinances, cached = open_ordinances(path)
+    parsed = time.perf_counter()
+
+    db = OrdinanceDBWithTogether(
+        api_key=os.getenv('TOGETHER_API_KEY'),
+        collection_name=collection_name
+    )
+    written = db.upsert_ordinances(ordinances)
+    finished = time.perf_counter()
+    return {
+        "path": path,
+        "sections": written,
+        "duplicates": db.last_duplicates,
+        "cached_parse": cached,
+        "parse_seconds": parsed - started,
+        "upsert_seconds": finished - parsed,
+        "total_seconds": finished - started
+    }
+
 
 @function.defn(name="parse_municode_entry")
 async def parse_municode_entry(input: ParseMunicodeEntryInputParams):
     try:
-        db = OrdinanceDBWithTogether.from_excel(
-            excel_path=input.get('path', None),
-            api_key=os.getenv('TOGETHER_API_KEY'),
-            collection_name="california_city_ordinances"
-        )
-        return True
+        # Parsing and embedding block, run them off the loop so the worker can
+        # process several files at once
+        return await asyncio.to_thread(_parse_and_upsert, input.path, input.collection_name)
+    except (FileNotFoundError, ValueError) as e:
+        log.error(f"Error parsing {input.path}: {e}")
+        raise FunctionFailure(f"Error parsing {input.path}: {e}", non_retryable=True)
     except Exception as e:
-        log.error(f"Error interacting with llm: {e}")
-        raise FunctionFailure(f"Error interacting with llm: {e}", non_retryable=True)
+        # Embedding and Chroma errors are usually transient, let the step retry
+        log.error(f"Error ingesting {input.path}: {e}")
+        raise FunctionFailure(f"Error ingesting {input.path}: {e}", non_retryable=False)
@@ -0,0 +1,171 @@
+# hn_client.py
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+DEFAULT_API_URL = "https://hn.algolia.com/api/v1"
+
+
+class SeenStories:
+    """
+    Stories a workflow has finished with, persisted per query in a JSON file.
+
+    Searching only filters, stories are marked seen by a separate call once
+    the run that received them has succeeded, so a failed or retried run
+    gets the same stories again.
+
+    The cursor is the newest created_at_i marked so far. IDs are kept only
+    for stories within retention_seconds of it, anything older than that
+    window counts as seen, which keeps the file small however long the
+    schedule runs.
+    """
+
+    def __init__(self, path: str, retention_seconds: float = 7 * 24 * 3600):
+        self.path = path
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, state: Dict):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+    def _entry(self, state: Dict, query: str) -> Dict:
+        return state.get(query, {"cursor": 0, "seen": {}})
+
+    def filter_new(self, query: str, hits: List[Dict]) -> List[Dict]:
+        """Hits not marked seen for this query, nothing is recorded"""
+        with self._lock:
+            entry = self._entry(self._load(), query)
+        cursor, seen = entry["cursor"], entry["seen"]
+        horizon = cursor - self.retention_seconds
+        return [
+            hit for hit in hits
+            if hit.get("objectID") is not None
+            and hit["objectID"] not in seen
+            and not (cursor and hit.get("created_at_i", 0) < horizon)
+        ]
+
+    def mark_seen(self, query: str, hits: List[Dict]):
+        """Record hits as handled for this query, marking a hit twice changes nothing"""
+        with self._lock:
+            state = self._load()
+            entry = self._entry(state, query)
+            cursor, seen = entry["cursor"], dict(entry["seen"])
+            for hit in hits:
+                if hit.get("objectID") is not None:
+                    seen[hit["objectID"]] = hit.get("created_at_i", 0)
+
+            cursor = max([cursor] + list(seen.values()))
+            horizon = cursor - self.retention_seconds
+            state[query] = {
+                "cursor": cursor,
+                "seen": {object_id: created for object_id, created in seen.items() if created >= horizon}
+            }
+            self._save(state)
+
+
+class HnClient:
+    """
+    Async Algolia HN search client shared by a worker's function runs.
+
+    Responses are kept for cache_ttl seconds per (query, count), so runs
+    scheduled close together share one request, and concurrent callers of
+    the same search wait for a single in-flight request.
+    """
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        cache_ttl: float = 300.0,
+        state_path: Optional[str] = None,
+        timeout: float = 10.0
+    ):
+        """
+        Args:
+            base_url: API root, defaults to HN_API_URL or the public Algolia API
+            cache_ttl: Seconds a search response is reused
+            state_path: JSON file of seen stories, defaults to HN_STATE_PATH
+            timeout: Seconds per request
+        """
+        self.cache_ttl = cache_ttl
+        self.seen = SeenStories(state_path or os.getenv("HN_STATE_PATH", "data/hn_state.json"))
+        self._cache: Dict[Tuple[str, int], Tuple[float, Dict]] = {}
+        self._inflight: Dict[Tuple[str, int], asyncio.Future] = {}
+        self._client = httpx.AsyncClient(
+            base_url=(base_url or os.getenv("HN_API_URL", DEFAULT_API_URL)).rstrip("/"),
+            limits=httpx.Limits(max_connections=8, max_keepalive_connections=8),
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 5.0))
+        )
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    async def _fetch(self, query: str, count: int) -> Dict:
+        response = await self._client.get("/search_by_date", params={
+            "tags": "show_hn",
+            "query": query,
+            "hitsPerPage": count,
+            "numericFilters": "points>2"
+        })
+        response.raise_for_status()
+        return response.json()
+
+    async def search(self, query: str, count: int) -> Dict:
+        """Search response, from the cache while it is fresh"""
+        key = (query, count)
+        cached = self._cache.get(key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            data = await self._fetch(query, count)
+            self._cache[key] = (time.monotonic() + self.cache_ttl, data)
+            future.set_result(data)
+            return data
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody may be waiting, do not warn about an unretrieved exception
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def search_new(self, query: str, count: int) -> Dict:
+        """
+        Search response with only the stories not marked seen for this query.
+
+        The hits are replaced by the new ones, and "skippedHits" counts the
+        stories already seen. Nothing is marked, call mark_seen once the
+        stories have been handled.
+        """
+        data = await self.search(query, count)
+        hits = data.get("hits", [])
+        new_hits = await asyncio.to_thread(self.seen.filter_new, query, hits)
+        return {**data, "hits": new_hits, "skippedHits": len(hits) - len(new_hits)}
+
+    async def mark_seen(self, query: str, hits: List[Dict]):
+        """Leave these stories out of later search_new results for the query"""
+        await asyncio.to_thread(self.seen.mark_seen, query, hits)
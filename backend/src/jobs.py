@@ -0,0 +1,292 @@
+# jobs.py
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+TERMINAL_STATUSES = ("succeeded", "failed")
+
+
+class JobStore:
+    """
+    Job records in a small SQLite file.
+
+    Server workers are separate processes, so a job started by one worker is
+    polled through another. Keeping the records on disk lets every worker
+    answer status requests for every job.
+    """
+
+    def __init__(self, path: str = "data/jobs.sqlite"):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    workflow_name TEXT NOT NULL,
+                    workflow_id TEXT NOT NULL,
+                    run_id TEXT,
+                    status TEXT NOT NULL,
+                    progress TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    updated_at REAL NOT NULL,
+                    lease_until REAL
+                )
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10.0)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def insert(self, job: Dict):
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, workflow_name, workflow_id, status, progress, created_at, updated_at, lease_until) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job["id"], job["workflow_name"], job["workflow_id"], job["status"],
+                 json.dumps(job["progress"]), job["created_at"], job["created_at"], job["lease_until"])
+            )
+
+    def update(self, job_id: str, **fields):
+        if "progress" in fields:
+            fields["progress"] = json.dumps(fields["progress"])
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"], default=str)
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def expire_leases(self, now: float) -> int:
+        """
+        Fail unfinished jobs whose lease ran out.
+
+        The worker waiting on a job renews its lease while it runs. A worker
+        killed without its shutdown leaves the job unfinished, once the lease
+        expires nobody is left to record its result.
+        """
+        with self._lock, self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ?, updated_at = ?, progress = ? "
+                "WHERE status NOT IN (?, ?) AND lease_until < ?",
+                ("Server worker stopped while waiting for the workflow result", now, now,
+                 json.dumps({"phase": "abandoned"}), *TERMINAL_STATUSES, now)
+            ).rowcount
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list(self, limit: int = 50) -> List[Dict]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def prune(self, older_than: float):
+        """Delete finished jobs last updated before the given timestamp"""
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (*TERMINAL_STATUSES, older_than)
+            )
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict:
+        job = dict(row)
+        job["progress"] = json.loads(job["progress"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+
+class JobManager:
+    """
+    Runs Restack workflows as background jobs.
+
+    submit() schedules the workflow and returns at once with a job ID, a
+    background task then waits for the workflow result and records it. The
+    Restack client is shared by all jobs of the process.
+    """
+
+    def __init__(
+        self,
+        client,
+        store: Optional[JobStore] = None,
+        retention_seconds: float = 7 * 24 * 3600,
+        poll_interval: float = 0.5,
+        lease_seconds: float = 60.0
+    ):
+        """
+        Args:
+            client: Restack client used to schedule workflows and await their results
+            store: Where job records are kept, shared by the server workers
+            retention_seconds: Finished jobs older than this are pruned
+            poll_interval: Seconds between store reads while streaming job events
+            lease_seconds: How long an unfinished job may go without a
+                heartbeat from its worker before it is marked failed, the
+                lease is renewed every third of it
+        """
+        self.client = client
+        self.store = store or JobStore()
+        self.retention_seconds = retention_seconds
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    async def submit(self, workflow_name: str, workflow_input: Optional[Dict] = None) -> Dict:
+        """Create a job for the workflow and start it in the background"""
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "workflow_name": workflow_name,
+            "workflow_id": f"{int(now * 1000)}-{workflow_name}-{job_id[:8]}",
+            "status": "queued",
+            "progress": {"phase": "queued"},
+            "created_at": now,
+            "lease_until": now + self.lease_seconds
+        }
+        await asyncio.to_thread(self.store.insert, job)
+        await asyncio.to_thread(self.store.prune, now - self.retention_seconds)
+        # Read before starting, the task may already have marked it running otherwise
+        queued = await asyncio.to_thread(self.store.get, job_id)
+
+        task = asyncio.create_task(self._run(job, workflow_input))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+        return queued
+
+    async def _keep_lease(self, job_id: str, phase: str, since: float, stop: asyncio.Event):
+        """Renew the job's lease and report how long it has been in its phase, until stop is set"""
+        while True:
+            try:
+                await asyncio.wait_for(stop.wait(), self.lease_seconds / 3)
+                return
+            except asyncio.TimeoutError:
+                pass
+            now = time.time()
+            await asyncio.to_thread(
+                self.store.update, job_id,
+                lease_until=now + self.lease_seconds,
+                progress={"phase": phase, "heartbeat_at": now, "phase_seconds": round(now - since, 1)}
+            )
+
+    def _start_lease(self, job_id: str, phase: str) -> Tuple[asyncio.Task, asyncio.Event]:
+        stop = asyncio.Event()
+        return asyncio.create_task(self._keep_lease(job_id, phase, time.time(), stop)), stop
+
+    @staticmethod
+    async def _stop_lease(lease: Tuple[asyncio.Task, asyncio.Event]):
+        """
+        Stop renewing the lease once a renewal in flight has been written.
+
+        Cancelling the task would not stop a renewal already running in its
+        thread, which could then overwrite the job's next state.
+        """
+        task, stop = lease
+        stop.set()
+        try:
+            await task
+        except Exception as e:
+            print(f"Error renewing job lease: {str(e)}")
+
+    async def _run(self, job: Dict, workflow_input: Optional[Dict]):
+        job_id = job["id"]
+        lease = self._start_lease(job_id, "scheduling")
+        try:
+            kwargs = {"workflow_name": job["workflow_name"], "workflow_id": job["workflow_id"]}
+            if workflow_input is not None:
+                kwargs["input"] = workflow_input
+            run_id = await self.client.schedule_workflow(**kwargs)
+            print(f"Job {job_id} scheduled workflow {job['workflow_name']} run {run_id}")
+            await self._stop_lease(lease)
+            started = time.time()
+            await asyncio.to_thread(
+                self.store.update, job_id,
+                run_id=run_id, status="running", started_at=started,
+                lease_until=started + self.lease_seconds,
+                progress={"phase": "running", "heartbeat_at": started, "phase_seconds": 0.0}
+            )
+            lease = self._start_lease(job_id, "running")
+
+            result = await self.client.get_workflow_result(workflow_id=job["workflow_id"], run_id=run_id)
+            await self._stop_lease(lease)
+            await asyncio.to_thread(
+                self.store.update, job_id,
+                status="succeeded", result=result, finished_at=time.time(),
+                progress={"phase": "finished"}
+            )
+        except asyncio.CancelledError:
+            await self._stop_lease(lease)
+            # The server is shutting down, the workflow itself keeps running in Restack
+            await asyncio.to_thread(
+                self.store.update, job_id,
+                status="failed", error="Server stopped while waiting for the workflow result",
+                finished_at=time.time(), progress={"phase": "abandoned"}
+            )
+            raise
+        except Exception as e:
+            await self._stop_lease(lease)
+            print(f"Job {job_id} failed: {str(e)}")
+            await asyncio.to_thread(
+                self.store.update, job_id,
+                status="failed", error=str(e), finished_at=time.time(),
+                progress={"phase": "failed"}
+            )
+
+    async def get(self, job_id: str) -> Optional[Dict]:
+        await asyncio.to_thread(self.store.expire_leases, time.time())
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is not None:
+            job["elapsed_seconds"] = (job["finished_at"] or time.time()) - job["created_at"]
+        return job
+
+    async def list(self, limit: int = 50) -> List[Dict]:
+        await asyncio.to_thread(self.store.expire_leases, time.time())
+        return await asyncio.to_thread(self.store.list, limit)
+
+    async def events(self, job_id: str, heartbeat: float = 15.0) -> AsyncIterator[str]:
+        """
+        Server-sent events for a job.
+
+        Sends a "status" event with the job (without its result) whenever it
+        changes, comment heartbeats while it does not, and ends after the
+        job finishes.
+        """
+        last_update = None
+        last_sent = time.monotonic()
+        while True:
+            job = await self.get(job_id)
+            if job is None:
+                yield f"event: error\ndata: {json.dumps({'detail': 'Job not found'})}\n\n"
+                return
+            if job["updated_at"] != last_update:
+                last_update = job["updated_at"]
+                last_sent = time.monotonic()
+                summary = {k: v for k, v in job.items() if k != "result"}
+                yield f"event: status\ndata: {json.dumps(summary)}\n\n"
+                if job["status"] in TERMINAL_STATUSES:
+                    return
+            elif time.monotonic() - last_sent >= heartbeat:
+                last_sent = time.monotonic()
+                yield ": heartbeat\n\n"
+            await asyncio.sleep(self.poll_interval)
+
+    async def shutdown(self):
+        """Stop waiting on workflow results, the workflows keep running in Restack"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,494 @@
+# llm_dispatcher.py
+import asyncio
+import itertools
+import json
+import time
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from llama_stack_client import LlamaStackClient
+
+from .metrics import LLM_TOKENS, STAGE_ERRORS, current_route, observe_stage
+
+
+class Priority(IntEnum):
+    """Scheduling priority for LLM requests, lower values are served first"""
+    INTERACTIVE = 0
+    DEFAULT = 5
+    BACKGROUND = 10
+
+
+_STREAM_END = object()
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed before it reached the LLM"""
+
+
+# Statuses meaning the backend has no batch inference, rather than a failed batch
+BATCH_UNSUPPORTED_STATUSES = (404, 405, 501)
+
+
+def _batch_unsupported(error: Exception) -> bool:
+    """Whether a failed batch call means the backend cannot batch at all"""
+    if isinstance(error, (AttributeError, NotImplementedError)):
+        return True
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status in BATCH_UNSUPPORTED_STATUSES
+
+
+@dataclass(order=True)
+class _LLMRequest:
+    """A queued chat completion request"""
+    priority: int
+    seq: int
+    model: str = field(compare=False)
+    messages: List[Dict] = field(compare=False)
+    stream: bool = field(default=False, compare=False)
+    sampling_params: Optional[Dict] = field(default=None, compare=False)
+    enqueued_at: float = field(default_factory=time.monotonic, compare=False)
+    future: Optional[asyncio.Future] = field(default=None, compare=False)
+    tokens: Optional[asyncio.Queue] = field(default=None, compare=False)
+    deadline: Optional[float] = field(default=None, compare=False)
+    cancelled: bool = field(default=False, compare=False)
+    finished: bool = field(default=False, compare=False)
+    upstream: Any = field(default=None, compare=False)
+    generated: int = field(default=0, compare=False)
+    route: str = field(default_factory=current_route.get, compare=False)
+
+    @property
+    def abandoned(self) -> bool:
+        """The caller went away, so the result would never be read"""
+        if self.stream:
+            return self.cancelled
+        return self.future.done()
+
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    @property
+    def batch_key(self) -> str:
+        """Requests can share a batch when model and sampling params match"""
+        return json.dumps(self.sampling_params or {}, sort_keys=True)
+
+
+class _ModelLane:
+    """Per-model queue with its own concurrency limit"""
+
+    def __init__(self, model: str, max_concurrency: int):
+        self.model = model
+        self.queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.inflight = 0
+        self.supports_batch = True
+        self.batch_paused_until = 0.0
+        self.worker: Optional[asyncio.Task] = None
+
+
+class LLMDispatcher:
+    """
+    Scheduling layer in front of LlamaStack inference.
+
+    All chat completions go through a priority queue per model. Interactive
+    requests are served before background ones, every model has a cap on
+    concurrent upstream requests, and non-streaming requests that arrive within
+    a short window are merged into a single batch inference call when the
+    backend supports it.
+    """
+
+    def __init__(
+        self,
+        client: Optional[LlamaStackClient] = None,
+        base_url: str = "http://localhost:5050",
+        max_concurrency: int = 4,
+        model_concurrency: Optional[Dict[str, int]] = None,
+        batch_window_ms: float = 10.0,
+        max_batch_size: int = 8,
+        enable_batching: bool = True,
+        expected_stream_tokens: int = 512,
+        batch_retry_seconds: float = 60.0
+    ):
+        """
+        Initialize the dispatcher.
+
+        Args:
+            client: LlamaStack client to use, created from base_url if omitted
+            base_url: LlamaStack server URL
+            max_concurrency: Default number of in-flight requests per model
+            model_concurrency: Per-model overrides of max_concurrency
+            batch_window_ms: How long to wait for more requests to batch together
+            max_batch_size: Maximum number of requests in one batch call
+            enable_batching: Whether to try batch inference at all
+            expected_stream_tokens: Assumed answer length used to estimate tokens
+                saved by cancelled streams until real lengths have been observed
+            batch_retry_seconds: How long a model is served without batching
+                after a batch call failed for another reason than the backend
+                lacking batch inference
+        """
+        self.client = client or LlamaStackClient(base_url=base_url)
+        self.max_concurrency = max_concurrency
+        self.model_concurrency = model_concurrency or {}
+        self.batch_window = batch_window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.enable_batching = enable_batching
+        self.expected_stream_tokens = expected_stream_tokens
+        self.batch_retry_seconds = batch_retry_seconds
+        self._batch_resource = (
+            getattr(self.client, "batch_inference", None)
+            or getattr(self.client, "batch_inferences", None)
+        )
+
+        self._lanes: Dict[str, _ModelLane] = {}
+        self._seq = itertools.count()
+        self._tasks = set()
+
+        # Wait time statistics
+        self._dispatched = 0
+        self._batches = 0
+        self._batched_requests = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._wait_last = 0.0
+        self._dropped_expired = 0
+        self._dropped_cancelled = 0
+
+        # Cancelled stream statistics
+        self._stream_lengths: Dict[str, float] = {}  # EWMA of completed stream length per model
+        self._cancelled_streams = 0
+        self._tokens_before_cancel = 0
+        self._tokens_saved = 0
+
+    # Public API
+
+    async def complete(
+        self,
+        messages: List[Dict],
+        model: str,
+        priority: Priority = Priority.DEFAULT,
+        sampling_params: Optional[Dict] = None,
+        deadline: Optional[float] = None
+    ) -> str:
+        """
+        Run a non-streaming chat completion and return the message content.
+
+        Args:
+            messages: Chat messages
+            model: Model identifier
+            priority: Scheduling priority
+            sampling_params: Optional sampling parameters passed to LlamaStack
+            deadline: time.monotonic() deadline, the request is dropped with
+                DeadlineExceeded if it is still queued when it passes
+        """
+        loop = asyncio.get_running_loop()
+        request = _LLMRequest(
+            priority=int(priority),
+            seq=next(self._seq),
+            model=model,
+            messages=messages,
+            sampling_params=sampling_params,
+            future=loop.create_future(),
+            deadline=deadline
+        )
+        self._enqueue(request)
+        return await request.future
+
+    async def stream(
+        self,
+        messages: List[Dict],
+        model: str,
+        priority: Priority = Priority.INTERACTIVE,
+        sampling_params: Optional[Dict] = None,
+        deadline: Optional[float] = None
+    ) -> AsyncIterator[str]:
+        """
+        Run a streaming chat completion, yielding text deltas as they arrive.
+
+        Args:
+            messages: Chat messages
+            model: Model identifier
+            priority: Scheduling priority
+            sampling_params: Optional sampling parameters passed to LlamaStack
+            deadline: time.monotonic() deadline, the request is dropped with
+                DeadlineExceeded if it is still queued when it passes
+        """
+        request = _LLMRequest(
+            priority=int(priority),
+            seq=next(self._seq),
+            model=model,
+            messages=messages,
+            stream=True,
+            sampling_params=sampling_params,
+            tokens=asyncio.Queue(),
+            deadline=deadline
+        )
+        self._enqueue(request)
+
+        try:
+            while True:
+                item = await request.tokens.get()
+                if item is _STREAM_END:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # The consumer left early: skip the request if it is still queued,
+            # or abort the upstream generation if it is already running
+            request.cancelled = True
+            if not request.finished:
+                self._abort_stream(request)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue depth, in-flight and wait time statistics"""
+        models = {}
+        for name, lane in self._lanes.items():
+            models[name] = {
+                "queue_depth": lane.queue.qsize(),
+                "inflight": lane.inflight,
+                "max_concurrency": lane.max_concurrency,
+                "batching": self.enable_batching and lane.supports_batch
+                and time.monotonic() >= lane.batch_paused_until
+            }
+        return {
+            "queue_depth": sum(m["queue_depth"] for m in models.values()),
+            "inflight": sum(m["inflight"] for m in models.values()),
+            "dispatched": self._dispatched,
+            "batches": self._batches,
+            "batched_requests": self._batched_requests,
+            "dropped_expired": self._dropped_expired,
+            "dropped_cancelled": self._dropped_cancelled,
+            "cancelled_streams": self._cancelled_streams,
+            "tokens_before_cancel": self._tokens_before_cancel,
+            "tokens_saved_estimate": self._tokens_saved,
+            "wait_time_ms": {
+                "avg": (self._wait_total / self._dispatched * 1000) if self._dispatched else 0.0,
+                "max": self._wait_max * 1000,
+                "last": self._wait_last * 1000
+            },
+            "models": models
+        }
+
+    # Scheduling
+
+    def _lane(self, model: str) -> _ModelLane:
+        lane = self._lanes.get(model)
+        if lane is None:
+            lane = _ModelLane(model, self.model_concurrency.get(model, self.max_concurrency))
+            self._lanes[model] = lane
+        if lane.worker is None or lane.worker.done():
+            lane.worker = asyncio.get_running_loop().create_task(self._run_lane(lane))
+        return lane
+
+    def _enqueue(self, request: _LLMRequest):
+        self._lane(request.model).queue.put_nowait(request)
+
+    def _record_wait(self, request: _LLMRequest):
+        waited = time.monotonic() - request.enqueued_at
+        observe_stage("llm_queue_wait", waited, model=request.model, route=request.route)
+        self._dispatched += 1
+        self._wait_total += waited
+        self._wait_last = waited
+        self._wait_max = max(self._wait_max, waited)
+
+    def _drop_if_dead(self, request: _LLMRequest) -> bool:
+        """Fail expired requests and forget abandoned ones before they reach the LLM"""
+        if request.abandoned:
+            self._dropped_cancelled += 1
+            return True
+        if request.expired:
+            self._dropped_expired += 1
+            error = DeadlineExceeded("Request deadline passed while queued for the LLM")
+            if request.stream:
+                request.tokens.put_nowait(error)
+            else:
+                request.future.set_exception(error)
+            return True
+        return False
+
+    def _can_batch(self, lane: _ModelLane, request: _LLMRequest) -> bool:
+        return (
+            self.enable_batching
+            and lane.supports_batch
+            and time.monotonic() >= lane.batch_paused_until
+            and self._batch_resource is not None
+            and not request.stream
+        )
+
+    async def _run_lane(self, lane: _ModelLane):
+        """Pull requests off a model queue and dispatch them within the concurrency cap"""
+        loop = asyncio.get_running_loop()
+        while True:
+            # Take a slot before a request, so the request dispatched is the
+            # most urgent one queued when the slot frees, not one held while waiting
+            await lane.slots.acquire()
+            request = await lane.queue.get()
+            if self._drop_if_dead(request):
+                lane.slots.release()
+                continue
+
+            batch = [request]
+            if self._can_batch(lane, request):
+                # Wait for more requests only while another slot is idle, with
+                # every slot busy the batch is what is already queued
+                wait = not lane.slots.locked()
+                held_back = []
+                window_end = loop.time() + self.batch_window
+                while len(batch) < self.max_batch_size:
+                    if lane.queue.empty():
+                        timeout = window_end - loop.time()
+                        if not wait or timeout <= 0:
+                            break
+                        try:
+                            candidate = await asyncio.wait_for(lane.queue.get(), timeout)
+                        except asyncio.TimeoutError:
+                            break
+                    else:
+                        candidate = lane.queue.get_nowait()
+                    if self._drop_if_dead(candidate):
+                        continue
+                    if candidate.stream or candidate.batch_key != request.batch_key:
+                        held_back.append(candidate)
+                    else:
+                        batch.append(candidate)
+                for candidate in held_back:
+                    lane.queue.put_nowait(candidate)
+
+            for item in batch:
+                self._record_wait(item)
+
+            lane.inflight += 1
+            if request.stream:
+                coro = self._execute_stream(lane, request)
+            elif len(batch) > 1:
+                coro = self._execute_batch(lane, batch)
+            else:
+                coro = self._execute_single(lane, request)
+            task = loop.create_task(coro)
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _release(self, lane: _ModelLane):
+        lane.inflight -= 1
+        lane.slots.release()
+
+    def _chat_kwargs(self, request: _LLMRequest) -> Dict:
+        kwargs = {"messages": request.messages, "model": request.model}
+        if request.sampling_params:
+            kwargs["sampling_params"] = request.sampling_params
+        return kwargs
+
+    async def _execute_single(self, lane: _ModelLane, request: _LLMRequest):
+        start = time.perf_counter()
+        try:
+            response = await asyncio.to_thread(
+                self.client.inference.chat_completion,
+                **self._chat_kwargs(request)
+            )
+            observe_stage("llm_completion", time.perf_counter() - start, model=request.model, route=request.route)
+            if not request.future.done():
+                request.future.set_result(response.completion_message.content)
+        except Exception as e:
+            STAGE_ERRORS.inc(stage="llm_completion", route=request.route, model=request.model)
+            if not request.future.done():
+                request.future.set_exception(e)
+        finally:
+            self._release(lane)
+
+    async def _execute_batch(self, lane: _ModelLane, batch: List[_LLMRequest]):
+        try:
+            kwargs = {
+                "messages_batch": [r.messages for r in batch],
+                "model": lane.model
+            }
+            if batch[0].sampling_params:
+                kwargs["sampling_params"] = batch[0].sampling_params
+            start = time.perf_counter()
+            response = await asyncio.to_thread(self._batch_resource.chat_completion, **kwargs)
+            elapsed = time.perf_counter() - start
+            for request in batch:
+                observe_stage("llm_completion", elapsed, model=lane.model, cache="batched", route=request.route)
+            self._batches += 1
+            self._batched_requests += len(batch)
+            for request, message in zip(batch, response.completion_message_batch):
+                if not request.future.done():
+                    request.future.set_result(message.content)
+        except Exception as e:
+            if _batch_unsupported(e):
+                # Backend without batch inference support, fall back to single requests
+                print(f"Batch inference unsupported for {lane.model}, disabling batching: {str(e)}")
+                lane.supports_batch = False
+            else:
+                # Timeout, server error or dropped connection, batch again after a pause
+                print(f"Batch inference failed for {lane.model}, pausing batching "
+                      f"for {self.batch_retry_seconds:.0f}s: {str(e)}")
+                lane.batch_paused_until = time.monotonic() + self.batch_retry_seconds
+            for request in batch:
+                if not request.future.done():
+                    lane.queue.put_nowait(request)
+        finally:
+            self._release(lane)
+
+    def _abort_stream(self, request: _LLMRequest):
+        """Close the upstream HTTP stream so LlamaStack stops generating"""
+        upstream = request.upstream
+        if upstream is not None:
+            try:
+                upstream.close()
+            except Exception as e:
+                print(f"Error closing upstream stream: {str(e)}")
+
+    def _record_stream_end(self, request: _LLMRequest):
+        average = self._stream_lengths.get(request.model)
+        if request.cancelled:
+            expected = average if average is not None else self.expected_stream_tokens
+            self._cancelled_streams += 1
+            self._tokens_before_cancel += request.generated
+            self._tokens_saved += max(0, int(expected) - request.generated)
+        elif average is None:
+            self._stream_lengths[request.model] = float(request.generated)
+        else:
+            self._stream_lengths[request.model] = 0.8 * average + 0.2 * request.generated
+
+    async def _execute_stream(self, lane: _ModelLane, request: _LLMRequest):
+        loop = asyncio.get_running_loop()
+
+        start = time.perf_counter()
+
+        def pump():
+            response = self.client.inference.chat_completion(
+                stream=True,
+                **self._chat_kwargs(request)
+            )
+            request.upstream = response
+            try:
+                for chunk in response:
+                    if request.cancelled:
+                        break
+                    event = chunk.event
+                    if event.event_type == "progress" and isinstance(event.delta, str):
+                        if request.generated == 0:
+                            observe_stage("llm_ttft", time.perf_counter() - start, model=request.model, route=request.route)
+                        request.generated += 1
+                        loop.call_soon_threadsafe(request.tokens.put_nowait, event.delta)
+            finally:
+                response.close()
+
+        try:
+            await asyncio.to_thread(pump)
+            request.tokens.put_nowait(_STREAM_END)
+            observe_stage("llm_generation", time.perf_counter() - start, model=request.model, route=request.route)
+        except Exception as e:
+            # Reading a stream we closed ourselves fails, that is expected
+            if not request.cancelled:
+                STAGE_ERRORS.inc(stage="llm_generation", route=request.route, model=request.model)
+                request.tokens.put_nowait(e)
+        finally:
+            LLM_TOKENS.inc(request.generated, route=request.route, model=request.model)
+            request.finished = True
+            self._record_stream_end(request)
+            self._release(lane)
@@ -0,0 +1,289 @@
+# metrics.py
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Route of the request being served, set by the app middleware so that
+# stages deep in the pipeline can be tagged without threading it through
+current_route: ContextVar[str] = ContextVar("current_route", default="none")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def snapshot(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(a: float, b: float) -> float:
+        return a + b
+
+    def render(self, values: Optional[Dict[Tuple[str, ...], float]] = None) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        if values is None:
+            values = self.snapshot()
+        for key, value in values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Fixed-bucket histogram with labels, one bisect and one lock per observation"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: bucket counts (last one is +Inf), sum, count
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = [0] * (len(self.buckets) + 1) + [0.0, 0]
+                self._series[key] = series
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self) -> Dict[Tuple[str, ...], List[float]]:
+        with self._lock:
+            return {key: list(series) for key, series in self._series.items()}
+
+    @staticmethod
+    def merge(a: List[float], b: List[float]) -> List[float]:
+        return [x + y for x, y in zip(a, b)]
+
+    def render(self, values: Optional[Dict[Tuple[str, ...], List[float]]] = None) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        if values is None:
+            values = self.snapshot()
+        for key, series in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _format_labels(self.labelnames, key, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {series[-2]}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together in Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def snapshot(self) -> Dict:
+        """Current values of every metric, in a JSON-serializable form"""
+        return {
+            metric.name: [[list(key), value] for key, value in metric.snapshot().items()]
+            for metric in self._metrics
+        }
+
+    def render(self, snapshots: Optional[List[Dict]] = None) -> str:
+        """
+        Render this process's metrics, or the sum of several processes' snapshots.
+
+        Counters and histogram buckets are added up per label set, so the
+        result is what a single process serving all their traffic would report.
+        """
+        lines = []
+        for metric in self._metrics:
+            if snapshots is None:
+                lines.extend(metric.render())
+                continue
+            merged = {}
+            for snapshot in snapshots:
+                for key, value in snapshot.get(metric.name, []):
+                    key = tuple(key)
+                    merged[key] = metric.merge(merged[key], value) if key in merged else value
+            lines.extend(metric.render(merged))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "rag_stage_duration_seconds",
+    "Latency of each RAG pipeline stage",
+    labelnames=("stage", "route", "model", "cache")
+))
+STAGE_ERRORS = REGISTRY.register(Counter(
+    "rag_stage_errors_total",
+    "Failed RAG pipeline stages",
+    labelnames=("stage", "route", "model")
+))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    "rag_cache_requests_total",
+    "Cache lookups by cache and result",
+    labelnames=("cache", "result", "route")
+))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "llm_stream_tokens_total",
+    "Streamed LLM tokens",
+    labelnames=("route", "model")
+))
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "http_requests_total",
+    "HTTP requests by route and status",
+    labelnames=("route", "method", "status")
+))
+HTTP_SECONDS = REGISTRY.register(Histogram(
+    "http_request_duration_seconds",
+    "Time until the response starts, streaming bodies excluded",
+    labelnames=("route", "method")
+))
+EMBEDDING_SHADOW_OVERLAP = REGISTRY.register(Histogram(
+    "embedding_shadow_overlap_ratio",
+    "Share of the serving top-k also returned by the migration target's top-k",
+    labelnames=("source_model", "target_model"),
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+))
+
+
+def observe_stage(stage: str, seconds: float, model: str = "", cache: str = "", route: str = None):
+    """Record the duration of one pipeline stage"""
+    STAGE_SECONDS.observe(
+        seconds,
+        stage=stage,
+        route=route or current_route.get(),
+        model=model,
+        cache=cache
+    )
+
+
+@contextmanager
+def stage_timer(stage: str, model: str = "", cache: str = ""):
+    """Time a block as a pipeline stage, counting it as an error if it raises"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage, route=current_route.get(), model=model)
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - start, model=model, cache=cache)
+
+
+def write_snapshot(directory: str, registry: Registry = REGISTRY):
+    """Write this process's metrics to directory, replacing its previous snapshot"""
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(registry.snapshot(), f, separators=(",", ":"))
+    os.replace(path + ".tmp", path)
+
+
+def read_snapshots(directory: str) -> List[Dict]:
+    """Snapshots of every process that wrote to directory, including exited ones"""
+    snapshots = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        try:
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"Error reading metrics snapshot {path}: {str(e)}")
+    return snapshots
+
+
+def clear_snapshots(directory: str):
+    """Start counting from zero, run before the server workers start"""
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        os.remove(path)
+
+
+class SnapshotWriter:
+    """Background thread writing this process's metrics to METRICS_DIR every interval"""
+
+    def __init__(self, directory: str, interval: float = 5.0):
+        self.directory = directory
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-snapshot", daemon=True)
+
+    def start(self) -> "SnapshotWriter":
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                write_snapshot(self.directory)
+            except OSError as e:
+                print(f"Error writing metrics snapshot: {str(e)}")
+
+    def stop(self):
+        """Stop and write a last snapshot, so nothing counted by this process is lost"""
+        self._stop.set()
+        self._thread.join()
+        write_snapshot(self.directory)
+
+
+def render_metrics() -> str:
+    """
+    All metrics in Prometheus text exposition format.
+
+    Metrics are kept per process. With METRICS_DIR set, as run_server does
+    for its workers, every worker writes snapshots there and whichever one
+    is scraped reports the sum over all of them, so counters never appear
+    to reset when consecutive scrapes reach different workers. Other
+    workers' snapshots are at most METRICS_SNAPSHOT_SECONDS old.
+    """
+    directory = os.getenv("METRICS_DIR")
+    if not directory:
+        return REGISTRY.render()
+    os.makedirs(directory, exist_ok=True)
+    write_snapshot(directory)
+    return REGISTRY.render(read_snapshots(directory))
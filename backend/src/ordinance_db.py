@@ -1,34 +1,84 @@
 # ordinance_db.py
-from typing import List, Dict, Optional
+from typing import Iterable, Iterator, List, Dict, Optional, Tuple
+from collections import OrderedDict
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import random
+import threading
+import time
 import uuid
 import os
 import json
 from dotenv import load_dotenv
 from .db import ChromaDb
+from .collection_versions import AliasRegistry
 from .embeddings import TogetherEmbeddingFunction
-from .parser import extract_ordinance_metadata
+from .embedding_migration import top_k_overlap
+from .sharding import create_collection, delete_collection, open_collection
+from .dedup import DedupIndex, copy_flags
+from .utils import estimate_tokens
+from .parser import open_ordinances
+from .ordinance_format import iter_ordinances
+from .metrics import CACHE_REQUESTS, EMBEDDING_SHADOW_OVERLAP, current_route, observe_stage, stage_timer
+from .tracing import SPAN_NAME
+from llama_index.core import Settings
+from llama_index.core.callbacks import CBEventType, EventPayload
 
 # Load environment variables from .env file
 load_dotenv()
 
+DEFAULT_EMBEDDING_MODEL = "togethercomputer/m2-bert-80M-32k-retrieval"
+
+
+def _filter_values(value) -> Optional[set]:
+    """Values a state or city filter accepts, None when it accepts any or is another operator"""
+    if not value:
+        return None
+    if isinstance(value, dict):
+        if "$eq" in value:
+            return {value["$eq"]}
+        if "$in" in value:
+            return set(value["$in"])
+        return None
+    return {value}
+
+
 class OrdinanceDBWithTogether(ChromaDb):
     def __init__(
         self,
         api_key: str = os.getenv('TOGETHER_API_KEY'),
-        model_name: str = "togethercomputer/m2-bert-80M-32k-retrieval",
+        model_name: str = os.getenv("EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL),
         collection_name: str = "ordinances",
         batch_size: int = 32,
-        force_recreate: bool = False
+        force_recreate: bool = False,
+        read_only: bool = False,
+        alias_refresh_seconds: float = 30.0,
+        shard_by: Optional[str] = os.getenv("ORDINANCE_SHARD_BY") or None,
+        dedup: bool = os.getenv("ORDINANCE_DEDUP", "0") == "1",
+        shadow_rate: float = float(os.getenv("EMBEDDING_SHADOW_RATE", "0"))
     ):
         """
         Initialize OrdinanceDB with Together AI embeddings.
         
         Args:
             api_key: Together AI API key
-            model_name: Name of the embedding model
-            collection_name: Name for the ChromaDB collection
+            model_name: Name of the embedding model for new collections,
+                existing collections keep the model they were built with
+            collection_name: Name for the ChromaDB collection, or an alias
+                published by collection_versions.rebuild_collection
             batch_size: Batch size for processing
             force_recreate: Whether to force create a new collection
+            read_only: Attach to an existing collection and never modify it,
+                used by server workers sharing one index
+            alias_refresh_seconds: How often searches check whether the alias
+                moved to a newer version
+            shard_by: Store new collections as one shard per "state" or
+                "city", existing collections keep their layout
+            dedup: Store near-duplicate sections of new collections once,
+                existing collections keep their setting
+            shadow_rate: Share of searches repeated against a migration
+                target in the background to report top-k overlap, 0 disables
         """
         if not api_key:
             raise ValueError("TOGETHER_API_KEY environment variable is not set")
@@ -39,21 +89,56 @@ class OrdinanceDBWithTogether(ChromaDb):
             batch_size=batch_size
         )
         super().__init__(embedding_function=embedding_function)
+        self.api_key = api_key
+        self.batch_size = batch_size
         
-        self.name = collection_name
+        # Small LRU of query embeddings keyed by model and query, repeated
+        # questions skip the Together call
+        self.model_name = model_name
+        self.query_cache_size = 1024
+        self._query_embeddings: OrderedDict = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+        
+        # Resolve the alias to the live version, plain names resolve to themselves
+        self.alias = collection_name
+        self.alias_refresh_seconds = alias_refresh_seconds
+        self.shard_by = shard_by
+        self.dedup = dedup
+        self._dedup_index: Optional[DedupIndex] = None
+        # Indexes searches read reference text from, by serving collection
+        self._read_indexes: Dict[str, DedupIndex] = {}
+        self.last_duplicates = 0
+        self._alias_registry = AliasRegistry(self.client, create=False)
+        self._alias_checked_at = time.monotonic()
+        self._alias_lock = threading.Lock()
+        self._migration: Optional[Dict] = None
+        self._migration_collection = None
+        self.shadow_rate = shadow_rate
+        self._shadow_pool: Optional[ThreadPoolExecutor] = None
+        self._shadow_busy = threading.Lock()
+        target = self._alias_registry.resolve(collection_name)
+        
+        self.name = target or collection_name
+        self.read_only = read_only
+        if read_only and force_recreate:
+            raise ValueError("Cannot recreate a collection opened read-only")
+        if target and force_recreate:
+            raise ValueError(f"{collection_name} is an alias of the live {target}, rebuild it with rebuild_collection")
         self.initialize_collection(force_recreate)
+        self._refresh_migration()
 
     def initialize_collection(self, force_recreate: bool = False):
         """Initialize or get the ChromaDB collection"""
-        if force_recreate:
+        if self.read_only:
+            # Never create or replace, the index is built by a separate ingestion run
+            self._attach(self.name)
+            print(f"Attached read-only to collection: {self.name}")
+        elif force_recreate:
             self.delete_collection()
             self.collection = self.create_new_collection()
         else:
             try:
-                self.collection = self.client.get_collection(
-                    name=self.name,
-                    embedding_function=self.embedding_function
-                )
+                self._attach(self.name)
                 print(f"Using existing collection: {self.name}")
             except Exception:
                 print(f"Creating new collection: {self.name}")
@@ -61,16 +146,51 @@ class OrdinanceDBWithTogether(ChromaDb):
 
     def create_new_collection(self):
         """Create a new ChromaDB collection with proper settings"""
-        return self.client.create_collection(
-            name=self.name,
-            embedding_function=self.embedding_function,
-            metadata={"hnsw:space": "cosine"}
+        return create_collection(
+            self.client,
+            self.name,
+            self.embedding_function,
+            metadata={"hnsw:space": "cosine", "embedding_model": self.model_name, "dedup": self.dedup},
+            shard_by=self.shard_by
         )
 
+    def _embedding_function_for(self, model_name: str) -> TogetherEmbeddingFunction:
+        if model_name == self.model_name:
+            return self.embedding_function
+        return TogetherEmbeddingFunction(api_key=self.api_key, model_name=model_name, batch_size=self.batch_size)
+
+    def _attach(self, name: str):
+        """
+        Open an existing collection with the embedding model it was built with.
+        
+        Collections record their model in their metadata, collections from
+        before that are assumed to use the configured model. Sharded
+        collections are opened through their shard router. The collection,
+        its embedding function and model name are swapped together, so a
+        search never embeds with one model and queries another's vectors.
+        """
+        metadata = self.client.get_collection(name=name, embedding_function=self.embedding_function).metadata or {}
+        model_name = metadata.get("embedding_model", self.model_name)
+        embedding_function = self._embedding_function_for(model_name)
+        collection = open_collection(self.client, name, embedding_function)
+        if model_name != self.model_name:
+            print(f"Collection {name} uses embedding model {model_name}")
+        with self._query_cache_lock:
+            self.collection = collection
+            self.embedding_function = embedding_function
+            self.model_name = model_name
+            self.name = name
+
+    def _serving(self):
+        """Collection, embedding function and model of one consistent version"""
+        with self._query_cache_lock:
+            return self.collection, self.embedding_function, self.model_name
+
     def delete_collection(self) -> bool:
         """Delete the current collection if it exists"""
+        self._check_writable()
         try:
-            self.client.delete_collection(self.name)
+            delete_collection(self.client, self.name)
             print(f"Successfully deleted collection: {self.name}")
             return True
         except Exception as e:
@@ -112,8 +232,132 @@ class OrdinanceDBWithTogether(ChromaDb):
             print(f"Error listing collections: {str(e)}")
             return []
     
+    def refresh_alias(self, force: bool = False) -> bool:
+        """
+        Follow the alias to the version it points at now.
+        
+        Checked at most every alias_refresh_seconds, so a rebuild or model
+        migration published by another process is picked up without
+        restarting. Searches already running keep the collection they
+        started with.
+        
+        Returns:
+            Whether the collection changed
+        """
+        if not force and time.monotonic() - self._alias_checked_at < self.alias_refresh_seconds:
+            return False
+        if not self._alias_lock.acquire(blocking=force):
+            return False  # Another search is already checking
+        try:
+            self._alias_checked_at = time.monotonic()
+            self._refresh_migration()
+            target = self._alias_registry.resolve(self.alias)
+            if not target or target == self.name:
+                return False
+            previous = self.name
+            self._attach(target)
+            print(f"Alias {self.alias} moved from {previous} to {target}")
+            return True
+        except Exception as e:
+            print(f"Error refreshing alias {self.alias}: {str(e)}")
+            return False
+        finally:
+            self._alias_lock.release()
+
+    def _refresh_migration(self):
+        """Pick up an embedding migration started for this alias by another process"""
+        migration = self._alias_registry.get_record(f"migration:{self.alias}")
+        if migration is not None and migration.get("source") != self.name:
+            migration = None  # Started against another version, not ours to mirror
+        previous = self._migration
+        self._migration = migration
+        if migration is None:
+            self._migration_collection = None
+            return
+        if previous is not None and previous["target"] == migration["target"]:
+            return  # Only the progress moved
+        # Failed embeddings must fail the write, a zero vector would go unnoticed until cutover
+        self._migration_collection = open_collection(
+            self.client,
+            migration["target"],
+            TogetherEmbeddingFunction(
+                api_key=self.api_key, model_name=migration["model"],
+                batch_size=self.batch_size, raise_on_error=True
+            )
+        )
+        print(f"Mirroring {self.name} to {migration['target']} for the {migration['model']} migration")
+
+    def _mirror(self, ids: List[str], metadatas: List[Dict], documents: Optional[List[str]] = None):
+        """
+        Dual-write a batch to the target of a running embedding migration.
+
+        The backfill copies what existed when it passed, this keeps sections
+        written since then from being missing after the cutover.
+        """
+        target = self._migration_collection
+        if target is None:
+            return
+        try:
+            if documents is None:
+                target.update(ids=ids, metadatas=metadatas)
+            else:
+                target.upsert(documents=documents, metadatas=metadatas, ids=ids)
+        except Exception as e:
+            print(f"Error mirroring batch to {target.name}: {str(e)}")
+            raise
+
+    def _maybe_shadow(self, query: str, max_results: int, where: Optional[Dict], served_ids: List[str]):
+        """
+        Repeat a sampled search against the migration target in the background.
+
+        Runs on one worker thread and is skipped while a previous shadow
+        query is still running, so it never adds latency or queues up work.
+        Only compared once the backfill is complete, a partial target would
+        only measure the backfill progress.
+        """
+        migration, target = self._migration, self._migration_collection
+        if (
+            target is None
+            or migration.get("status") != "ready"
+            or self.shadow_rate <= 0
+            or random.random() >= self.shadow_rate
+        ):
+            return
+        if not self._shadow_busy.acquire(blocking=False):
+            return
+        if self._shadow_pool is None:
+            self._shadow_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-shadow")
+        source_model = self.model_name
+        
+        def run():
+            try:
+                query_params = {"query_texts": [query], "n_results": max_results}
+                if where:
+                    query_params["where"] = where
+                shadow_ids = target.query(**query_params)["ids"][0]
+                EMBEDDING_SHADOW_OVERLAP.observe(
+                    top_k_overlap(served_ids, shadow_ids),
+                    source_model=source_model,
+                    target_model=migration["model"]
+                )
+            except Exception as e:
+                print(f"Shadow query failed: {str(e)}")
+            finally:
+                self._shadow_busy.release()
+        
+        try:
+            self._shadow_pool.submit(run)
+        except Exception:
+            self._shadow_busy.release()
+
+    def _check_writable(self):
+        if self.read_only:
+            raise RuntimeError(f"Collection {self.name} is opened read-only")
+
     def add_ordinances(self, ordinances: List[Dict], batch_size: int = 100):
         """Add multiple ordinances to the collection"""
+        self._check_writable()
+        self._refresh_migration()
         documents = []
         metadatas = []
         ids = []
@@ -132,11 +376,136 @@ class OrdinanceDBWithTogether(ChromaDb):
                     metadatas=metadatas[i:batch_end],
                     ids=ids[i:batch_end]
                 )
+                self._mirror(ids[i:batch_end], metadatas[i:batch_end], documents[i:batch_end])
                 print(f"Added batch {i//batch_size + 1} of {(len(documents)-1)//batch_size + 1}")
             except Exception as e:
                 print(f"Error adding batch {i//batch_size + 1}: {str(e)}")
                 raise
 
+    @staticmethod
+    def ordinance_ids(ordinances: Iterable[Dict]) -> Iterator[Tuple[str, Dict]]:
+        """
+        Pair ordinances with stable IDs derived from where each sits in the code.
+
+        The same section parsed again gets the same ID, so upserting a file
+        replaces its previous copy instead of duplicating it. Repeated
+        sections within one call are numbered in order of appearance.
+        """
+        seen: Dict[str, int] = {}
+        for ordinance in ordinances:
+            metadata = ordinance['metadata']
+            key = "|".join(
+                str(metadata.get(field, ''))
+                for field in ('state', 'city', 'title', 'chapter', 'section', 'url')
+            )
+            digest = hashlib.sha256(key.encode()).hexdigest()[:32]
+            occurrence = seen.get(digest, 0)
+            seen[digest] = occurrence + 1
+            yield f"{digest}-{occurrence}", ordinance
+
+    def upsert_ordinances(self, ordinances: Iterable[Dict], batch_size: int = 100) -> int:
+        """
+        Insert or replace ordinances keyed by ordinance_ids.
+
+        Unlike add_ordinances this is safe to run for several files at once
+        and to retry, a re-run overwrites the sections it already wrote.
+        Ordinances may be a stream, only one batch is held at a time.
+        During an embedding migration each batch is also written to the
+        migration target. In a deduplicated collection, near-duplicates of
+        stored sections are added as references to them instead, see
+        _assign_duplicates, and last_duplicates counts them.
+
+        Returns:
+            Number of documents written to the collection
+        """
+        self._check_writable()
+        self._refresh_migration()
+        written = 0
+        self.last_duplicates = 0
+        pairs = self.ordinance_ids(ordinances)
+        while True:
+            batch = list(islice(pairs, batch_size))
+            if not batch:
+                break
+            touched: set = set()
+            if self._deduplicated():
+                batch, touched = self._assign_duplicates(batch)
+            documents = [self._format_document(o) for _, o in batch]
+            ids = [id_ for id_, _ in batch]
+            if self._deduplicated():
+                metadatas = [self._dedup_index.canonical_metadata(id_) for id_ in ids]
+            else:
+                metadatas = [o['metadata'] for _, o in batch]
+            try:
+                if ids:
+                    self.collection.upsert(documents=documents, metadatas=metadatas, ids=ids)
+                    self._mirror(ids, metadatas, documents)
+                    if self._deduplicated():
+                        self._dedup_index.mark_stored(ids)
+                self._refresh_references(touched - set(ids))
+            except Exception as e:
+                print(f"Error upserting batch {written//batch_size + 1}: {str(e)}")
+                raise
+            written += len(batch)
+            print(f"Upserted {written} ordinances, {self.last_duplicates} stored as duplicates")
+        return written
+
+    def _deduplicated(self) -> bool:
+        if not (self.collection.metadata or {}).get("dedup"):
+            return False
+        if self._dedup_index is None or self._dedup_index.collection != self.name:
+            self._dedup_index = DedupIndex(self.name)
+        return True
+
+    def _assign_duplicates(self, batch: List[Tuple[str, Dict]]) -> Tuple[List[Tuple[str, Dict]], set]:
+        """
+        Split a batch into the sections to store and the duplicates to reference.
+
+        Returns:
+            The sections to embed and store, and the stored canonical
+            sections whose references changed
+        """
+        stored = []
+        touched = set()
+        for id_, ordinance in batch:
+            document = self._format_document(ordinance)
+            canonical, previous = self._dedup_index.assign(
+                id_, ordinance.get('content', ''), ordinance['metadata'],
+                estimate_tokens(document), len(document.encode())
+            )
+            if previous:
+                touched.add(previous)
+            if canonical is None:
+                stored.append((id_, ordinance))
+            else:
+                touched.add(canonical)
+                self.last_duplicates += 1
+        return stored, touched
+
+    def _refresh_references(self, canonical_ids: set):
+        """
+        Rewrite the metadata of stored sections whose copies changed jurisdictions.
+
+        Only the state and city flags live in the collection, so most new
+        copies, from a jurisdiction the section already has, change nothing
+        and are not written.
+        """
+        if not canonical_ids:
+            return
+        ids = sorted(canonical_ids)
+        stored = self.collection.get(ids=ids, include=["metadatas"])
+        current = dict(zip(stored["ids"], stored["metadatas"]))
+        changed = [
+            (id_, metadata) for id_, metadata in
+            ((id_, self._dedup_index.canonical_metadata(id_)) for id_ in ids)
+            if current.get(id_) != metadata
+        ]
+        if not changed:
+            return
+        ids, metadatas = [list(column) for column in zip(*changed)]
+        self.collection.update(ids=ids, metadatas=metadatas)
+        self._mirror(ids, metadatas)
+
     def update_collection(
         self,
         new_documents: List[Dict],
@@ -171,6 +540,27 @@ Content:
         return formatted
     
     
+    def _embed_query(self, query: str, embedding_function=None, model_name: str = None) -> Tuple[List[float], bool]:
+        """Embed a search query, returns the embedding and whether it was cached"""
+        if embedding_function is None:
+            _, embedding_function, model_name = self._serving()
+        key = (model_name, query)
+        with self._query_cache_lock:
+            embedding = self._query_embeddings.get(key)
+            if embedding is not None:
+                self._query_embeddings.move_to_end(key)
+        if embedding is not None:
+            CACHE_REQUESTS.inc(cache="query_embedding", result="hit", route=current_route.get())
+            return embedding, True
+        
+        CACHE_REQUESTS.inc(cache="query_embedding", result="miss", route=current_route.get())
+        embedding = embedding_function([query])[0]
+        with self._query_cache_lock:
+            self._query_embeddings[key] = embedding
+            if len(self._query_embeddings) > self.query_cache_size:
+                self._query_embeddings.popitem(last=False)
+        return embedding, False
+    
     def search_ordinances(
         self,
         query: str,
@@ -189,37 +579,92 @@ Content:
             state: Filter by state
             city: Filter by city
         """
+        self.refresh_alias()
+        collection, embedding_function, model_name = self._serving()
+        # Traced through the globally configured llama_index callback manager
+        callback_manager = Settings.callback_manager
+        
+        with callback_manager.event(
+            CBEventType.EMBEDDING,
+            payload={EventPayload.MODEL_NAME: model_name, "query_bytes": len(query.encode())}
+        ) as embed_event:
+            start = time.perf_counter()
+            embedding, cached = self._embed_query(query, embedding_function, model_name)
+            cache = "hit" if cached else "miss"
+            if cached:
+                observe_stage("embed", time.perf_counter() - start, model=model_name, cache=cache)
+            embed_event.on_end(payload={EventPayload.EMBEDDINGS: [embedding], "cache": cache})
+        
         query_params = {
-            "query_texts": [query],
+            "query_embeddings": [embedding],
             "n_results": max_results
         }
+        dedup = bool((collection.metadata or {}).get("dedup"))
+        where = self._build_where(filter_conditions, state, city, dedup)
+        if where:
+            query_params["where"] = where
         
-        # Combine all filters using ChromaDB's $and operator
-        if any([filter_conditions, state, city]):
-            where_conditions = []
-            
-            if filter_conditions:
-                for key, value in filter_conditions.items():
-                    where_conditions.append({key: value})
-            if state:
-                where_conditions.append({"state": state})
-            if city:
-                where_conditions.append({"city": city})
-                
-            if where_conditions:
-                if len(where_conditions) == 1:
-                    query_params["where"] = where_conditions[0]
-                else:
-                    query_params["where"] = {"$and": where_conditions}
-        
-        results = self.collection.query(**query_params)
+        with callback_manager.event(
+            CBEventType.QUERY,
+            payload={SPAN_NAME: "vector_query", "collection": collection.name, "n_results": max_results}
+        ) as query_event:
+            with stage_timer("vector_query", model=model_name, cache=cache):
+                results = collection.query(**query_params)
+            query_event.on_end(payload={"result_count": len(results['ids'][0])})
+        
+        self._maybe_shadow(query, max_results, where, results['ids'][0])
+        formatted = self._format_results(results, 0)
+        if dedup:
+            formatted = self._resolve_copies(collection.name, formatted, filter_conditions, state, city)
+        return formatted
+    
+    @staticmethod
+    def _build_where(
+        filter_conditions: Optional[Dict] = None,
+        state: Optional[str] = None,
+        city: Optional[str] = None,
+        dedup: bool = False
+    ) -> Optional[Dict]:
+        """
+        Combine all filters using ChromaDB's $and operator
         
+        In a deduplicated collection a stored section stands for every copy,
+        state and city filters, plain or "$eq"/"$in", match the flags of all
+        its copies instead. Other operators still apply to the stored
+        section's own metadata. A copy may be stored in another
+        jurisdiction's shard, so in a sharded collection these searches
+        query every shard.
+        """
+        where_conditions = []
+        filters = list((filter_conditions or {}).items())
+        if state:
+            filters.append(("state", state))
+        if city:
+            filters.append(("city", city))
+        for key, value in filters:
+            values = _filter_values(value) if dedup and key in ("state", "city") else None
+            if not values:
+                where_conditions.append({key: value})
+            elif len(values) == 1:
+                where_conditions.append(copy_flags({key: next(iter(values))}))
+            else:
+                where_conditions.append({"$or": [copy_flags({key: v}) for v in sorted(values)]})
+        
+        if not where_conditions:
+            return None
+        if len(where_conditions) == 1:
+            return where_conditions[0]
+        return {"$and": where_conditions}
+    
+    @staticmethod
+    def _format_results(results: Dict, index: int, limit: Optional[int] = None) -> List[Dict]:
+        """Results of the index-th query embedding of a collection.query call"""
         formatted_results = []
         for doc, metadata, distance, id_ in zip(
-            results['documents'][0],
-            results['metadatas'][0],
-            results['distances'][0],
-            results['ids'][0]
+            results['documents'][index],
+            results['metadatas'][index],
+            results['distances'][index],
+            results['ids'][index]
         ):
             formatted_results.append({
                 'document': doc,
@@ -227,23 +672,159 @@ Content:
                 'relevance_score': 1 - distance,
                 'id': id_
             })
+        return formatted_results[:limit] if limit is not None else formatted_results
+    
+    def _resolve_copies(
+        self,
+        collection_name: str,
+        results: List[Dict],
+        filter_conditions: Optional[Dict] = None,
+        state: Optional[str] = None,
+        city: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        Present deduplicated results as the copy the search asked for.
+
+        The copies of each stored section are read from the DedupIndex. A
+        section matching a state or city filter through one of them is
+        returned with that copy's metadata and its own text, so results
+        always belong to the jurisdiction searched. A copy whose text is not
+        in the index is left as the stored section. "copies" counts the
+        sections sharing the embedding.
+        """
+        filters = dict(filter_conditions or {})
+        wanted = {
+            key: _filter_values(value)
+            for key, value in (("state", state or filters.get("state")), ("city", city or filters.get("city")))
+        }
+        index = self._read_indexes.get(collection_name)
+        if index is None:
+            index = self._read_indexes.setdefault(collection_name, DedupIndex(collection_name))
+        references = index.references([result['id'] for result in results])
+        for result in results:
+            own = {k: v for k, v in result['metadata'].items() if not k.startswith(("state__", "city__"))}
+            copies = [{"metadata": own, "content": None}] + references.get(result['id'], [])
+            chosen = next(
+                (c for c in copies if all(not v or c["metadata"].get(k) in v for k, v in wanted.items())),
+                copies[0]
+            )
+            if chosen["content"] is not None:
+                result['document'] = self._format_document(chosen)
+                result['metadata'] = chosen["metadata"]
+            else:
+                result['metadata'] = own
+            result['copies'] = len(copies)
+        return results
+
+    def search_ordinances_batch(self, searches: List[Dict]) -> List[List[Dict]]:
+        """
+        Run many searches with shared work.
+        
+        Query embeddings missing from the cache are fetched in one embedding
+        call, and searches with the same filters are answered by a single
+        collection.query with several query embeddings.
+        
+        Args:
+            searches: Dicts with "query" and optionally "max_results",
+                "filter_conditions", "state" and "city", as for search_ordinances
             
-        return formatted_results
+        Returns:
+            Results for each search, in the order given
+        """
+        self.refresh_alias()
+        collection, embedding_function, model_name = self._serving()
+        callback_manager = Settings.callback_manager
+        
+        # Embed the distinct uncached queries together
+        queries = [item["query"] for item in searches]
+        embeddings: Dict[str, List[float]] = {}
+        with self._query_cache_lock:
+            for query in queries:
+                embedding = self._query_embeddings.get((model_name, query))
+                if embedding is not None:
+                    embeddings[query] = embedding
+                    self._query_embeddings.move_to_end((model_name, query))
+        missing = list(dict.fromkeys(q for q in queries if q not in embeddings))
+        route = current_route.get()
+        CACHE_REQUESTS.inc(len(queries) - len(missing), cache="query_embedding", result="hit", route=route)
+        CACHE_REQUESTS.inc(len(missing), cache="query_embedding", result="miss", route=route)
+        if missing:
+            with callback_manager.event(
+                CBEventType.EMBEDDING,
+                payload={EventPayload.MODEL_NAME: model_name, "query_count": len(missing)}
+            ) as embed_event:
+                fetched = embedding_function(missing)
+                embed_event.on_end(payload={EventPayload.EMBEDDINGS: fetched, "cache": "miss"})
+            with self._query_cache_lock:
+                for query, embedding in zip(missing, fetched):
+                    embeddings[query] = embedding
+                    self._query_embeddings[(model_name, query)] = embedding
+                while len(self._query_embeddings) > self.query_cache_size:
+                    self._query_embeddings.popitem(last=False)
+        
+        # One vector query per distinct filter
+        dedup = bool((collection.metadata or {}).get("dedup"))
+        groups: Dict[str, List[int]] = {}
+        wheres: Dict[str, Optional[Dict]] = {}
+        for i, item in enumerate(searches):
+            where = self._build_where(item.get("filter_conditions"), item.get("state"), item.get("city"), dedup)
+            key = json.dumps(where, sort_keys=True)
+            groups.setdefault(key, []).append(i)
+            wheres[key] = where
+        
+        output: List[List[Dict]] = [[] for _ in searches]
+        for key, indices in groups.items():
+            n_results = max(searches[i].get("max_results", 5) for i in indices)
+            query_params = {
+                "query_embeddings": [embeddings[searches[i]["query"]] for i in indices],
+                "n_results": n_results
+            }
+            if wheres[key]:
+                query_params["where"] = wheres[key]
+            with callback_manager.event(
+                CBEventType.QUERY,
+                payload={SPAN_NAME: "vector_query", "collection": collection.name, "n_results": n_results, "query_count": len(indices)}
+            ) as query_event:
+                with stage_timer("vector_query", model=model_name, cache="batch"):
+                    results = collection.query(**query_params)
+                query_event.on_end(payload={"result_count": sum(len(ids) for ids in results['ids'])})
+            for position, i in enumerate(indices):
+                output[i] = self._format_results(results, position, searches[i].get("max_results", 5))
+                if dedup:
+                    output[i] = self._resolve_copies(
+                        collection.name, output[i], searches[i].get("filter_conditions"), searches[i].get("state"), searches[i].get("city")
+                    )
+        return output
 
     @classmethod
     def from_excel(cls, excel_path: str, api_key: str, **kwargs):
-        """Create OrdinanceDB instance from Excel file"""
-        print(f"Parsing Excel file: {excel_path}")
-        ordinances = extract_ordinance_metadata(excel_path)
-        if not ordinances:
-            raise ValueError("Failed to parse ordinances from Excel file")
+        """
+        Create OrdinanceDB instance from Excel file
+        
+        The Excel file is only parsed when the parse cache has no entry for
+        its current content, otherwise the cached records are streamed.
+        """
+        ordinances, cached = open_ordinances(excel_path)
+        print(f"{'Using cached parse of' if cached else 'Parsed'} Excel file: {excel_path}")
         
         print(f"Creating database instance...")
         kwargs['force_recreate'] = True
         db = cls(api_key=api_key, **kwargs)
         
-        print(f"Adding {len(ordinances)} ordinances to database...")
-        db.add_ordinances(ordinances)
+        written = db.upsert_ordinances(ordinances)
+        print(f"Added {written} ordinances to database")
+        
+        return db
+
+    @classmethod
+    def from_parsed(cls, path: str, api_key: str, **kwargs):
+        """Create OrdinanceDB instance from a compact intermediate file, in bounded memory"""
+        print(f"Streaming parsed ordinances: {path}")
+        kwargs['force_recreate'] = True
+        db = cls(api_key=api_key, **kwargs)
+        
+        written = db.upsert_ordinances(iter_ordinances(path))
+        print(f"Added {written} ordinances to database")
         
         return db
 
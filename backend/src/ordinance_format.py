@@ -0,0 +1,155 @@
+# ordinance_format.py
+import gzip
+import json
+import os
+from typing import Dict, Iterable, Iterator, List
+
+FORMAT_NAME = "ordinances-ndjson"
+FORMAT_VERSION = 1
+SUFFIX = ".ordinances.ndjson.gz"
+
+# Few distinct values repeated on every section, stored once and referenced by index
+DICTIONARY_FIELDS = ("title", "chapter", "state", "city")
+PLAIN_FIELDS = ("section", "subtitle", "url", "pages")
+
+
+def parsed_path(source_path: str) -> str:
+    """Intermediate file written next to a source export"""
+    root, _ = os.path.splitext(source_path)
+    return root + SUFFIX
+
+
+class OrdinanceWriter:
+    """
+    Streams ordinance records into a gzip compressed, line-delimited file.
+
+    The first line is a header naming the columns. Each record is then one
+    JSON array holding the metadata columns and the content, where the
+    title, chapter, state and city columns hold indexes into per-column
+    dictionaries. A dictionary entry is written on its own line just before
+    the first record using it, so neither side needs all values up front.
+
+    The file is written under a temporary name and renamed on close, readers
+    never see a partial file.
+    """
+
+    def __init__(self, path: str, compresslevel: int = 6):
+        self.path = path
+        self._tmp_path = f"{path}.{os.getpid()}.tmp"
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = gzip.open(self._tmp_path, "wt", encoding="utf-8", compresslevel=compresslevel)
+        self._dictionaries: Dict[str, Dict[str, int]] = {field: {} for field in DICTIONARY_FIELDS}
+        self.count = 0
+        self._write_line({
+            "format": FORMAT_NAME,
+            "version": FORMAT_VERSION,
+            "dictionary_fields": list(DICTIONARY_FIELDS),
+            "plain_fields": list(PLAIN_FIELDS)
+        })
+
+    def __enter__(self) -> "OrdinanceWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _write_line(self, value):
+        self._file.write(json.dumps(value, ensure_ascii=False, separators=(",", ":")))
+        self._file.write("\n")
+
+    def write(self, ordinance: Dict):
+        metadata = ordinance["metadata"]
+        row = []
+        for field in DICTIONARY_FIELDS:
+            value = metadata.get(field)
+            if value is None:
+                row.append(None)
+                continue
+            codes = self._dictionaries[field]
+            code = codes.get(value)
+            if code is None:
+                code = codes[value] = len(codes)
+                self._write_line({"d": field, "i": code, "v": value})
+            row.append(code)
+        row.extend(metadata.get(field) for field in PLAIN_FIELDS)
+        # Fields outside the fixed columns, rare enough to keep as a mapping
+        extra = {k: v for k, v in metadata.items() if k not in DICTIONARY_FIELDS and k not in PLAIN_FIELDS}
+        row.append(extra or None)
+        row.append(ordinance.get("content", ""))
+        self._write_line(row)
+        self.count += 1
+
+    def write_all(self, ordinances: Iterable[Dict]) -> int:
+        for ordinance in ordinances:
+            self.write(ordinance)
+        return self.count
+
+    def close(self):
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
+
+
+def write_ordinances(path: str, ordinances: Iterable[Dict]) -> int:
+    """Write records to path, returns how many were written"""
+    with OrdinanceWriter(path) as writer:
+        return writer.write_all(ordinances)
+
+
+def iter_ordinances(path: str) -> Iterator[Dict]:
+    """
+    Read records back one at a time, in the {"metadata", "content"} shape
+    produced by parser.extract_ordinance_metadata.
+
+    Only the dictionaries and the current line are held in memory.
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline() or "null")
+        if not header or header.get("format") != FORMAT_NAME:
+            raise ValueError(f"{path} is not an {FORMAT_NAME} file")
+        if header["version"] > FORMAT_VERSION:
+            raise ValueError(f"{path} has format version {header['version']}, this reader supports {FORMAT_VERSION}")
+        dictionary_fields = header["dictionary_fields"]
+        plain_fields = header["plain_fields"]
+        dictionaries: Dict[str, List[str]] = {field: [] for field in dictionary_fields}
+
+        for line in f:
+            value = json.loads(line)
+            if isinstance(value, dict):
+                dictionaries[value["d"]].append(value["v"])
+                continue
+            metadata = {}
+            for field, code in zip(dictionary_fields, value):
+                if code is not None:
+                    metadata[field] = dictionaries[field][code]
+            offset = len(dictionary_fields)
+            for field, plain in zip(plain_fields, value[offset:]):
+                if plain is not None:
+                    metadata[field] = plain
+            extra = value[offset + len(plain_fields)]
+            if extra:
+                metadata.update(extra)
+            yield {"metadata": metadata, "content": value[-1]}
+
+
+def iter_batches(path: str, batch_size: int = 100) -> Iterator[List[Dict]]:
+    """Records in lists of at most batch_size"""
+    batch = []
+    for ordinance in iter_ordinances(path):
+        batch.append(ordinance)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
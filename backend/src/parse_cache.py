@@ -0,0 +1,108 @@
+# parse_cache.py
+import hashlib
+import json
+import os
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from .ordinance_format import SUFFIX, iter_ordinances, write_ordinances
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ParseCache:
+    """
+    Parsed ordinance records keyed by the source file's content and the parser version.
+
+    Entries are stored in the compact ordinance format, named after the
+    SHA-256 of the source file and the parser version, so a changed file or
+    a new parser never reads stale records. Hashing a large export takes a
+    while, so each source path also gets a small fingerprint file with its
+    size, mtime and last hash: while size and mtime match, the hash is
+    reused without reading the file. A touched but unchanged file is hashed
+    again and still hits.
+
+    Entries and fingerprints are written to temporary names and renamed, so
+    concurrent ingestions never read a partial entry.
+    """
+
+    def __init__(self, directory: Optional[str] = None, parser_version: str = "1"):
+        """
+        Args:
+            directory: Where entries are kept, defaults to PARSE_CACHE_DIR
+            parser_version: Bumped whenever parsing changes, old entries stop matching
+        """
+        self.directory = directory or os.getenv("PARSE_CACHE_DIR", "data/parse_cache")
+        self.parser_version = parser_version
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _fingerprint_path(self, source_path: str) -> str:
+        key = hashlib.sha256(os.path.abspath(source_path).encode()).hexdigest()
+        return os.path.join(self.directory, f"{key}.fingerprint.json")
+
+    def _entry_path(self, content_hash: str) -> str:
+        return os.path.join(self.directory, f"{content_hash}-p{self.parser_version}{SUFFIX}")
+
+    def content_hash(self, source_path: str) -> str:
+        """SHA-256 of the source, reused from the fingerprint while size and mtime match"""
+        stat = os.stat(source_path)
+        fingerprint_path = self._fingerprint_path(source_path)
+        try:
+            with open(fingerprint_path) as f:
+                fingerprint = json.load(f)
+            if fingerprint["size"] == stat.st_size and fingerprint["mtime_ns"] == stat.st_mtime_ns:
+                return fingerprint["sha256"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+        content_hash = file_sha256(source_path)
+        tmp_path = f"{fingerprint_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": content_hash}, f)
+        os.replace(tmp_path, fingerprint_path)
+        return content_hash
+
+    def get(self, source_path: str) -> Optional[Iterator[Dict]]:
+        """Cached records of the source, None on a miss"""
+        entry_path = self._entry_path(self.content_hash(source_path))
+        if not os.path.exists(entry_path):
+            return None
+        return iter_ordinances(entry_path)
+
+    def put(self, source_path: str, ordinances: List[Dict]) -> str:
+        """Store the records parsed from the source, returns the entry path"""
+        entry_path = self._entry_path(self.content_hash(source_path))
+        write_ordinances(entry_path, ordinances)
+        return entry_path
+
+    def load_or_parse(
+        self,
+        source_path: str,
+        parse: Callable[[str], Optional[List[Dict]]]
+    ) -> Tuple[Iterator[Dict], bool]:
+        """
+        Records of the source, from the cache or by parsing it.
+
+        Args:
+            source_path: The export to read
+            parse: Parser returning the records, or None when parsing failed
+
+        Returns:
+            (iterator of records, whether it was a cache hit)
+
+        Raises:
+            ValueError: The source could not be parsed
+        """
+        cached = self.get(source_path)
+        if cached is not None:
+            return cached, True
+        ordinances = parse(source_path)
+        if not ordinances:
+            raise ValueError(f"Failed to parse ordinances from {source_path}")
+        self.put(source_path, ordinances)
+        return iter(ordinances), False
@@ -1,10 +1,18 @@
 import pandas as pd
 import json
-from pathlib import Path
+from typing import Dict, Iterator, Tuple
 
-def extract_ordinance_metadata(excel_path):
+from .ordinance_format import parsed_path, write_ordinances
+from .parse_cache import ParseCache
+
+# Bump whenever the records produced for the same Excel file change, cached parses are then ignored
+PARSER_VERSION = "1"
+
+_parse_cache = None
+
+def parse_ordinances(excel_path):
     """
-    Extract metadata and content from Code of Ordinances Excel file.
+    Parse a Code of Ordinances Excel file without writing anything.
     
     Args:
         excel_path (str): Path to the XLSX file
@@ -53,19 +61,52 @@ def extract_ordinance_metadata(excel_path):
                     
                     ordinances.append(ordinance)
                     
-        # Save to JSON file
-        output_path = Path(excel_path).with_suffix('.json')
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(ordinances, f, indent=2, ensure_ascii=False)
-            
         print(f"Successfully processed {len(ordinances)} ordinances")
-        print(f"Output saved to: {output_path}")
-        
         return ordinances
                 
     except Exception as e:
         return None
 
+def extract_ordinance_metadata(excel_path):
+    """
+    Extract metadata and content from Code of Ordinances Excel file.
+    
+    The records are also saved next to the Excel file in the compact
+    intermediate format.
+    
+    Args:
+        excel_path (str): Path to the XLSX file
+        
+    Returns:
+        list: List of dictionaries containing metadata and content for each section
+    """
+    ordinances = parse_ordinances(excel_path)
+    if ordinances:
+        output_path = parsed_path(excel_path)
+        write_ordinances(output_path, ordinances)
+        print(f"Output saved to: {output_path}")
+    return ordinances
+
+def parse_cache() -> ParseCache:
+    """Process-wide cache of parsed exports, in PARSE_CACHE_DIR"""
+    global _parse_cache
+    if _parse_cache is None:
+        _parse_cache = ParseCache(parser_version=PARSER_VERSION)
+    return _parse_cache
+
+def open_ordinances(excel_path) -> Tuple[Iterator[Dict], bool]:
+    """
+    Ordinances of an Excel export, streamed from the parse cache when the
+    file was parsed before and parsed (then cached) otherwise.
+    
+    Args:
+        excel_path (str): Path to the XLSX file
+        
+    Returns:
+        tuple: (iterator of ordinances, whether the cache was hit)
+    """
+    return parse_cache().load_or_parse(excel_path, parse_ordinances)
+
 def main():
     # Example usage
     file_path = '/Users/lianasoima/Documents/compllama/backend/data/raw_files/AventuraFLCodeofOrdinancesEXPORT20240913.xlsx'
@@ -0,0 +1,221 @@
+# pdf_extraction.py
+import io
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+# Headings that start a new section in municipal code PDFs
+SECTION_HEADING = re.compile(
+    r"^\s*((?:Sec(?:tion)?s?\.?\s+[\dA-Z][\w.\-–—]*)|(?:CHAPTER\s+[\dA-Z][\w.\-]*)|(?:ARTICLE\s+[\dA-Z][\w.\-]*))(.*)$",
+    re.MULTILINE
+)
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+@dataclass
+class PageText:
+    """Text of one page and how long it took to extract"""
+    page_number: int  # 1-based
+    text: str
+    seconds: float
+
+
+def _read_shared(source: Tuple[str, int]) -> bytes:
+    """Copy a document out of the shared memory block the caller wrote it to"""
+    name, size = source
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return bytes(block.buf[:size])
+    finally:
+        block.close()
+
+
+def _extract_range(source: Union[bytes, Tuple[str, int]], start: int, end: int) -> List[PageText]:
+    """Extract pages [start, end) of the document bytes or shared memory block (name, size)"""
+    import pdfplumber
+
+    pdf_bytes = source if isinstance(source, bytes) else _read_shared(source)
+    pages = []
+    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+        for index in range(start, min(end, len(pdf.pages))):
+            began = time.perf_counter()
+            page = pdf.pages[index]
+            # Pages without a text layer return None
+            text = page.extract_text() or ""
+            page.close()
+            pages.append(PageText(index + 1, text, time.perf_counter() - began))
+    return pages
+
+
+def page_count(pdf_bytes: bytes) -> int:
+    import pdfplumber
+
+    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+        return len(pdf.pages)
+
+
+def shared_pool() -> ProcessPoolExecutor:
+    """
+    Process pool reused across documents, sized by PDF_WORKERS.
+
+    Workers are spawned rather than forked, the callers run event loops and
+    threads that must not be duplicated into the children.
+    """
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 2))),
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+
+def iter_pages(
+    pdf_bytes: bytes,
+    pages_per_task: int = 16,
+    executor: Optional[Executor] = None
+) -> Iterator[PageText]:
+    """
+    Extract page text in parallel, yielding pages in document order.
+
+    The page ranges are extracted concurrently by the pool, and each range is
+    yielded as soon as it and every range before it are done. Documents of a
+    single range are extracted in the calling process.
+
+    The document is written once to a shared memory block and tasks carry
+    only its name, instead of every task pickling the whole file to a worker.
+
+    Args:
+        pdf_bytes: The PDF file contents
+        pages_per_task: Pages extracted per pool task
+        executor: Pool to use, defaults to the shared process pool
+    """
+    total = page_count(pdf_bytes)
+    if total <= pages_per_task:
+        yield from _extract_range(pdf_bytes, 0, total)
+        return
+
+    executor = executor or shared_pool()
+    block = shared_memory.SharedMemory(create=True, size=len(pdf_bytes))
+    futures = []
+    try:
+        block.buf[:len(pdf_bytes)] = pdf_bytes
+        source = (block.name, len(pdf_bytes))
+        futures = [
+            executor.submit(_extract_range, source, start, start + pages_per_task)
+            for start in range(0, total, pages_per_task)
+        ]
+        for future in futures:
+            yield from future.result()
+    finally:
+        # Stopped early, do not keep the pool busy with unwanted pages
+        for future in futures:
+            future.cancel()
+        # Tasks already running keep their mapping, the name goes away now
+        block.close()
+        block.unlink()
+
+
+def split_sections(pages: Iterable[PageText], base_metadata: Dict) -> Iterator[Dict]:
+    """
+    Group streamed page text into section records.
+
+    A record starts at each section heading and ends at the next one, which
+    may be pages later. Text before the first heading becomes a preamble
+    record. Records have the {"metadata", "content"} shape produced by
+    parser.extract_ordinance_metadata, with the heading as "section" and the
+    page span in "pages".
+    """
+    heading = None
+    subtitle = ""
+    parts: List[str] = []
+    first_page = last_page = None
+
+    def record():
+        content = "\n".join(parts).strip()
+        if not content:
+            return None
+        metadata = dict(base_metadata)
+        metadata["section"] = heading or "Preamble"
+        if subtitle:
+            metadata["subtitle"] = subtitle
+        metadata["pages"] = f"{first_page}-{last_page}" if first_page != last_page else str(first_page)
+        return {"metadata": metadata, "content": content}
+
+    for page in pages:
+        position = 0
+        for match in SECTION_HEADING.finditer(page.text):
+            before = page.text[position:match.start()]
+            if before.strip():
+                parts.append(before)
+                last_page = page.page_number
+                if first_page is None:
+                    first_page = page.page_number
+            section = record()
+            if section is not None:
+                yield section
+            heading = match.group(1).strip()
+            subtitle = match.group(2).strip(" .:-")
+            parts = []
+            first_page = last_page = page.page_number
+            position = match.end()
+        rest = page.text[position:]
+        if rest.strip():
+            parts.append(rest)
+            if first_page is None:
+                first_page = page.page_number
+            last_page = page.page_number
+
+    section = record()
+    if section is not None:
+        yield section
+
+
+@dataclass
+class ExtractionReport:
+    """Per-page timings of one document"""
+    pages: int
+    total_seconds: float
+    wall_seconds: float
+    slowest_pages: List[Dict]
+    empty_pages: List[int]
+
+
+def extract_sections(
+    pdf_bytes: bytes,
+    base_metadata: Dict,
+    pages_per_task: int = 16,
+    executor: Optional[Executor] = None
+):
+    """
+    Extract a PDF into section records ready for chunking and embedding.
+
+    Returns:
+        (records, ExtractionReport) with the per-page timing summary
+    """
+    timings: List[Dict] = []
+    empty_pages: List[int] = []
+    began = time.perf_counter()
+
+    def timed_pages():
+        for page in iter_pages(pdf_bytes, pages_per_task, executor):
+            timings.append({"page": page.page_number, "seconds": page.seconds})
+            if not page.text.strip():
+                empty_pages.append(page.page_number)
+            yield page
+
+    records = list(split_sections(timed_pages(), base_metadata))
+    report = ExtractionReport(
+        pages=len(timings),
+        total_seconds=sum(t["seconds"] for t in timings),
+        wall_seconds=time.perf_counter() - began,
+        slowest_pages=sorted(timings, key=lambda t: t["seconds"], reverse=True)[:5],
+        empty_pages=empty_pages
+    )
+    return records, report
@@ -1,15 +1,21 @@
 # rag.py
+import asyncio
+import time
+from contextlib import aclosing
 from typing import List, Optional, Dict, Any
 from llama_index.core import Settings
 from llama_index.core.schema import TextNode, NodeWithScore
 from llama_index.core.base.base_query_engine import BaseQueryEngine
 from llama_index.core.retrievers import BaseRetriever
-from llama_index.core.callbacks import CallbackManager
+from llama_index.core.callbacks import CallbackManager, CBEventType, EventPayload
 from llama_index.core.llms import CustomLLM
 from llama_index.core.embeddings import BaseEmbedding
 from llama_stack_client import LlamaStackClient
-from llama_stack_client.lib.inference.event_logger import EventLogger
 from .ordinance_db import OrdinanceDBWithTogether
+from .llm_dispatcher import LLMDispatcher, Priority, DeadlineExceeded
+from .utils import estimate_tokens
+from .metrics import stage_timer
+from .tracing import SPAN_NAME, current_request_id
 from dotenv import load_dotenv
 from pydantic import Field
 
@@ -19,7 +25,7 @@ load_dotenv()
 class LlamaStackLLM(CustomLLM):
     """Custom LLM class for LlamaStack integration"""
     
-    client: LlamaStackClient = Field(description="LlamaStack client instance")
+    dispatcher: LLMDispatcher = Field(description="Dispatcher owning the LlamaStack client")
     model_name: str = Field(default="Llama3.2-90B-Vision-Instruct", description="Model name")
     system_prompt: str = Field(
         default="You are a helpful assistant specialized in municipal ordinances. Answer questions accurately based on the provided context.",
@@ -31,14 +37,14 @@ class LlamaStackLLM(CustomLLM):
     
     def __init__(
         self,
-        client: LlamaStackClient,
+        dispatcher: LLMDispatcher,
         model_name: str = "Llama3.2-90B-Vision-Instruct",
         system_prompt: str = "You are a helpful assistant specialized in municipal ordinances. Answer questions accurately based on the provided context.",
         temperature: float = 0.1,
         **kwargs: Any
     ):
         super().__init__(
-            client=client,
+            dispatcher=dispatcher,
             model_name=model_name,
             system_prompt=system_prompt,
             temperature=temperature,
@@ -62,7 +68,8 @@ class LlamaStackLLM(CustomLLM):
             {"role": "user", "content": prompt}
         ]
         
-        response = self.client.inference.chat_completion(
+        # Synchronous callers bypass the dispatcher queue
+        response = self.dispatcher.client.inference.chat_completion(
             messages=messages,
             model=self.model_name,
             stream=True
@@ -81,32 +88,87 @@ class LlamaStackLLM(CustomLLM):
             {"role": "user", "content": prompt}
         ]
         
-        response = self.client.inference.chat_completion(
+        response = self.dispatcher.client.inference.chat_completion(
             messages=messages,
             model=self.model_name
         )
         return response.completion_message.content
 
-    async def acomplete(self, prompt: str, **kwargs) -> str:
-        """Async complete - uses regular complete for now"""
-        return self.complete(prompt, **kwargs)
+    async def acomplete(
+        self,
+        prompt: str,
+        priority: Priority = Priority.DEFAULT,
+        deadline: Optional[float] = None,
+        **kwargs
+    ) -> str:
+        """Async complete through the dispatcher queue"""
+        messages = [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": prompt}
+        ]
+        return await self.dispatcher.complete(
+            messages=messages,
+            model=self.model_name,
+            priority=priority,
+            deadline=deadline
+        )
 
-    async def astream_complete(self, prompt: str, **kwargs):
-        """Stream complete using LlamaStack"""
+    async def astream_complete(
+        self,
+        prompt: str,
+        priority: Priority = Priority.INTERACTIVE,
+        deadline: Optional[float] = None,
+        **kwargs
+    ):
+        """Stream complete through the dispatcher queue"""
         messages = [
             {"role": "system", "content": self.system_prompt},
             {"role": "user", "content": prompt}
         ]
         
-        response = self.client.inference.chat_completion(
+        # aclosing() propagates an early close down to the dispatcher stream
+        async with aclosing(self.dispatcher.stream(
             messages=messages,
             model=self.model_name,
-            stream=True
-        )
+            priority=priority,
+            deadline=deadline
+        )) as tokens:
+            async for token in tokens:
+                yield token
+
+def adaptive_cutoff(
+    scores: List[float],
+    min_k: int = 1,
+    max_k: int = 10,
+    score_threshold: float = 0.85
+) -> int:
+    """
+    Decide how many of the ranked candidates to keep.
+    
+    Candidates are kept while their score stays above score_threshold times
+    the leader's score, the list is cut at the first sharp drop.
+    
+    Args:
+        scores: Relevance scores sorted from best to worst
+        min_k: Minimum number of candidates to keep
+        max_k: Maximum number of candidates to keep
+        score_threshold: Fraction of the leader's score a candidate must reach
         
-        async for log in EventLogger().log(response):
-            if hasattr(log, "content"):
-                yield log.content
+    Returns:
+        Number of candidates to keep
+    """
+    if not scores:
+        return 0
+    
+    leader = scores[0]
+    limit = min(max_k, len(scores))
+    if leader <= 0:
+        return min(min_k, limit)
+    
+    keep = 1
+    while keep < limit and scores[keep] >= leader * score_threshold:
+        keep += 1
+    return max(min(min_k, limit), keep)
 
 class OrdinanceRetriever(BaseRetriever):
     """Custom retriever that wraps OrdinanceDBWithTogether"""
@@ -115,9 +177,26 @@ class OrdinanceRetriever(BaseRetriever):
         self,
         ordinance_db: OrdinanceDBWithTogether,
         similarity_top_k: int = 5,
+        adaptive: bool = False,
+        min_k: int = 1,
+        max_k: int = 10,
+        score_threshold: float = 0.85
     ):
+        """
+        Args:
+            ordinance_db: Database to search
+            similarity_top_k: Number of documents to return when not adaptive
+            adaptive: Over-fetch max_k candidates and cut at the first sharp score drop
+            min_k: Minimum number of documents in adaptive mode
+            max_k: Number of candidates fetched in adaptive mode
+            score_threshold: Fraction of the leader's score a document must reach
+        """
         self.ordinance_db = ordinance_db
         self.similarity_top_k = similarity_top_k
+        self.adaptive = adaptive
+        self.min_k = min_k
+        self.max_k = max_k
+        self.score_threshold = score_threshold
         super().__init__()
 
     def _retrieve(self, query_str: str, **kwargs) -> List[NodeWithScore]:
@@ -128,11 +207,38 @@ class OrdinanceRetriever(BaseRetriever):
         
         results = self.ordinance_db.search_ordinances(
             query=query_str,
-            max_results=self.similarity_top_k,
+            max_results=self.max_k if self.adaptive else self.similarity_top_k,
             filter_conditions=filter_conditions,
             state=state,
             city=city
         )
+        return self._to_nodes(results)
+    
+    def _retrieve_batch(self, searches: List[Dict]) -> List[List[NodeWithScore]]:
+        """Retrieve nodes for many queries, sharing embedding and vector query work"""
+        max_results = self.max_k if self.adaptive else self.similarity_top_k
+        results = self.ordinance_db.search_ordinances_batch([
+            {
+                "query": item["query"],
+                "max_results": max_results,
+                "filter_conditions": item.get("filter_conditions"),
+                "state": item.get("state"),
+                "city": item.get("city")
+            }
+            for item in searches
+        ])
+        return [self._to_nodes(item_results) for item_results in results]
+    
+    def _to_nodes(self, results: List[Dict]) -> List[NodeWithScore]:
+        """Apply the adaptive cut and convert search results to nodes"""
+        if self.adaptive:
+            keep = adaptive_cutoff(
+                [r['relevance_score'] for r in results],
+                min_k=self.min_k,
+                max_k=self.max_k,
+                score_threshold=self.score_threshold
+            )
+            results = results[:keep]
         
         nodes_with_score = []
         for result in results:
@@ -157,94 +263,72 @@ class OrdinanceRAG:
     def __init__(
         self,
         ordinance_db: OrdinanceDBWithTogether,
-        llama_client: LlamaStackClient,
+        llama_client: Optional[LlamaStackClient] = None,
         model_name: str = "Llama3.2-90B-Vision-Instruct",
-        top_k: int = 5
+        top_k: int = 5,
+        dispatcher: Optional[LLMDispatcher] = None,
+        adaptive_top_k: bool = False,
+        min_k: int = 1,
+        max_k: int = 10,
+        score_threshold: float = 0.85,
+        callback_manager: Optional[CallbackManager] = None
     ):
         self.ordinance_db = ordinance_db
         self.top_k = top_k
+        # Events of every query go through this manager, see tracing.py
+        self.callback_manager = callback_manager or CallbackManager()
+        
+        # All LLM calls go through the dispatcher, wrap a bare client if needed
+        if dispatcher is None:
+            dispatcher = LLMDispatcher(client=llama_client)
+        self.dispatcher = dispatcher
         
         # Initialize LlamaStack LLM
         self.llm = LlamaStackLLM(
-            client=llama_client,
+            dispatcher=dispatcher,
             model_name=model_name
         )
         
         # Configure global settings without embedding model
         Settings.llm = self.llm
-        Settings.callback_manager = CallbackManager()
+        Settings.callback_manager = self.callback_manager
         Settings.embed_model = None  # Disable default embedding model
         
         # Initialize custom retriever
         self.retriever = OrdinanceRetriever(
             ordinance_db=self.ordinance_db,
-            similarity_top_k=self.top_k
+            similarity_top_k=self.top_k,
+            adaptive=adaptive_top_k,
+            min_k=min_k,
+            max_k=max_k,
+            score_threshold=score_threshold
         )
     
-    async def aquery(
-        self,
-        query_str: str,
-        filter_conditions: Optional[Dict] = None,
-        state: Optional[str] = None,
-        city: Optional[str] = None,
-        stream: bool = False
-    ):
-        """Async query with optional streaming"""
-        # Get relevant documents
-        nodes = self.retriever._retrieve(
-            query_str,
-            filter_conditions=filter_conditions,
-            state=state,
-            city=city
-        )
-        
-        # Format context
+    def build_prompt(self, query_str: str, nodes: List[NodeWithScore]) -> str:
+        """Build the answer prompt from the retrieved documents"""
         context = "\n\n".join([
             f"Document {i+1}:\n{node.node.text}"
             for i, node in enumerate(nodes)
         ])
         
-        # Create prompt
-        prompt = (
+        return (
             "Based on the following ordinance documents, please answer the question.\n\n"
             f"Documents:\n{context}\n\n"
             f"Question: {query_str}\n\n"
             "Answer:"
         )
-        
-        if stream:
-            generator = self.llm.astream_complete(prompt)
-            return generator  # Return the async generator directly
-        else:
-            return await self.llm.acomplete(prompt)
-    """RAG system for ordinance retrieval and question answering"""
     
-    def __init__(
-        self,
-        ordinance_db: OrdinanceDBWithTogether,
-        llama_client: LlamaStackClient,
-        model_name: str = "Llama3.2-90B-Vision-Instruct",
-        top_k: int = 5
-    ):
-        self.ordinance_db = ordinance_db
-        self.top_k = top_k
-        
-        # Initialize LlamaStack LLM
-        self.llm = LlamaStackLLM(
-            client=llama_client,
-            model_name=model_name
-        )
-        
-        # Configure global settings without embedding model
-        Settings.llm = self.llm
-        Settings.callback_manager = CallbackManager()
-        Settings.embed_model = None  # Disable default embedding model
-        
-        # Initialize custom retriever
-        self.retriever = OrdinanceRetriever(
-            ordinance_db=self.ordinance_db,
-            similarity_top_k=self.top_k
-        )
+    @staticmethod
+    def format_sources(nodes: List[NodeWithScore]) -> List[Dict]:
+        """Summarize retrieved documents for the response"""
+        return [
+            {
+                "id": node.node.id_,
+                "score": node.score,
+                "metadata": node.node.metadata
+            }
+            for node in nodes
+        ]
     
     async def aquery(
         self,
@@ -252,32 +336,136 @@ class OrdinanceRAG:
         filter_conditions: Optional[Dict] = None,
         state: Optional[str] = None,
         city: Optional[str] = None,
-        stream: bool = False
+        stream: bool = False,
+        deadline: Optional[float] = None
     ):
-        """Async query with optional streaming"""
-        # Get relevant documents
-        nodes = self.retriever._retrieve(
-            query_str,
-            filter_conditions=filter_conditions,
-            state=state,
-            city=city
-        )
+        """
+        Async query with optional streaming.
         
-        # Format context
-        context = "\n\n".join([
-            f"Document {i+1}:\n{node.node.text}"
-            for i, node in enumerate(nodes)
-        ])
+        Returns a dict with the retrieved "sources" and "prompt_tokens", plus
+        either the "answer" or, when streaming, the token "generator". A
+        time.monotonic() deadline that passes before generation starts raises
+        DeadlineExceeded instead of calling the LLM.
+        """
+        # One llama_index trace per query keeps the manager's event map bounded
+        with self.callback_manager.as_trace(current_request_id.get() or "query"):
+            # Get relevant documents off the event loop, cancelling the caller
+            # abandons the retrieval before the LLM is ever called
+            with self.callback_manager.event(
+                CBEventType.RETRIEVE,
+                payload={EventPayload.QUERY_STR: query_str, "state": state or "", "city": city or ""}
+            ) as retrieve_event:
+                with stage_timer("retrieve", model=self.llm.model_name):
+                    nodes = await asyncio.to_thread(
+                        self.retriever._retrieve,
+                        query_str,
+                        filter_conditions=filter_conditions,
+                        state=state,
+                        city=city
+                    )
+                retrieve_event.on_end(payload={EventPayload.NODES: nodes})
+            
+            if deadline is not None and time.monotonic() >= deadline:
+                raise DeadlineExceeded("Request deadline passed during retrieval")
+            
+            with self.callback_manager.event(CBEventType.TEMPLATING) as templating_event:
+                with stage_timer("prompt_build", model=self.llm.model_name):
+                    prompt = self.build_prompt(query_str, nodes)
+                templating_event.on_end(payload={EventPayload.PROMPT: prompt})
+            result = {
+                "sources": self.format_sources(nodes),
+                "prompt_tokens": estimate_tokens(prompt)
+            }
+            
+            if stream:
+                result["generator"] = self._traced_stream(prompt, deadline)
+            else:
+                with self.callback_manager.event(
+                    CBEventType.LLM,
+                    payload={EventPayload.PROMPT: prompt, EventPayload.MODEL_NAME: self.llm.model_name}
+                ) as llm_event:
+                    answer = await self.llm.acomplete(prompt, deadline=deadline)
+                    llm_event.on_end(payload={EventPayload.COMPLETION: answer})
+                result["answer"] = answer
+        return result
+    
+    async def aquery_batch(
+        self,
+        items: List[Dict],
+        max_concurrency: int = 8,
+        priority: Priority = Priority.BACKGROUND,
+        deadline: Optional[float] = None
+    ):
+        """
+        Answer many queries, yielding each result as soon as it is ready.
         
-        # Create prompt
-        prompt = (
-            "Based on the following ordinance documents, please answer the question.\n\n"
-            f"Documents:\n{context}\n\n"
-            f"Question: {query_str}\n\n"
-            "Answer:"
-        )
+        Retrieval for all items runs as one batch, then the answers are
+        generated with at most max_concurrency LLM calls in flight. Results
+        come in completion order as dicts with the item's "index" and either
+        "answer" and "sources" or an "error", a failing item does not fail
+        the others. Closing the generator cancels the outstanding items.
+        
+        Args:
+            items: Dicts with "query" and optionally "state", "city" and
+                "filter_conditions"
+            max_concurrency: LLM calls in flight at once for this batch
+            priority: Dispatcher priority, bulk jobs yield to interactive traffic
+            deadline: time.monotonic() deadline for the whole batch
+        """
+        try:
+            with stage_timer("retrieve", model=self.llm.model_name, cache="batch"):
+                batch_nodes = await asyncio.to_thread(self.retriever._retrieve_batch, items)
+        except Exception as e:
+            for index in range(len(items)):
+                yield {"index": index, "error": f"Retrieval failed: {str(e)}"}
+            return
         
-        if stream:
-            return self.llm.astream_complete(prompt)
-        else:
-            return await self.llm.acomplete(prompt)
\ No newline at end of file
+        slots = asyncio.Semaphore(max_concurrency)
+        
+        async def answer(index: int, nodes: List[NodeWithScore]) -> Dict:
+            sources = self.format_sources(nodes)
+            try:
+                async with slots:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        raise DeadlineExceeded("Batch deadline passed before generation")
+                    prompt = self.build_prompt(items[index]["query"], nodes)
+                    text = await self.llm.acomplete(prompt, priority=priority, deadline=deadline)
+                return {"index": index, "answer": text, "sources": sources}
+            except Exception as e:
+                return {"index": index, "error": str(e), "sources": sources}
+        
+        tasks = [
+            asyncio.create_task(answer(index, nodes))
+            for index, nodes in enumerate(batch_nodes)
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    async def _traced_stream(self, prompt: str, deadline: Optional[float]):
+        """Stream the answer inside an LLM event that ends with the stream"""
+        event_id = self.callback_manager.on_event_start(
+            CBEventType.LLM,
+            payload={
+                EventPayload.PROMPT: prompt,
+                EventPayload.MODEL_NAME: self.llm.model_name,
+                SPAN_NAME: "llm_stream"
+            }
+        )
+        chunks = []
+        end_payload = {}
+        try:
+            async with aclosing(self.llm.astream_complete(prompt, deadline=deadline)) as tokens:
+                async for token in tokens:
+                    chunks.append(token)
+                    yield token
+        except Exception as e:
+            end_payload[EventPayload.EXCEPTION] = e
+            raise
+        finally:
+            end_payload[EventPayload.COMPLETION] = "".join(chunks)
+            end_payload["streamed_chunks"] = len(chunks)
+            self.callback_manager.on_event_end(CBEventType.LLM, payload=end_payload, event_id=event_id)
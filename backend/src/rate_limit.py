@@ -0,0 +1,167 @@
+# rate_limit.py
+import asyncio
+import time
+from typing import Mapping, Optional
+
+
+class TokenBucket:
+    """
+    Bucket refilled continuously at a fixed rate, up to its capacity.
+
+    acquire() may take the bucket below zero for requests larger than the
+    capacity, the debt is paid back before anyone else is admitted.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        Args:
+            rate: Units added per second
+            capacity: Most units the bucket holds, the allowed burst
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: Optional[float] = None) -> float:
+        """Seconds until amount can be taken, 0 when it can be taken now"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        needed = min(amount, self.capacity) - self.level
+        return max(0.0, needed / self.rate) if self.rate > 0 else float("inf")
+
+    def take(self, amount: float, now: Optional[float] = None):
+        self._refill(time.monotonic() if now is None else now)
+        self.level -= amount
+
+    def set_rate(self, rate: float, capacity: Optional[float] = None):
+        self._refill(time.monotonic())
+        self.rate = rate
+        if capacity is not None:
+            self.capacity = capacity
+            self.level = min(self.level, capacity)
+
+
+def _header_float(headers: Mapping[str, str], *names: str) -> Optional[float]:
+    for name in names:
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            return float(str(value).rstrip("s"))
+        except ValueError:
+            continue
+    return None
+
+
+class AdaptiveRateLimiter:
+    """
+    Client-side limit on requests per second and tokens per minute.
+
+    Each call reserves one request and its estimated tokens before it is
+    sent. The request rate backs off by half on every 429 and recovers
+    additively after successes, and both limits follow the provider's
+    x-ratelimit-* headers when it sends them. A Retry-After or an exhausted
+    remaining quota pauses all callers until the reset time.
+    """
+
+    def __init__(
+        self,
+        requests_per_second: float = 10.0,
+        tokens_per_minute: float = 180_000.0,
+        min_requests_per_second: float = 0.2,
+        recovery_step: float = 0.1,
+        burst_seconds: float = 1.0
+    ):
+        """
+        Args:
+            requests_per_second: Starting and maximum request rate
+            tokens_per_minute: Token budget, prompt plus completion
+            min_requests_per_second: Floor of the request rate after backoffs
+            recovery_step: Requests per second regained after each success
+            burst_seconds: Seconds of quota that may be spent at once
+        """
+        self.max_requests_per_second = requests_per_second
+        self.min_requests_per_second = min_requests_per_second
+        self.recovery_step = recovery_step
+        self.burst_seconds = burst_seconds
+        self.requests = TokenBucket(requests_per_second, max(1.0, requests_per_second * burst_seconds))
+        self.tokens = TokenBucket(tokens_per_minute / 60.0, max(1.0, tokens_per_minute / 60.0 * burst_seconds))
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    @property
+    def requests_per_second(self) -> float:
+        return self.requests.rate
+
+    @property
+    def tokens_per_minute(self) -> float:
+        return self.tokens.rate * 60.0
+
+    async def acquire(self, tokens: int = 0):
+        """Wait until one request with the given estimated tokens fits both limits"""
+        # Callers queue on the lock, so they are admitted in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                delay = max(
+                    self._paused_until - now,
+                    self.requests.wait_time(1, now),
+                    self.tokens.wait_time(tokens, now)
+                )
+                if delay <= 0:
+                    self.requests.take(1, now)
+                    self.tokens.take(tokens, now)
+                    return
+                await asyncio.sleep(delay)
+
+    def reconcile(self, estimated: int, actual: int):
+        """Correct the token bucket once the real usage of a call is known"""
+        self.tokens.level -= actual - estimated
+
+    def pause(self, seconds: float):
+        """Admit no request for the next seconds"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def on_success(self, headers: Optional[Mapping[str, str]] = None):
+        """Recover the request rate and adopt the provider's limits"""
+        self.requests.set_rate(min(self.max_requests_per_second, self.requests.rate + self.recovery_step))
+        if headers:
+            self._apply_headers(headers)
+
+    def on_rate_limited(self, headers: Optional[Mapping[str, str]] = None) -> float:
+        """
+        Back off after a 429.
+
+        Returns:
+            Seconds to wait before retrying
+        """
+        self.requests.set_rate(max(self.min_requests_per_second, self.requests.rate / 2))
+        retry_after = None
+        if headers:
+            self._apply_headers(headers)
+            retry_after = _header_float(headers, "retry-after", "x-ratelimit-reset")
+        delay = retry_after if retry_after is not None else 1.0 / self.requests.rate
+        self.pause(delay)
+        return delay
+
+    def _apply_headers(self, headers: Mapping[str, str]):
+        # Request limits are reported per second, token limits per minute
+        limit = _header_float(headers, "x-ratelimit-limit-requests", "x-ratelimit-limit")
+        if limit:
+            self.max_requests_per_second = limit
+            if self.requests.rate > limit:
+                self.requests.set_rate(limit, max(1.0, limit * self.burst_seconds))
+        token_limit = _header_float(headers, "x-ratelimit-limit-tokens")
+        if token_limit:
+            self.tokens.set_rate(token_limit / 60.0, max(1.0, token_limit / 60.0 * self.burst_seconds))
+
+        remaining = _header_float(headers, "x-ratelimit-remaining-requests", "x-ratelimit-remaining")
+        remaining_tokens = _header_float(headers, "x-ratelimit-remaining-tokens")
+        if (remaining is not None and remaining <= 0) or (remaining_tokens is not None and remaining_tokens <= 0):
+            reset = _header_float(headers, "x-ratelimit-reset-requests", "x-ratelimit-reset-tokens", "x-ratelimit-reset")
+            self.pause(reset if reset is not None else 1.0)
@@ -1,12 +1,17 @@
 import asyncio
+import os
 from src.client import client
 from src.functions.llm.chat import llm_chat
-from src.functions.hn.search import hn_search
+from src.functions.hn.search import hn_search, hn_mark_seen
 from src.functions.llm.parse_municode_entry import parse_municode_entry
+from src.functions.index.collection_version import (
+    begin_collection_version, discard_collection_version, publish_collection_version
+)
 from src.workflows.campbellca_parser import campbellca_parser
 from src.workflows.municode_parser import municode_parser
 from src.workflows.workflow import hn_workflow
 from src.functions.crawl.crawl_campbellca import crawl_campbellca
+from src.functions.crawl.crawl_urls import crawl_urls
 from src.functions.crawl.store_campbellca_to_db import store_campbellca_to_db
 from restack_ai.restack import ServiceOptions
 
@@ -14,14 +19,20 @@ async def main():
     await asyncio.gather(
         client.start_service(
             workflows=[hn_workflow, municode_parser, campbellca_parser],
-            functions=[hn_search, parse_municode_entry, crawl_campbellca, store_campbellca_to_db],
+            functions=[
+                hn_search, hn_mark_seen, parse_municode_entry,
+                begin_collection_version, publish_collection_version, discard_collection_version,
+                crawl_campbellca, crawl_urls, store_campbellca_to_db
+            ],
         ),
         client.start_service(
             functions=[llm_chat],
             task_queue="llm_chat",
+            # Calls are paced by the shared client's adaptive rate limiter,
+            # the queue only bounds how many wait on it at once
             options=ServiceOptions(
-                rate_limit=1,
-                max_concurrent_function_runs=1
+                rate_limit=float(os.getenv("LLM_CHAT_QUEUE_RATE_LIMIT", "50")),
+                max_concurrent_function_runs=int(os.getenv("LLM_CHAT_CONCURRENCY", "16"))
             )
         )
     )
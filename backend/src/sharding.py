@@ -0,0 +1,326 @@
+# sharding.py
+import hashlib
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+SHARD_KEYS = {"state": ("state",), "city": ("state", "city")}
+SHARD_SEPARATOR = "__"
+
+
+def shard_name(root: str, key: Tuple[str, ...]) -> str:
+    """
+    Collection name of one shard.
+
+    Chroma names allow only a few characters and at most 63 of them, so the
+    jurisdiction is slugged and truncated and a short hash keeps it unique.
+    """
+    value = "|".join(key)
+    slug = re.sub(r"[^a-z0-9]+", "-", value.lower()).strip("-")[:20].strip("-") or "none"
+    digest = hashlib.sha256(value.encode()).hexdigest()[:8]
+    return f"{root}{SHARD_SEPARATOR}{slug}-{digest}"
+
+
+_query_pool: Optional[ThreadPoolExecutor] = None
+_query_pool_lock = threading.Lock()
+
+
+def query_pool() -> ThreadPoolExecutor:
+    """Threads shared by the fan-out of every sharded collection of the process"""
+    global _query_pool
+    with _query_pool_lock:
+        if _query_pool is None:
+            _query_pool = ThreadPoolExecutor(
+                max_workers=int(os.getenv("SHARD_QUERY_WORKERS", "8")),
+                thread_name_prefix="shard-query"
+            )
+        return _query_pool
+
+
+def _collection_names(client) -> List[str]:
+    return [c if isinstance(c, str) else c.name for c in client.list_collections()]
+
+
+def _route_values(where: Optional[Dict], field: str) -> Optional[set]:
+    """
+    Values a where clause restricts field to, None when it does not restrict it.
+
+    Deduplicated collections filter on "state__X"/"city__X" copy flags
+    instead, which do not restrict the shard: a section is stored in the
+    shard of its first copy and carries the flags of copies in other
+    jurisdictions. Such searches query every shard.
+    """
+    if not where:
+        return None
+    conditions = where["$and"] if "$and" in where else [where]
+    allowed = None
+    for condition in conditions:
+        if field not in condition:
+            continue
+        value = condition[field]
+        if isinstance(value, dict):
+            if "$eq" in value:
+                values = {value["$eq"]}
+            elif "$in" in value:
+                values = set(value["$in"])
+            else:
+                continue
+        else:
+            values = {value}
+        allowed = values if allowed is None else allowed & values
+    return allowed
+
+
+class ShardedCollection:
+    """
+    One logical collection stored as one Chroma collection per jurisdiction.
+
+    A small root collection carries the name, the collection metadata and
+    the shard key, shards are the collections named after it with a
+    jurisdiction suffix and hold the documents. Writes go to the shard of
+    each document's state, or state and city. Queries filtered on state or
+    city only search the matching shards, other queries search every shard
+    in parallel and keep the closest results across them, so a filtered
+    search walks a small HNSW graph instead of the whole country's.
+
+    The methods used by this codebase mirror Chroma's Collection, so it can
+    stand in for one wherever a collection is expected.
+    """
+
+    def __init__(
+        self,
+        client,
+        root,
+        embedding_function=None,
+        refresh_seconds: float = 30.0
+    ):
+        """
+        Args:
+            client: Chroma client holding the root and the shards
+            root: The root collection, its metadata names the shard key
+            embedding_function: Embeds documents written and query_texts searched
+            refresh_seconds: How often readers look for shards created by
+                another process
+        """
+        self.client = client
+        self.root = root
+        self.embedding_function = embedding_function
+        self.shard_by = root.metadata["shard_by"]
+        self.key_fields = SHARD_KEYS[self.shard_by]
+        self.refresh_seconds = refresh_seconds
+        self._shards: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        self._refreshed_at = 0.0
+        self.refresh()
+
+    @property
+    def name(self) -> str:
+        return self.root.name
+
+    @property
+    def metadata(self) -> Dict:
+        return self.root.metadata
+
+    def _shard_metadata(self, key: Tuple[str, ...]) -> Dict:
+        metadata = {k: v for k, v in self.metadata.items() if k != "shard_by"}
+        metadata["shard_of"] = self.name
+        metadata.update(zip(self.key_fields, key))
+        return metadata
+
+    def refresh(self):
+        """Pick up the shards that exist now"""
+        prefix = self.name + SHARD_SEPARATOR
+        shards = {}
+        for name in _collection_names(self.client):
+            if not name.startswith(prefix):
+                continue
+            collection = self.client.get_collection(name=name, embedding_function=self.embedding_function)
+            metadata = collection.metadata or {}
+            shards[tuple(metadata.get(field, "") for field in self.key_fields)] = collection
+        with self._lock:
+            self._shards = shards
+            self._refreshed_at = time.monotonic()
+
+    def shards(self) -> Dict[Tuple[str, ...], object]:
+        if time.monotonic() - self._refreshed_at >= self.refresh_seconds:
+            self.refresh()
+        with self._lock:
+            return dict(self._shards)
+
+    def _key(self, metadata: Dict) -> Tuple[str, ...]:
+        return tuple(str(metadata.get(field) or "") for field in self.key_fields)
+
+    def _shard_for_write(self, key: Tuple[str, ...]):
+        with self._lock:
+            shard = self._shards.get(key)
+        if shard is None:
+            shard = self.client.get_or_create_collection(
+                name=shard_name(self.name, key),
+                embedding_function=self.embedding_function,
+                metadata=self._shard_metadata(key)
+            )
+            with self._lock:
+                self._shards[key] = shard
+        return shard
+
+    def route(self, where: Optional[Dict]) -> List:
+        """Shards that can hold documents matching the where clause"""
+        shards = self.shards()
+        allowed = [_route_values(where, field) for field in self.key_fields]
+        return [
+            shard for key, shard in sorted(shards.items())
+            if all(values is None or value in values for value, values in zip(key, allowed))
+        ]
+
+    def _write(self, method: str, ids: List[str], metadatas: List[Dict], **columns):
+        groups: Dict[Tuple[str, ...], List[int]] = {}
+        for i, metadata in enumerate(metadatas):
+            groups.setdefault(self._key(metadata), []).append(i)
+        for key, indices in groups.items():
+            batch = {
+                column: [values[i] for i in indices]
+                for column, values in columns.items() if values is not None
+            }
+            getattr(self._shard_for_write(key), method)(
+                ids=[ids[i] for i in indices],
+                metadatas=[metadatas[i] for i in indices],
+                **batch
+            )
+
+    def upsert(self, ids: List[str], metadatas: List[Dict], documents: List[str] = None, embeddings=None):
+        self._write("upsert", ids, metadatas, documents=documents, embeddings=embeddings)
+
+    def add(self, ids: List[str], metadatas: List[Dict], documents: List[str] = None, embeddings=None):
+        self._write("add", ids, metadatas, documents=documents, embeddings=embeddings)
+
+    def update(self, ids: List[str], metadatas: List[Dict]):
+        """Replace metadata, the shard key fields of a document must not change"""
+        self._write("update", ids, metadatas)
+
+    def count(self) -> int:
+        return sum(shard.count() for shard in self.shards().values())
+
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        where: Optional[Dict] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        include: Sequence[str] = ("metadatas", "documents")
+    ) -> Dict:
+        """Documents of the matching shards, paged in shard order"""
+        include = list(include)
+        merged = {"ids": [], **{field: [] for field in include}}
+        skip = offset or 0
+        for shard in self.route(where):
+            if limit is not None and len(merged["ids"]) >= limit:
+                break
+            if ids is None and skip:
+                # Skip whole shards, counting them without reading documents
+                size = shard.count() if where is None else len(shard.get(where=where, include=[])["ids"])
+                if size <= skip:
+                    skip -= size
+                    continue
+            params = {"include": include}
+            if ids is not None:
+                params["ids"] = ids
+            if where:
+                params["where"] = where
+            if ids is None:
+                if limit is not None:
+                    params["limit"] = limit - len(merged["ids"])
+                if skip:
+                    params["offset"] = skip
+            page = shard.get(**params)
+            if ids is None and skip:
+                skip = 0
+            merged["ids"].extend(page["ids"])
+            for field in include:
+                merged[field].extend(page.get(field) or [])
+        return merged
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None):
+        for shard in self.route(where):
+            shard.delete(ids=ids, where=where)
+
+    def query(
+        self,
+        query_embeddings: Optional[List[List[float]]] = None,
+        query_texts: Optional[List[str]] = None,
+        n_results: int = 10,
+        where: Optional[Dict] = None,
+        include: Sequence[str] = ("metadatas", "documents", "distances")
+    ) -> Dict:
+        """
+        Search the shards the filter routes to and merge their results.
+
+        Each shard returns its own top n_results, the closest n_results of
+        all of them are the global top n_results.
+        """
+        if query_embeddings is None:
+            query_embeddings = self.embedding_function(query_texts)
+        include = list(include)
+        if "distances" not in include:
+            include.append("distances")
+        shards = self.route(where)
+
+        def search(shard):
+            params = {"query_embeddings": query_embeddings, "n_results": n_results, "include": include}
+            if where:
+                params["where"] = where
+            return shard.query(**params)
+
+        if len(shards) == 1:
+            results = [search(shards[0])]
+        else:
+            results = list(query_pool().map(search, shards))
+
+        merged = {"ids": [], **{field: [] for field in include}}
+        for index in range(len(query_embeddings)):
+            rows = []
+            for result in results:
+                for position, distance in enumerate(result["distances"][index]):
+                    rows.append((distance, result, position))
+            rows.sort(key=lambda row: row[0])
+            rows = rows[:n_results]
+            merged["ids"].append([result["ids"][index][position] for _, result, position in rows])
+            for field in include:
+                merged[field].append([result[field][index][position] for _, result, position in rows])
+        return merged
+
+
+def open_collection(client, name: str, embedding_function=None):
+    """The named collection, wrapped in a ShardedCollection when its metadata says it is sharded"""
+    collection = client.get_collection(name=name, embedding_function=embedding_function)
+    if (collection.metadata or {}).get("shard_by"):
+        return ShardedCollection(client, collection, embedding_function)
+    return collection
+
+
+def create_collection(client, name: str, embedding_function, metadata: Dict, shard_by: Optional[str] = None):
+    """
+    Create a collection, sharded by state or city when shard_by is given.
+
+    Raises:
+        ValueError: shard_by is not one of SHARD_KEYS
+    """
+    if not shard_by:
+        return client.create_collection(name=name, embedding_function=embedding_function, metadata=metadata)
+    if shard_by not in SHARD_KEYS:
+        raise ValueError(f"Cannot shard by {shard_by}, choose one of {', '.join(SHARD_KEYS)}")
+    root = client.create_collection(
+        name=name, embedding_function=embedding_function, metadata={**metadata, "shard_by": shard_by}
+    )
+    return ShardedCollection(client, root, embedding_function)
+
+
+def delete_collection(client, name: str):
+    """Delete a collection and its shards if it has any"""
+    prefix = name + SHARD_SEPARATOR
+    for shard in _collection_names(client):
+        if shard.startswith(prefix):
+            client.delete_collection(shard)
+    client.delete_collection(name)
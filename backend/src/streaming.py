@@ -0,0 +1,156 @@
+# streaming.py
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterator, Optional
+
+from fastapi import Request
+
+try:
+    import orjson
+except ImportError:  # Optional, falls back to the standard library encoder
+    orjson = None
+
+# Compact separators and no ASCII escaping keep lines short for the fallback encoder
+_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+class _CoalesceState:
+    """Token buffer shared between the coalescing pump and its consumer"""
+
+    def __init__(self):
+        self.buffer = []
+        self.size = 0
+        self.first_at = 0.0
+        self.done = False
+        self.error: Optional[BaseException] = None
+
+
+async def _close(iterator: AsyncIterator):
+    aclose = getattr(iterator, "aclose", None)
+    if aclose is not None:
+        await aclose()
+
+
+def encode_line(obj: Any) -> bytes:
+    """Serialize one NDJSON record, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    return (_json_encoder.encode(obj) + "\n").encode("utf-8")
+
+
+async def coalesce_tokens(
+    tokens: AsyncIterator[str],
+    flush_ms: Optional[float] = 20.0,
+    flush_bytes: Optional[int] = 256
+) -> AsyncIterator[str]:
+    """
+    Merge small token deltas into larger chunks.
+
+    Buffered text is flushed once flush_ms has passed since the first buffered
+    token, once it reaches flush_bytes, or when the source ends, whichever comes
+    first. A flush_ms of 0 or None passes every token through unchanged.
+
+    Args:
+        tokens: Source of text deltas
+        flush_ms: Longest time a token may wait in the buffer
+        flush_bytes: Buffer size that forces a flush
+    """
+    if not flush_ms:
+        try:
+            async for token in tokens:
+                yield token
+        finally:
+            await _close(tokens)
+        return
+
+    flush_interval = flush_ms / 1000.0
+    loop = asyncio.get_running_loop()
+    state = _CoalesceState()
+    wakeup = asyncio.Event()
+
+    # The pump only appends to the buffer, the consumer is woken up for the
+    # first token of a chunk, a full buffer and the end of the source
+    async def pump():
+        try:
+            async for token in tokens:
+                if not state.buffer:
+                    state.first_at = loop.time()
+                    wakeup.set()
+                state.buffer.append(token)
+                state.size += len(token)
+                if flush_bytes and state.size >= flush_bytes:
+                    wakeup.set()
+        except Exception as e:
+            state.error = e
+        finally:
+            state.done = True
+            wakeup.set()
+
+    pump_task = loop.create_task(pump())
+    try:
+        while True:
+            if not state.buffer and not state.done:
+                wakeup.clear()
+                await wakeup.wait()
+                continue
+
+            full = flush_bytes and state.size >= flush_bytes
+            if state.buffer and not state.done and not full:
+                remaining = state.first_at + flush_interval - loop.time()
+                if remaining > 0:
+                    wakeup.clear()
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+            if state.buffer:
+                chunk = "".join(state.buffer)
+                state.buffer.clear()
+                state.size = 0
+                yield chunk
+            if state.done and not state.buffer:
+                if state.error is not None:
+                    raise state.error
+                return
+    finally:
+        # Stopping the pump closes the source, cancelling upstream generation
+        if not pump_task.done():
+            pump_task.cancel()
+            try:
+                await pump_task
+            except asyncio.CancelledError:
+                pass
+        await _close(tokens)
+
+
+async def stop_on_disconnect(
+    http_request: Request,
+    body: AsyncIterator,
+    check_interval: float = 0.25
+) -> AsyncIterator:
+    """
+    Stream a response body until the client goes away.
+
+    The connection is checked at most every check_interval seconds between
+    chunks. On disconnect the body is closed, which cancels the upstream LLM
+    stream and any retrieval still in flight.
+
+    Args:
+        http_request: Incoming request whose connection is watched
+        body: Async iterator producing the response chunks
+        check_interval: Minimum seconds between disconnect checks
+    """
+    last_check = time.monotonic()
+    try:
+        async for chunk in body:
+            now = time.monotonic()
+            if now - last_check >= check_interval:
+                last_check = now
+                if await http_request.is_disconnected():
+                    print("Client disconnected, cancelling stream")
+                    break
+            yield chunk
+    finally:
+        await _close(body)
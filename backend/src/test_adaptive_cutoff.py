@@ -0,0 +1,28 @@
+# test_adaptive_cutoff.py
+from src.rag import adaptive_cutoff
+
+
+def test_keeps_candidates_until_the_first_sharp_drop():
+    # 0.8 is within 85% of the leader, 0.5 is the drop
+    assert adaptive_cutoff([0.9, 0.85, 0.8, 0.5, 0.49]) == 3
+    assert adaptive_cutoff([0.9, 0.85, 0.8, 0.5, 0.49], score_threshold=0.5) == 5
+    # Later candidates close to the one before the drop are not kept either
+    assert adaptive_cutoff([0.9, 0.3, 0.29, 0.28]) == 1
+
+
+def test_min_k_and_max_k_bound_the_cut():
+    flat = [0.9] * 20
+    assert adaptive_cutoff(flat, max_k=10) == 10
+    assert adaptive_cutoff(flat, max_k=4) == 4
+    assert adaptive_cutoff([0.9, 0.1, 0.1, 0.1], min_k=3) == 3
+    # min_k never asks for more candidates than there are
+    assert adaptive_cutoff([0.9, 0.1], min_k=5) == 2
+
+
+def test_empty_single_and_non_positive_inputs():
+    assert adaptive_cutoff([]) == 0
+    assert adaptive_cutoff([0.7]) == 1
+    assert adaptive_cutoff([0.7], min_k=3, max_k=10) == 1
+    # Without a positive leader there is no drop to measure, only min_k is kept
+    assert adaptive_cutoff([0.0, 0.0, 0.0], min_k=2) == 2
+    assert adaptive_cutoff([-0.2, -0.3]) == 1
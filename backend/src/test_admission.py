@@ -0,0 +1,123 @@
+# test_admission.py
+import asyncio
+import gc
+import time
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from src.admission import AdmissionController, RouteLimit, hold_while_streaming
+from src.app import request_timeout
+
+
+def _controller(max_concurrency=1, max_queue=1, timeout=30.0):
+    return AdmissionController(limits={"/query": RouteLimit(max_concurrency, max_queue, timeout)})
+
+
+def _request(headers):
+    return Request({"type": "http", "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()]})
+
+
+def test_full_queue_is_rejected_with_429():
+    async def run():
+        admission = _controller(max_concurrency=1, max_queue=1)
+        deadline = admission.deadline_for("/query")
+        ticket = await admission.acquire("/query", deadline)
+        queued = asyncio.ensure_future(admission.acquire("/query", deadline))
+        await asyncio.sleep(0.01)
+        admission._gate("/query").service_time = 4.2
+        with pytest.raises(HTTPException) as rejected:
+            await admission.acquire("/query", deadline)
+        ticket.release()
+        (await queued).release()
+        return rejected.value, admission.stats()["/query"]
+
+    error, stats = asyncio.run(run())
+    assert error.status_code == 429
+    # Two requests ahead of it, one slot, 4.2s each
+    assert error.headers["Retry-After"] == "9"
+    assert stats["rejected_queue_full"] == 1
+    assert stats["admitted"] == 2
+
+
+def test_deadlines_that_cannot_be_met_are_rejected_with_503():
+    async def run():
+        admission = _controller(max_concurrency=1, max_queue=4)
+        ticket = await admission.acquire("/query", admission.deadline_for("/query"))
+        gate = admission._gate("/query")
+
+        # By estimate, without waiting
+        gate.service_time = 10.0
+        start = time.monotonic()
+        with pytest.raises(HTTPException) as estimated:
+            await admission.acquire("/query", time.monotonic() + 1.0)
+        rejected_at_once = time.monotonic() - start < 0.1
+
+        # After waiting in the queue for the whole deadline
+        gate.service_time = 0.01
+        with pytest.raises(HTTPException) as waited:
+            await admission.acquire("/query", time.monotonic() + 0.05)
+        ticket.release()
+        return estimated.value, rejected_at_once, waited.value, admission.stats()["/query"]
+
+    estimated, rejected_at_once, waited, stats = asyncio.run(run())
+    assert estimated.status_code == 503 and rejected_at_once
+    assert estimated.headers["Retry-After"] == "10"
+    assert waited.status_code == 503 and waited.detail == "Request deadline expired while queued"
+    assert waited.headers["Retry-After"] == "1"
+    assert stats["rejected_deadline"] == 2
+    assert stats["waiting"] == 0
+
+
+def test_client_timeout_header_shortens_the_deadline():
+    admission = _controller(timeout=30.0)
+    assert request_timeout(_request({"X-Request-Timeout": "2.5"})) == 2.5
+    assert request_timeout(_request({"X-Request-Timeout": "soon"})) is None
+    assert request_timeout(_request({})) is None
+
+    now = time.monotonic()
+    assert admission.deadline_for("/query", 2.5) - now == pytest.approx(2.5, abs=0.05)
+    # Never longer than the route allows, and the route default without a header
+    assert admission.deadline_for("/query", 600.0) - now == pytest.approx(30.0, abs=0.05)
+    assert admission.deadline_for("/query", None) - now == pytest.approx(30.0, abs=0.05)
+
+
+async def _body():
+    for chunk in ("a", "b", "c"):
+        yield chunk
+
+
+def test_streaming_holds_the_ticket_until_the_body_ends_or_the_client_leaves():
+    async def run():
+        admission = _controller(max_concurrency=1)
+        gate = admission._gate("/query")
+        active = []
+
+        # Completed
+        ticket = await admission.acquire("/query", admission.deadline_for("/query"))
+        chunks = [chunk async for chunk in hold_while_streaming(_body(), ticket)]
+        active.append(gate.active)
+
+        # Disconnected after the first chunk
+        ticket = await admission.acquire("/query", admission.deadline_for("/query"))
+        stream = hold_while_streaming(_body(), ticket)
+        await stream.__anext__()
+        active.append(gate.active)
+        await stream.aclose()
+        active.append(gate.active)
+
+        # Disconnected before streaming started, the body is never iterated
+        ticket = await admission.acquire("/query", admission.deadline_for("/query"))
+        stream = hold_while_streaming(_body(), ticket)
+        del stream
+        gc.collect()
+        active.append(gate.active)
+
+        # The slot is free again
+        await admission.acquire("/query", time.monotonic() + 0.1)
+        return chunks, active
+
+    chunks, active = asyncio.run(run())
+    assert chunks == ["a", "b", "c"]
+    assert active == [0, 1, 0, 0]
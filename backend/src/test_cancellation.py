@@ -0,0 +1,66 @@
+# test_cancellation.py
+import asyncio
+import time
+
+from llama_stack_client import LlamaStackClient
+
+from src.benchmarks.fake_llama_stack import FakeLlamaStackServer
+from src.llm_dispatcher import LLMDispatcher
+
+MESSAGES = [{"role": "user", "content": "What are the parking requirements?"}]
+
+
+async def consume_then_cancel(dispatcher: LLMDispatcher, tokens_to_read: int) -> float:
+    """Read a few tokens, then drop the stream like a disconnected client would"""
+    stream = dispatcher.stream(messages=MESSAGES, model="fake-model")
+    received = 0
+    async for _ in stream:
+        received += 1
+        if received >= tokens_to_read:
+            break
+    await stream.aclose()
+    return time.monotonic()
+
+
+def test_cancelled_stream_stops_generation():
+    """Generation on the server stops shortly after the consumer goes away"""
+    # 1000 tokens at 100 tokens/sec would take ten seconds to finish
+    with FakeLlamaStackServer(ttft=0.01, tokens_per_sec=100, num_tokens=1000) as server:
+        dispatcher = LLMDispatcher(client=LlamaStackClient(base_url=server.url))
+        cancelled_at = asyncio.run(consume_then_cancel(dispatcher, tokens_to_read=5))
+
+        deadline = cancelled_at + 2.0
+        while time.monotonic() < deadline and not server.abort_times:
+            time.sleep(0.02)
+
+        stats = server.stats()
+        assert stats["streams_aborted"] == 1, stats
+        assert stats["streams_completed"] == 0, stats
+        assert server.abort_times[0] - cancelled_at < 2.0
+        assert stats["tokens_sent"] < 1000
+
+        dispatcher_stats = dispatcher.stats()
+        assert dispatcher_stats["cancelled_streams"] == 1
+        assert dispatcher_stats["tokens_saved_estimate"] > 0
+        print(f"✓ Generation stopped {server.abort_times[0] - cancelled_at:.3f}s after cancel, "
+              f"{stats['tokens_sent']} of 1000 tokens sent")
+
+
+def test_completed_stream_is_not_counted_as_cancelled():
+    """A stream read to the end leaves the cancellation counters untouched"""
+    with FakeLlamaStackServer(ttft=0.01, tokens_per_sec=1000, num_tokens=20) as server:
+        dispatcher = LLMDispatcher(client=LlamaStackClient(base_url=server.url))
+
+        async def read_all():
+            return [token async for token in dispatcher.stream(messages=MESSAGES, model="fake-model")]
+
+        tokens = asyncio.run(read_all())
+        assert len(tokens) == 20
+        assert server.stats()["streams_completed"] == 1
+        assert dispatcher.stats()["cancelled_streams"] == 0
+        print("✓ Completed stream not counted as cancelled")
+
+
+if __name__ == "__main__":
+    test_cancelled_stream_stops_generation()
+    test_completed_stream_is_not_counted_as_cancelled()
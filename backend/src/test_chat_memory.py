@@ -0,0 +1,75 @@
+# test_chat_memory.py
+import asyncio
+
+from src.chat_memory import ChatMemory, ChatSessionStore
+from src.llm_dispatcher import Priority
+from src.utils import estimate_tokens
+
+
+class SummaryDispatcher:
+    """Dispatcher stand-in answering summary requests with the tail of the prompt"""
+
+    def __init__(self):
+        self.priorities = []
+
+    async def complete(self, messages, model, priority, deadline=None):
+        self.priorities.append(priority)
+        await asyncio.sleep(0.01)
+        return "Summary: " + messages[-1]["content"][-300:]
+
+
+def test_prompt_size_stays_bounded_over_a_long_conversation(tmp_path):
+    async def run():
+        dispatcher = SummaryDispatcher()
+        memory = ChatMemory(
+            dispatcher, "model", ChatSessionStore(str(tmp_path / "chat.sqlite")),
+            history_tokens=300, summary_tokens=100, keep_turns=4
+        )
+        session_id = await memory.open(None)
+        sizes = []
+        for turn in range(30):
+            messages = await memory.build_messages(session_id, "system", f"question {turn} " + "x" * 200)
+            sizes.append(sum(estimate_tokens(m["content"]) for m in messages))
+            await memory.record(session_id, messages[-1]["content"], f"answer {turn} " + "y" * 400)
+            await asyncio.gather(*memory._tasks)
+        last = await memory.build_messages(session_id, "system", "next")
+        session = memory.store.load(session_id)
+        return dispatcher, sizes, last, session
+
+    dispatcher, sizes, last, session = asyncio.run(run())
+    # system + summary budget + history budget + the new message
+    assert max(sizes) <= 2 + 110 + 300 + 60
+    assert max(sizes[10:]) - min(sizes[10:]) < 50
+    assert last[1]["content"].startswith("Summary of the conversation so far:")
+    assert "answer 29" in last[-2]["content"]
+    assert len(session["turns"]) <= 4
+    assert set(dispatcher.priorities) == {Priority.BACKGROUND}
+
+
+def test_sessions_expire_and_are_evicted(tmp_path):
+    store = ChatSessionStore(str(tmp_path / "chat.sqlite"))
+    first = store.open(None, ttl_seconds=60)
+    assert store.open(first, ttl_seconds=60) == first
+    # Idle for longer than the TTL starts a new conversation
+    assert store.open(first, ttl_seconds=-1) != first
+
+    sessions = [store.open(None, ttl_seconds=60) for _ in range(5)]
+    store.append(sessions[0], [{"role": "user", "content": "hello"}])
+    assert store.evict(ttl_seconds=60, max_sessions=3) == 4
+    assert store.load(sessions[0]) == {"summary": "", "turns": []}
+    assert store.open(sessions[-1], ttl_seconds=60) == sessions[-1]
+
+
+def test_turns_of_an_evicted_session_are_not_stored(tmp_path):
+    store = ChatSessionStore(str(tmp_path / "chat.sqlite"))
+    session = store.open(None, ttl_seconds=60)
+    # Evicted between open and record, as under a burst of new sessions
+    assert store.evict(ttl_seconds=60, max_sessions=0) == 1
+    assert store.append(session, [{"role": "user", "content": "hello"}]) is False
+
+    with store._connect() as conn:
+        # An orphan turn written before append checked the session
+        conn.execute("INSERT INTO turns VALUES ('gone', 1, 'user', 'hello', 2)")
+    store.evict(ttl_seconds=60, max_sessions=10)
+    with store._connect() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM turns").fetchone()[0] == 0
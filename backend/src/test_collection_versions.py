@@ -0,0 +1,94 @@
+# test_collection_versions.py
+import pytest
+
+from src.collection_versions import (
+    AliasRegistry, begin_version, collect_garbage, discard_version, finish_version, version_name
+)
+from src.test_sharding import MemoryClient
+
+
+class BuiltVersion:
+    """OrdinanceDBWithTogether stand-in for a freshly built version"""
+
+    def __init__(self, client, name, documents):
+        self.name = name
+        self.collection = client.create_collection(name)
+        self.collection.upsert(
+            ids=[f"d{i}" for i in range(documents)],
+            embeddings=[[float(i)] for i in range(documents)],
+            metadatas=[{"city": "Fresno"}] * documents
+        )
+
+    def search_ordinances(self, query, max_results=5):
+        return self.collection.get(limit=max_results)["ids"]
+
+
+def _build(registry, alias, documents, written=None):
+    version = begin_version(registry, alias)
+    db = BuiltVersion(registry.client, version_name(alias, version), documents)
+    return finish_version(
+        db, registry, alias, version, documents if written is None else written,
+        smoke_query="building permit"
+    )
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setenv("DEDUP_DB", str(tmp_path / "dedup.sqlite"))
+    return AliasRegistry(MemoryClient())
+
+
+def test_publish_moves_the_alias_and_retires_the_previous_version(registry):
+    assert _build(registry, "ordinances", 3) is None
+    assert registry.resolve("ordinances") == "ordinances_v1"
+
+    assert _build(registry, "ordinances", 4) == "ordinances_v1"
+    assert registry.resolve("ordinances") == "ordinances_v2"
+    statuses = {r["collection"]: r["status"] for r in registry.versions("ordinances")}
+    assert statuses == {"ordinances_v1": "retired", "ordinances_v2": "live"}
+    # Readers may still be on v1 during the grace period
+    assert "ordinances_v1" in registry.client.collections
+    assert registry.aliases() == ["ordinances"]
+
+
+def test_failed_validation_keeps_the_live_version(registry):
+    _build(registry, "ordinances", 3)
+    with pytest.raises(RuntimeError, match="the build wrote 5"):
+        _build(registry, "ordinances", 2, written=5)
+
+    assert registry.resolve("ordinances") == "ordinances_v1"
+    assert "ordinances_v2" not in registry.client.collections
+    statuses = {r["collection"]: r["status"] for r in registry.versions("ordinances")}
+    assert statuses == {"ordinances_v1": "live", "ordinances_v2": "deleted"}
+
+    # Empty versions never go live either
+    with pytest.raises(RuntimeError, match="at least 1 required"):
+        _build(registry, "ordinances", 0)
+    assert registry.resolve("ordinances") == "ordinances_v1"
+
+
+def test_retired_versions_are_collected_after_the_grace_period(registry):
+    _build(registry, "ordinances", 3)
+    _build(registry, "ordinances", 3)
+
+    assert collect_garbage(registry, "ordinances", grace_seconds=3600) == []
+    assert collect_garbage(registry, "ordinances", grace_seconds=0) == ["ordinances_v1"]
+    assert sorted(registry.client.collections) == ["collection_aliases", "ordinances_v2"]
+    # The live version is never collected
+    assert collect_garbage(registry, "ordinances", grace_seconds=0) == []
+    assert registry.resolve("ordinances") == "ordinances_v2"
+
+
+def test_retried_builds_reuse_their_version_and_failed_ones_are_discarded(registry):
+    _build(registry, "ordinances", 3)
+    assert begin_version(registry, "ordinances", build_id="run-1") == 2
+    # A retry of the same run, after the first attempt reserved the version
+    assert begin_version(registry, "ordinances", build_id="run-1") == 2
+    assert begin_version(registry, "ordinances", build_id="run-2") == 3
+
+    BuiltVersion(registry.client, "ordinances_v2", 2)
+    discard_version(registry, "ordinances", 2, ["export.xlsx: parse error"])
+    assert "ordinances_v2" not in registry.client.collections
+    statuses = {r["collection"]: r["status"] for r in registry.versions("ordinances")}
+    assert statuses["ordinances_v2"] == "deleted"
+    assert registry.resolve("ordinances") == "ordinances_v1"
@@ -0,0 +1,153 @@
+# test_crawler.py
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.crawler import Crawler
+
+PDF_BYTES = b"%PDF-1.4\n% minimal body, parsed elsewhere\n%%EOF\n"
+
+
+class DocumentCenter:
+    """Local HTTP server with an ETag-aware document, a PDF and a slow page"""
+
+    def __init__(self):
+        self.requests = []
+        self.not_modified = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler_class(self):
+        center = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, body: bytes = b"", content_type: str = "text/html", headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                with center.lock:
+                    center.requests.append(self.path)
+                    center.in_flight += 1
+                    center.max_in_flight = max(center.max_in_flight, center.in_flight)
+                try:
+                    if self.path == "/page":
+                        if self.headers.get("If-None-Match") == '"v1"':
+                            with center.lock:
+                                center.not_modified += 1
+                            self._send(304, headers={"ETag": '"v1"'})
+                        else:
+                            self._send(200, b"<html><body>Smoke alarms</body></html>", headers={"ETag": '"v1"'})
+                    elif self.path == "/doc.pdf":
+                        self._send(200, PDF_BYTES, content_type="application/pdf")
+                    elif self.path.startswith("/slow"):
+                        time.sleep(0.1)
+                        self._send(200, b"slow")
+                    else:
+                        self._send(404, b"missing")
+                finally:
+                    with center.lock:
+                        center.in_flight -= 1
+
+        return Handler
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def document_center():
+    with DocumentCenter() as center:
+        yield center
+
+
+def test_conditional_get_is_served_from_cache(document_center, tmp_path):
+    async def run():
+        async with Crawler(cache_dir=str(tmp_path), per_host_rate=0) as crawler:
+            first = await crawler.fetch(f"{document_center.url}/page")
+        # A new crawler, as in a later run, revalidates against the disk cache
+        async with Crawler(cache_dir=str(tmp_path), per_host_rate=0) as crawler:
+            second = await crawler.fetch(f"{document_center.url}/page")
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first.ok and not first.from_cache
+    assert second.ok and second.from_cache
+    assert second.content == first.content
+    assert document_center.not_modified == 1
+
+
+def test_pdf_bytes_stay_in_memory(document_center, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    async def run():
+        async with Crawler(per_host_rate=0) as crawler:
+            return await crawler.fetch(f"{document_center.url}/doc.pdf")
+
+    result = asyncio.run(run())
+    assert result.ok and result.is_pdf
+    assert result.content == PDF_BYTES
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_per_host_concurrency_and_errors(document_center):
+    async def run():
+        async with Crawler(per_host_concurrency=2, per_host_rate=0, max_retries=0) as crawler:
+            urls = [f"{document_center.url}/slow/{i}" for i in range(6)] + [f"{document_center.url}/missing"]
+            return await crawler.fetch_all(urls)
+
+    results = asyncio.run(run())
+    assert all(r.ok for r in results[:6])
+    assert results[6].status == 404 and not results[6].ok
+    assert document_center.max_in_flight <= 2
+
+
+def test_per_host_rate_limit(document_center):
+    async def run():
+        async with Crawler(per_host_concurrency=8, per_host_rate=20.0) as crawler:
+            start = time.monotonic()
+            await crawler.fetch_all([f"{document_center.url}/page" for _ in range(5)])
+            return time.monotonic() - start
+
+    # Five requests at 20 per second need at least four intervals of 50ms
+    assert asyncio.run(run()) >= 0.19
+
+
+def test_fetches_past_the_deadline_are_dropped_and_the_rest_kept(document_center):
+    async def run():
+        async with Crawler(per_host_concurrency=1, per_host_rate=0, max_retries=0) as crawler:
+            urls = [f"{document_center.url}/page"] + [f"{document_center.url}/slow/{i}" for i in range(6)]
+            start = time.monotonic()
+            results = await crawler.fetch_all(urls, deadline=0.25)
+            return results, time.monotonic() - start
+
+    results, elapsed = asyncio.run(run())
+    # One request at a time, six slow pages would take 0.6s
+    assert elapsed < 0.4
+    assert results[0].ok and results[1].ok
+    assert not results[-1].ok and "deadline" in results[-1].error
+    assert [r.url for r in results][1:] == [f"{document_center.url}/slow/{i}" for i in range(6)]
@@ -0,0 +1,130 @@
+# test_dedup.py
+import random
+
+import pytest
+
+from src import db, ordinance_db
+from src.dedup import DedupIndex, minhash, similarity
+from src.ordinance_db import OrdinanceDBWithTogether
+from src.test_sharding import MemoryClient
+
+WORDS = "permit building fire code inspection structure owner approval chapter section shall must".split()
+
+
+def _text(seed: int, length: int = 300) -> str:
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) + str(rng.randint(0, 50)) for _ in range(length))
+
+
+def test_signatures_estimate_similarity():
+    text = _text(1)
+    edited = text.replace(text.split()[100], "amended", 1)
+    assert similarity(minhash(text), minhash(text)) == 1.0
+    assert similarity(minhash(text), minhash(edited)) > 0.9
+    assert similarity(minhash(text), minhash(_text(2))) < 0.2
+
+
+def test_copies_in_other_cities_reference_the_stored_section(tmp_path):
+    index = DedupIndex("ordinances_v1", path=str(tmp_path / "dedup.sqlite"))
+    model_code = _text(1)
+    fresno = {"state": "CA", "city": "Fresno", "section": "8-1.01"}
+    austin = {"state": "TX", "city": "Austin", "section": "25-12-1"}
+
+    assert index.assign("fresno-1", model_code, fresno, 400, 2000) == (None, None)
+    # Not referenceable until the writer has stored it
+    assert index.assign("austin-1", model_code + " local", austin, 400, 2000) == (None, None)
+
+    index.mark_stored(["fresno-1"])
+    assert index.assign("austin-2", model_code + " local", austin, 400, 2000) == ("fresno-1", None)
+    assert index.assign("austin-3", _text(3), austin, 400, 2000) == (None, None)
+    # Re-ingesting a reference keeps it, and reports the canonical it had
+    assert index.assign("austin-2", model_code, austin, 400, 2000) == ("fresno-1", "fresno-1")
+
+    metadata = index.canonical_metadata("fresno-1")
+    assert metadata["city"] == "Fresno"
+    assert metadata["city__Fresno"] and metadata["city__Austin"] and metadata["state__TX"]
+    # Only the flags go to the collection, the copies stay in the index with their own text
+    assert set(metadata) == set(fresno) | {"state__CA", "state__TX", "city__Fresno", "city__Austin"}
+    assert index.references(["fresno-1", "austin-3"]) == {
+        "fresno-1": [{"id": "austin-2", "metadata": austin, "content": model_code}]
+    }
+
+    report = index.report(embedding_dim=768)
+    assert report["sections"] == 4
+    assert report["references"] == 1
+    assert report["embedding_tokens_saved"] == 400
+    assert report["index_bytes_saved"] == 2000 + 768 * 4
+
+    index.copy_to("ordinances_v2")
+    copied = DedupIndex("ordinances_v2", path=index.path)
+    assert copied.report()["references"] == 1
+    assert copied.references(["fresno-1"]) == index.references(["fresno-1"])
+
+
+class WordEmbedding:
+    """TogetherEmbeddingFunction stand-in counting the vocabulary words of each text"""
+
+    def __init__(self, api_key, model_name, batch_size=32, raise_on_error=False):
+        self.model_name = model_name
+
+    def __call__(self, documents):
+        return [[float(document.count(word)) for word in WORDS] for document in documents]
+
+
+def _ordinance(state, city, section, content):
+    return {"metadata": {"state": state, "city": city, "title": "Building", "section": section}, "content": content}
+
+
+@pytest.fixture
+def deduplicated(tmp_path, monkeypatch):
+    monkeypatch.setenv("DEDUP_DB", str(tmp_path / "dedup.sqlite"))
+    monkeypatch.setattr(ordinance_db, "TogetherEmbeddingFunction", WordEmbedding)
+    client = MemoryClient()
+    monkeypatch.setattr(db, "create_chroma_client", lambda: client)
+
+    def build(shard_by=None):
+        ordinances = OrdinanceDBWithTogether(api_key="key", collection_name="ordinances", shard_by=shard_by, dedup=True)
+        model_code = _text(1)
+        ordinances.upsert_ordinances([
+            _ordinance("CA", "Fresno", "8-1.01", model_code),
+            _ordinance("CA", "Oakland", "15.04", _text(2)),
+            _ordinance("TX", "Houston", "10-1", _text(4)),
+        ])
+        # Austin adopted the model code with a local amendment
+        ordinances.upsert_ordinances([_ordinance("TX", "Austin", "25-12-1", model_code + " austin amendment")])
+        return client, ordinances
+
+    return build
+
+
+@pytest.mark.parametrize("shard_by", [None, "state"])
+def test_searches_return_the_copy_of_the_filtered_city(deduplicated, shard_by):
+    client, ordinances = deduplicated(shard_by)
+    assert ordinances.last_duplicates == 1
+    assert ordinances.collection.count() == 3
+    stored = ordinances.collection.get(include=["metadatas"])["metadatas"]
+    assert {"city__Fresno", "city__Austin", "state__TX"} <= set(max(stored, key=len))
+    assert not any(isinstance(v, str) and v.startswith("[") for m in stored for v in m.values())
+
+    query = _text(1)
+    for search in ({"city": "Austin"}, {"filter_conditions": {"city": {"$eq": "Austin"}}}):
+        results = ordinances.search_ordinances(query, max_results=5, **search)
+        assert len(results) == 1
+        assert results[0]["metadata"]["section"] == "25-12-1"
+        assert results[0]["document"].endswith("austin amendment")
+        assert "Location: TX, Austin" in results[0]["document"]
+        assert results[0]["copies"] == 2
+
+    fresno = ordinances.search_ordinances(query, max_results=5, city="Fresno")
+    assert fresno[0]["metadata"]["city"] == "Fresno"
+    assert not fresno[0]["document"].endswith("austin amendment")
+
+    results = ordinances.search_ordinances(query, max_results=5, filter_conditions={"city": {"$in": ["Austin", "Oakland"]}})
+    assert sorted(r["metadata"]["city"] for r in results) == ["Austin", "Oakland"]
+
+    if shard_by:
+        # The Austin copy is stored in the CA shard, so state filters query every shard
+        shards = [c for name, c in client.collections.items() if "__" in name]
+        before = sum(c.queries for c in shards)
+        assert ordinances.search_ordinances(query, state="TX")[0]["metadata"]["city"] == "Austin"
+        assert sum(c.queries for c in shards) - before == len(shards) == 2
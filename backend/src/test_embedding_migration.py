@@ -0,0 +1,161 @@
+# test_embedding_migration.py
+import asyncio
+
+import pytest
+
+from src import embedding_migration
+from src.collection_versions import AliasRegistry, begin_version, publish_version
+from src.embedding_migration import abort, backfill, cut_over, migration_record_id, start_migration
+from src.sharding import create_collection, open_collection
+from src.test_sharding import MemoryClient
+
+OLD_EMBEDDING = [0.0, 0.0]
+
+
+class Interrupted(BaseException):
+    """Stops a backfill the way a killed process would, past its retries"""
+
+
+class FakeEmbedding:
+    """TogetherEmbeddingFunction stand-in recording the documents it embeds"""
+
+    embedded = []
+    interrupt_at = None
+
+    def __init__(self, api_key, model_name, raise_on_error=False):
+        self.model_name = model_name
+
+    def __call__(self, documents):
+        if FakeEmbedding.interrupt_at is not None and len(FakeEmbedding.embedded) >= FakeEmbedding.interrupt_at:
+            raise Interrupted()
+        FakeEmbedding.embedded.extend(documents)
+        return [[float(len(d)), 1.0] for d in documents]
+
+
+def _sections(ids):
+    return {
+        id_: ({"state": "CA" if i % 2 else "TX", "city": "Fresno" if i % 2 else "Austin"}, f"section {id_} text")
+        for i, id_ in enumerate(ids)
+    }
+
+
+def _write(collection, sections, embedding):
+    ids = sorted(sections)
+    collection.upsert(
+        ids=ids,
+        metadatas=[sections[i][0] for i in ids],
+        documents=[sections[i][1] for i in ids],
+        embeddings=[embedding(sections[i][1]) for i in ids]
+    )
+
+
+def _contents(collection):
+    page = collection.get(include=["documents", "metadatas"])
+    return dict(zip(page["ids"], zip(page["documents"], page["metadatas"])))
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setenv("DEDUP_DB", str(tmp_path / "dedup.sqlite"))
+    monkeypatch.setenv("MIGRATION_REQUESTS_PER_SECOND", "1000")
+    monkeypatch.setenv("MIGRATION_TOKENS_PER_MINUTE", "1e9")
+    monkeypatch.setattr(embedding_migration, "TogetherEmbeddingFunction", FakeEmbedding)
+    FakeEmbedding.embedded = []
+    FakeEmbedding.interrupt_at = None
+    return AliasRegistry(MemoryClient())
+
+
+def _live(registry, shard_by=None):
+    version = begin_version(registry, "ords")
+    source = create_collection(registry.client, f"ords_v{version}", None, {"hnsw:space": "cosine"}, shard_by=shard_by)
+    _write(source, _sections([f"s{i:02d}" for i in range(10)]), lambda _: OLD_EMBEDDING)
+    publish_version(registry, "ords", version)
+    return source
+
+
+def _backfill(registry):
+    return asyncio.run(backfill(registry, "ords", "key", tokens_per_minute=1e9, requests_per_second=1000, page_size=4))
+
+
+@pytest.mark.parametrize("shard_by", [None, "state"])
+def test_interrupted_backfill_resumes_reconciles_and_cuts_over(registry, shard_by):
+    source = _live(registry, shard_by)
+    record = start_migration(registry, "ords", "new-model", "key")
+    assert (record["source"], record["target"]) == ("ords_v1", "ords_v2")
+    assert open_collection(registry.client, "ords_v2").metadata["embedding_model"] == "new-model"
+
+    # Stopped after the first page, its progress is saved
+    FakeEmbedding.interrupt_at = 4
+    with pytest.raises(Interrupted):
+        _backfill(registry)
+    assert registry.get_record(migration_record_id("ords"))["backfilled"] == 4
+    target = open_collection(registry.client, "ords_v2")
+    backfilled = set(target.get()["ids"])
+    assert len(backfilled) == 4
+
+    # Writes while the backfill is stopped, all sorting before its offset in the same shard
+    current = _contents(source)
+    relabeled, changed = sorted(backfilled)[:2]
+    first, metadata = relabeled, current[relabeled][1]
+    dual = {first + "b": (metadata, "mirrored section")}
+    _write(source, dual, lambda _: OLD_EMBEDDING)
+    _write(target, dual, lambda d: [float(len(d)), 1.0])  # By a writer that saw the migration
+    _write(source, {first + "a": (metadata, "written before the writer noticed")}, lambda _: OLD_EMBEDDING)
+    _write(source, {changed: (current[changed][1], "amended text")}, lambda _: OLD_EMBEDDING)
+    source.update(ids=[relabeled], metadatas=[dict(current[relabeled][1], city__Oakland=True)])
+
+    FakeEmbedding.interrupt_at = None
+    FakeEmbedding.embedded = []
+    record = _backfill(registry)
+    assert record["status"] == "ready"
+    target = open_collection(registry.client, "ords_v2")
+    assert _contents(target) == _contents(source)
+    assert "written before the writer noticed" in FakeEmbedding.embedded
+    assert "amended text" in FakeEmbedding.embedded
+    # Metadata-only changes and mirrored writes are not embedded again
+    assert current[relabeled][0] not in FakeEmbedding.embedded
+    assert "mirrored section" not in FakeEmbedding.embedded
+
+    assert cut_over(registry, "ords", "key", grace_seconds=0) == "ords_v1"
+    assert registry.resolve("ords") == "ords_v2"
+    assert registry.get_record(migration_record_id("ords")) is None
+    assert not any(name.startswith("ords_v1") for name in registry.client.collections)
+
+
+def test_cut_over_refuses_an_incomplete_target(registry, monkeypatch):
+    _live(registry)
+    start_migration(registry, "ords", "new-model", "key")
+    with pytest.raises(RuntimeError, match="not complete"):
+        cut_over(registry, "ords", "key")
+
+    _backfill(registry)
+    target = open_collection(registry.client, "ords_v2")
+    target.delete(ids=["s03"])
+
+    async def missed(*args, **kwargs):
+        return 0
+
+    # A reconcile that misses sections still must not publish a short version
+    reconcile = embedding_migration.reconcile
+    monkeypatch.setattr(embedding_migration, "reconcile", missed)
+    with pytest.raises(RuntimeError, match="ords_v2 has 9 documents, ords_v1 has 10"):
+        cut_over(registry, "ords", "key")
+    assert registry.resolve("ords") == "ords_v1"
+
+    monkeypatch.setattr(embedding_migration, "reconcile", reconcile)
+    assert cut_over(registry, "ords", "key") == "ords_v1"
+    assert open_collection(registry.client, "ords_v2").count() == 10
+
+
+def test_abort_drops_the_target_and_keeps_the_alias(registry):
+    _live(registry)
+    start_migration(registry, "ords", "new-model", "key")
+    with pytest.raises(ValueError, match="already running"):
+        start_migration(registry, "ords", "other-model", "key")
+
+    abort(registry, "ords")
+    assert registry.resolve("ords") == "ords_v1"
+    assert "ords_v2" not in registry.client.collections
+    assert registry.get_record(migration_record_id("ords")) is None
+    # A new migration can start afterwards
+    assert start_migration(registry, "ords", "other-model", "key")["target"] == "ords_v3"
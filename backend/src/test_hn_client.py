@@ -0,0 +1,109 @@
+# test_hn_client.py
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from src.hn_client import HnClient
+
+
+class AlgoliaStandIn:
+    """Local search_by_date endpoint serving a settable list of hits"""
+
+    def __init__(self):
+        self.hits = []
+        self.requests = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/api/v1"
+
+    def _handler_class(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                params = parse_qs(url.query)
+                stand_in.requests.append(params)
+                time.sleep(0.05)
+                count = int(params["hitsPerPage"][0])
+                body = json.dumps({"hits": stand_in.hits[:count], "query": params["query"][0]}).encode()
+                self.send_response(200 if url.path == "/api/v1/search_by_date" else 404)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+@pytest.fixture
+def algolia():
+    stand_in = AlgoliaStandIn()
+    thread = threading.Thread(target=stand_in.server.serve_forever, daemon=True)
+    thread.start()
+    yield stand_in
+    stand_in.server.shutdown()
+    stand_in.server.server_close()
+
+
+def hit(object_id: str, created: int) -> dict:
+    return {"objectID": object_id, "created_at_i": created, "url": f"https://example.org/{object_id}"}
+
+
+def test_concurrent_and_repeated_searches_share_one_request(algolia, tmp_path):
+    algolia.hits = [hit("1", 100)]
+
+    async def run():
+        client = HnClient(base_url=algolia.url, cache_ttl=60, state_path=str(tmp_path / "hn.json"))
+        try:
+            first = await asyncio.gather(*[client.search("ai", 5) for _ in range(5)])
+            again = await client.search("ai", 5)
+            other = await client.search("ai", 10)
+        finally:
+            await client.aclose()
+        return first, again, other
+
+    first, again, other = asyncio.run(run())
+    assert all(r["hits"][0]["objectID"] == "1" for r in first + [again, other])
+    # One request for (ai, 5) and one for (ai, 10)
+    assert len(algolia.requests) == 2
+
+
+def test_later_runs_only_see_stories_not_marked_seen(algolia, tmp_path):
+    state_path = str(tmp_path / "hn.json")
+
+    async def run(hits, succeed=True):
+        algolia.hits = hits
+        # A fresh client per run, as after a worker restart, so only the file carries state
+        client = HnClient(base_url=algolia.url, cache_ttl=0, state_path=state_path)
+        try:
+            data = await client.search_new("ai", 10)
+            if succeed:
+                await client.mark_seen("ai", data["hits"])
+            return data
+        finally:
+            await client.aclose()
+
+    # A run failing after the search leaves its stories for the next one
+    failed = asyncio.run(run([hit("2", 200), hit("1", 100)], succeed=False))
+    first = asyncio.run(run([hit("2", 200), hit("1", 100)]))
+    second = asyncio.run(run([hit("3", 300), hit("2", 200), hit("1", 100)]))
+    assert [h["objectID"] for h in failed["hits"]] == ["2", "1"]
+    assert [h["objectID"] for h in first["hits"]] == ["2", "1"]
+    assert [h["objectID"] for h in second["hits"]] == ["3"]
+    assert second["skippedHits"] == 2
+
+    with open(state_path) as f:
+        assert json.load(f)["ai"]["cursor"] == 300
@@ -0,0 +1,132 @@
+# test_jobs.py
+import asyncio
+import threading
+import time
+
+from src.jobs import JobManager, JobStore
+
+
+class SlowWorkflowClient:
+    """Restack stand-in whose workflows finish after a short delay"""
+
+    def __init__(self, delay: float = 0.2, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+
+    async def schedule_workflow(self, workflow_name: str, workflow_id: str, **kwargs) -> str:
+        return f"run-{workflow_id}"
+
+    async def get_workflow_result(self, workflow_id: str, run_id: str):
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("workflow failed")
+        return {"parsed": 3}
+
+
+def test_submit_returns_before_the_workflow_finishes(tmp_path):
+    async def run():
+        jobs = JobManager(SlowWorkflowClient(), store=JobStore(str(tmp_path / "jobs.sqlite")), poll_interval=0.02)
+        job = await jobs.submit("municode_parser")
+        assert job["status"] == "queued"
+
+        events = [event async for event in jobs.events(job["id"])]
+        finished = await jobs.get(job["id"])
+        return events, finished
+
+    events, finished = asyncio.run(run())
+    assert finished["status"] == "succeeded"
+    assert finished["result"] == {"parsed": 3}
+    assert finished["run_id"].startswith("run-")
+    assert '"status": "succeeded"' in events[-1]
+
+
+def test_failed_workflow_is_recorded(tmp_path):
+    async def run():
+        jobs = JobManager(SlowWorkflowClient(delay=0.0, fail=True), store=JobStore(str(tmp_path / "jobs.sqlite")))
+        job = await jobs.submit("campbellca_parser")
+        await asyncio.sleep(0.1)
+        return await jobs.get(job["id"])
+
+    job = asyncio.run(run())
+    assert job["status"] == "failed"
+    assert job["error"] == "workflow failed"
+
+
+def test_heartbeats_keep_a_long_job_alive(tmp_path):
+    async def run():
+        jobs = JobManager(
+            SlowWorkflowClient(delay=0.3), store=JobStore(str(tmp_path / "jobs.sqlite")), lease_seconds=0.09
+        )
+        job = await jobs.submit("municode_parser")
+        await asyncio.sleep(0.2)
+        running = await jobs.get(job["id"])
+        await asyncio.sleep(0.2)
+        return running, await jobs.get(job["id"])
+
+    running, finished = asyncio.run(run())
+    assert running["status"] == "running"
+    assert running["progress"]["phase"] == "running"
+    assert running["progress"]["phase_seconds"] > 0
+    assert finished["status"] == "succeeded"
+
+
+def test_jobs_of_a_dead_worker_fail_when_their_lease_expires(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite"))
+    # Left running by a worker killed without its shutdown
+    store.insert({
+        "id": "orphan", "workflow_name": "municode_parser", "workflow_id": "wf-orphan",
+        "status": "queued", "progress": {"phase": "queued"}, "created_at": 0.0, "lease_until": 1.0
+    })
+    store.update("orphan", status="running", progress={"phase": "running"})
+
+    async def run():
+        jobs = JobManager(SlowWorkflowClient(), store=store, poll_interval=0.01)
+        events = [event async for event in jobs.events("orphan", heartbeat=0.01)]
+        return events, await jobs.get("orphan")
+
+    events, job = asyncio.run(run())
+    assert job["status"] == "failed"
+    assert job["progress"] == {"phase": "abandoned"}
+    assert len(events) == 1 and '"status": "failed"' in events[0]
+
+
+class SlowRenewalStore(JobStore):
+    """JobStore whose lease renewals take a while to be written"""
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.renewing = threading.Event()
+
+    def update(self, job_id: str, **fields):
+        if "heartbeat_at" in fields.get("progress", {}) and "status" not in fields:
+            self.renewing.set()
+            time.sleep(0.3)
+        super().update(job_id, **fields)
+
+
+class RenewalWaitingClient(SlowWorkflowClient):
+    """Restack stand-in whose workflows finish while a lease renewal is being written"""
+
+    def __init__(self, store: SlowRenewalStore):
+        super().__init__()
+        self.store = store
+
+    async def get_workflow_result(self, workflow_id: str, run_id: str):
+        while not self.store.renewing.is_set():
+            await asyncio.sleep(0.01)
+        return {"parsed": 3}
+
+
+def test_lease_renewal_in_flight_does_not_overwrite_the_final_state(tmp_path):
+    store = SlowRenewalStore(str(tmp_path / "jobs.sqlite"))
+
+    async def run():
+        jobs = JobManager(RenewalWaitingClient(store), store=store, lease_seconds=0.15)
+        job = await jobs.submit("municode_parser")
+        await asyncio.sleep(0.6)
+        return await jobs.get(job["id"])
+
+    job = asyncio.run(run())
+    assert job["status"] == "succeeded"
+    assert job["progress"] == {"phase": "finished"}
+    assert job["updated_at"] >= job["finished_at"]
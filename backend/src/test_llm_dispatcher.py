@@ -0,0 +1,112 @@
+# test_llm_dispatcher.py
+import asyncio
+import threading
+from types import SimpleNamespace
+
+from src.llm_dispatcher import LLMDispatcher, Priority
+
+
+class StatusError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class BatchingClient:
+    """LlamaStack stand-in whose batch endpoint fails with the given statuses first"""
+
+    def __init__(self, batch_failures):
+        self.batch_failures = list(batch_failures)
+        self.batch_calls = 0
+        self.single_calls = 0
+        self.inference = SimpleNamespace(chat_completion=self._single)
+        self.batch_inference = SimpleNamespace(chat_completion=self._batch)
+
+    def _single(self, messages, model, **kwargs):
+        self.single_calls += 1
+        return SimpleNamespace(completion_message=SimpleNamespace(content="single " + messages[0]["content"]))
+
+    def _batch(self, messages_batch, model, **kwargs):
+        self.batch_calls += 1
+        if self.batch_failures:
+            raise StatusError(self.batch_failures.pop(0))
+        return SimpleNamespace(completion_message_batch=[
+            SimpleNamespace(content="batched " + messages[0]["content"]) for messages in messages_batch
+        ])
+
+
+class GatedClient:
+    """LlamaStack stand-in whose calls block until released, recording their order"""
+
+    def __init__(self):
+        self.started = []
+        self.gate = None
+        self.inference = SimpleNamespace(chat_completion=self._single)
+
+    def _single(self, messages, model, **kwargs):
+        self.started.append(messages[0]["content"])
+        self.gate.wait()
+        return SimpleNamespace(completion_message=SimpleNamespace(content=messages[0]["content"]))
+
+
+async def _burst(dispatcher: LLMDispatcher, size: int = 3):
+    return await asyncio.gather(*(
+        dispatcher.complete(messages=[{"role": "user", "content": str(i)}], model="m") for i in range(size)
+    ))
+
+
+def test_transient_batch_failure_pauses_batching():
+    async def run():
+        client = BatchingClient([503])
+        dispatcher = LLMDispatcher(client=client, batch_window_ms=50, batch_retry_seconds=0.2)
+        first = await _burst(dispatcher)
+        paused = dispatcher.stats()["models"]["m"]["batching"]
+        await asyncio.sleep(0.25)
+        second = await _burst(dispatcher)
+        return client, first, paused, second
+
+    client, first, paused, second = asyncio.run(run())
+    # The failed batch is answered one request at a time
+    assert first == ["single 0", "single 1", "single 2"]
+    assert paused is False
+    assert second == ["batched 0", "batched 1", "batched 2"]
+    assert client.batch_calls == 2
+
+
+def test_backend_without_batch_inference_disables_batching():
+    async def run():
+        client = BatchingClient([404])
+        dispatcher = LLMDispatcher(client=client, batch_window_ms=50, batch_retry_seconds=0.0)
+        first = await _burst(dispatcher)
+        second = await _burst(dispatcher)
+        return client, dispatcher, first, second
+
+    client, dispatcher, first, second = asyncio.run(run())
+    assert first == second == ["single 0", "single 1", "single 2"]
+    assert client.batch_calls == 1
+    assert dispatcher.stats()["models"]["m"]["batching"] is False
+
+
+def test_interactive_requests_overtake_background_ones_while_slots_are_busy():
+    async def run():
+        client = GatedClient()
+        client.gate = threading.Event()
+        dispatcher = LLMDispatcher(client=client, max_concurrency=1, enable_batching=False)
+
+        def send(content, priority):
+            return asyncio.ensure_future(dispatcher.complete(
+                messages=[{"role": "user", "content": content}], model="m", priority=priority
+            ))
+
+        busy = send("busy", Priority.DEFAULT)
+        while not client.started:
+            await asyncio.sleep(0.01)
+        background = send("background", Priority.BACKGROUND)
+        await asyncio.sleep(0.05)
+        interactive = send("interactive", Priority.INTERACTIVE)
+        await asyncio.sleep(0.05)
+        client.gate.set()
+        await asyncio.gather(busy, background, interactive)
+        return client.started
+
+    assert asyncio.run(run()) == ["busy", "interactive", "background"]
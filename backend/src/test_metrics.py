@@ -0,0 +1,60 @@
+# test_metrics.py
+import json
+
+from src import metrics
+from src.metrics import Counter, Histogram, Registry, read_snapshots, write_snapshot
+
+
+def _registry():
+    registry = Registry()
+    counter = registry.register(Counter("requests_total", "Requests", labelnames=("route",)))
+    histogram = registry.register(Histogram("stage_seconds", "Stage latency", labelnames=("stage",), buckets=(0.1, 1.0)))
+    return registry, counter, histogram
+
+
+def test_exposition_format():
+    registry, counter, histogram = _registry()
+    counter.inc(route='/query "x"')
+    histogram.observe(0.05, stage="embed")
+    histogram.observe(2.0, stage="embed")
+
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests",
+        "# TYPE requests_total counter",
+        'requests_total{route="/query \\"x\\""} 1.0',
+        "# HELP stage_seconds Stage latency",
+        "# TYPE stage_seconds histogram",
+        'stage_seconds_bucket{stage="embed",le="0.1"} 1',
+        'stage_seconds_bucket{stage="embed",le="1.0"} 1',
+        'stage_seconds_bucket{stage="embed",le="+Inf"} 2',
+        'stage_seconds_sum{stage="embed"} 2.05',
+        'stage_seconds_count{stage="embed"} 2',
+    ]
+
+
+def test_scrapes_report_the_totals_of_all_workers(tmp_path, monkeypatch):
+    # Another worker's snapshot, written by a registry of the same metrics
+    other, counter, histogram = _registry()
+    counter.inc(3, route="/query")
+    counter.inc(route="/chat")
+    histogram.observe(0.5, stage="embed")
+    (tmp_path / "1.json").write_text(json.dumps(other.snapshot()))
+
+    registry, counter, histogram = _registry()
+    counter.inc(2, route="/query")
+    histogram.observe(0.05, stage="embed")
+    write_snapshot(str(tmp_path), registry)
+
+    lines = registry.render(read_snapshots(str(tmp_path))).splitlines()
+    assert 'requests_total{route="/query"} 5.0' in lines
+    assert 'requests_total{route="/chat"} 1.0' in lines
+    assert 'stage_seconds_bucket{stage="embed",le="0.1"} 1' in lines
+    assert 'stage_seconds_bucket{stage="embed",le="1.0"} 2' in lines
+    assert 'stage_seconds_count{stage="embed"} 2' in lines
+
+    # The app's /metrics renders the shared totals once METRICS_DIR is set
+    monkeypatch.setenv("METRICS_DIR", str(tmp_path / "app"))
+    metrics.HTTP_REQUESTS.inc(route="/metrics", method="GET", status="200")
+    rendered = metrics.render_metrics()
+    assert 'http_requests_total{route="/metrics",method="GET",status="200"}' in rendered
+    assert len(read_snapshots(str(tmp_path / "app"))) == 1
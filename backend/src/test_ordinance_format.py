@@ -0,0 +1,48 @@
+# test_ordinance_format.py
+import gzip
+import json
+
+from src.ordinance_format import iter_batches, iter_ordinances, parsed_path, write_ordinances
+
+
+def sample_ordinances(count: int):
+    for n in range(count):
+        metadata = {
+            "title": f"TITLE {n // 50 + 1}, GENERAL PROVISIONS",
+            "chapter": f"CHAPTER {n // 10 + 1}, DEFINITIONS",
+            "section": f"Sec. {n // 10 + 1}-{n % 10}",
+            "state": "CA",
+            "city": "California_City",
+            "url": f"https://library.municode.com/ca/california_city/codes/{n}"
+        }
+        if n % 3 == 0:
+            metadata["subtitle"] = "Definitions."
+        if n == 7:
+            metadata["pages"] = "3-4"
+            metadata["source"] = "pdf"
+        yield {"metadata": metadata, "content": f"Section {n} text with ünïcode."}
+
+
+def test_round_trip_preserves_records(tmp_path):
+    path = str(tmp_path / "codes.ordinances.ndjson.gz")
+    expected = list(sample_ordinances(120))
+
+    assert write_ordinances(path, iter(expected)) == 120
+    assert list(iter_ordinances(path)) == expected
+    assert [len(batch) for batch in iter_batches(path, batch_size=50)] == [50, 50, 20]
+
+
+def test_repeated_metadata_is_stored_once(tmp_path):
+    path = str(tmp_path / "codes.ordinances.ndjson.gz")
+    write_ordinances(path, sample_ordinances(120))
+
+    with gzip.open(path, "rt") as f:
+        lines = [json.loads(line) for line in f][1:]
+    entries = [line for line in lines if isinstance(line, dict)]
+    # 3 titles, 12 chapters, 1 state and 1 city
+    assert len(entries) == 17
+    assert not (tmp_path / "codes.ordinances.ndjson.gz.tmp").exists()
+
+
+def test_parsed_path_sits_next_to_the_export():
+    assert parsed_path("data/raw_files/City.xlsx") == "data/raw_files/City.ordinances.ndjson.gz"
@@ -0,0 +1,52 @@
+# test_parse_cache.py
+import os
+
+from src.parse_cache import ParseCache
+
+RECORDS = [
+    {"metadata": {"title": "TITLE 1", "state": "CA", "city": "Campbell", "section": "Sec. 1-1"}, "content": "Text"},
+    {"metadata": {"title": "TITLE 1", "state": "CA", "city": "Campbell", "section": "Sec. 1-2"}, "content": "More"},
+]
+
+
+class CountingParser:
+    def __init__(self, records):
+        self.records = records
+        self.calls = 0
+
+    def __call__(self, path):
+        self.calls += 1
+        return self.records
+
+
+def test_unchanged_file_is_parsed_once(tmp_path):
+    source = tmp_path / "export.xlsx"
+    source.write_bytes(b"excel bytes")
+    parse = CountingParser(RECORDS)
+    cache = ParseCache(str(tmp_path / "cache"))
+
+    first, first_hit = cache.load_or_parse(str(source), parse)
+    assert list(first) == RECORDS and not first_hit
+
+    # Touching the file changes its mtime but not its content, still a hit
+    os.utime(source, (1, 1))
+    again, hit = ParseCache(str(tmp_path / "cache")).load_or_parse(str(source), parse)
+    assert hit and list(again) == RECORDS
+    assert parse.calls == 1
+
+
+def test_changed_content_or_parser_version_misses(tmp_path):
+    source = tmp_path / "export.xlsx"
+    source.write_bytes(b"version one")
+    parse = CountingParser(RECORDS)
+    cache = ParseCache(str(tmp_path / "cache"))
+    cache.load_or_parse(str(source), parse)
+
+    source.write_bytes(b"version two, longer")
+    _, hit = cache.load_or_parse(str(source), parse)
+    assert not hit
+
+    _, hit = ParseCache(str(tmp_path / "cache"), parser_version="2").load_or_parse(str(source), parse)
+    assert not hit
+    assert parse.calls == 3
+    assert not [name for name in os.listdir(tmp_path / "cache") if name.endswith(".tmp")]
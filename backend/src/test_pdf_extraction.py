@@ -0,0 +1,85 @@
+# test_pdf_extraction.py
+from concurrent.futures import ThreadPoolExecutor
+
+from src.pdf_extraction import PageText, extract_sections, iter_pages, split_sections
+
+BASE = {"state": "CA", "city": "Campbell", "url": "https://example.org/doc.pdf"}
+
+
+def test_sections_span_pages_and_keep_order():
+    pages = [
+        PageText(1, "Smoke alarm handout\nSec. 1.01. Adoption.\nThe city adopts", 0.01),
+        PageText(2, "the fire code.\nSec. 1.02. Alarms.\nAlarms are required.", 0.01),
+        PageText(3, "", 0.0),  # Scanned page without a text layer
+        PageText(4, "In every bedroom.", 0.01),
+    ]
+    records = list(split_sections(pages, BASE))
+
+    assert [r["metadata"]["section"] for r in records] == ["Preamble", "Sec. 1.01.", "Sec. 1.02."]
+    adoption, alarms = records[1], records[2]
+    assert adoption["metadata"]["subtitle"] == "Adoption"
+    assert adoption["metadata"]["pages"] == "1-2"
+    assert "The city adopts\nthe fire code." in adoption["content"]
+    assert alarms["metadata"]["pages"] == "2-4"
+    assert alarms["content"].endswith("In every bedroom.")
+    assert all(r["metadata"]["city"] == "Campbell" for r in records)
+
+
+def _pdf(pages):
+    """Minimal PDF, each page a list of text lines"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        stream = "BT /F1 12 Tf 14 TL 72 720 Td " + " ".join(f"({line}) Tj T*" for line in lines) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode()
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return out
+
+
+class RecordingExecutor(ThreadPoolExecutor):
+    """Thread pool remembering the arguments of every task"""
+
+    def __init__(self):
+        super().__init__(max_workers=3)
+        self.task_args = []
+
+    def submit(self, fn, *args, **kwargs):
+        self.task_args.append(args)
+        return super().submit(fn, *args, **kwargs)
+
+
+def test_page_ranges_are_extracted_in_parallel_and_yielded_in_order():
+    pdf = _pdf([[f"Sec. 1.0{i}. Part {i}.", f"Text of part {i}."] for i in range(1, 8)])
+    with RecordingExecutor() as executor:
+        pages = list(iter_pages(pdf, pages_per_task=2, executor=executor))
+        records, report = extract_sections(pdf, BASE, pages_per_task=2, executor=executor)
+
+    assert [page.page_number for page in pages] == list(range(1, 8))
+    assert all(page.text.endswith(f"Text of part {page.page_number}.") for page in pages)
+    assert all(page.seconds > 0 for page in pages)
+    # Four ranges per run, none of them carrying the document itself
+    assert [args[1:] for args in executor.task_args[:4]] == [(0, 2), (2, 4), (4, 6), (6, 8)]
+    assert not any(isinstance(args[0], bytes) for args in executor.task_args)
+
+    assert [r["metadata"]["section"] for r in records] == [f"Sec. 1.0{i}." for i in range(1, 8)]
+    assert [r["metadata"]["pages"] for r in records] == [str(i) for i in range(1, 8)]
+    assert report.pages == 7 and report.empty_pages == []
+    assert [t["seconds"] for t in report.slowest_pages] == sorted(
+        (t["seconds"] for t in report.slowest_pages), reverse=True
+    )
+    assert len(report.slowest_pages) == 5 and report.total_seconds > 0
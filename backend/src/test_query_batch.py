@@ -0,0 +1,101 @@
+# test_query_batch.py
+import json
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src import db, ordinance_db
+from src.app import app
+from src.llm_dispatcher import LLMDispatcher
+from src.ordinance_db import OrdinanceDBWithTogether
+from src.rag import OrdinanceRAG
+from src.test_dedup import WORDS, WordEmbedding, _ordinance, _text
+from src.test_sharding import MemoryClient
+
+
+class CountingEmbedding(WordEmbedding):
+    """WordEmbedding recording each call's texts"""
+
+    calls = []
+
+    def __call__(self, documents):
+        CountingEmbedding.calls.append(list(documents))
+        return super().__call__(documents)
+
+
+class EchoClient:
+    """LlamaStack stand-in answering with the question, failing on "unanswerable" ones"""
+
+    def __init__(self):
+        self.inference = SimpleNamespace(chat_completion=self._complete)
+
+    def _complete(self, messages, model, **kwargs):
+        question = messages[-1]["content"].split("Question: ")[-1].split("\n")[0]
+        if "unanswerable" in question:
+            raise RuntimeError("model overloaded")
+        return SimpleNamespace(completion_message=SimpleNamespace(content=f"Answer to {question}"))
+
+
+@pytest.fixture
+def ordinances(tmp_path, monkeypatch):
+    """OrdinanceDBWithTogether on the in-memory client, three Fresno and two Austin sections"""
+    monkeypatch.setattr(ordinance_db, "TogetherEmbeddingFunction", CountingEmbedding)
+    client = MemoryClient()
+    monkeypatch.setattr(db, "create_chroma_client", lambda: client)
+    CountingEmbedding.calls = []
+    ordinances = OrdinanceDBWithTogether(api_key="key", collection_name="ordinances")
+    ordinances.upsert_ordinances(
+        [_ordinance("CA", "Fresno", f"8-{i}", _text(i)) for i in range(3)]
+        + [_ordinance("TX", "Austin", f"25-{i}", _text(10 + i)) for i in range(2)]
+    )
+    CountingEmbedding.calls = []
+    return ordinances
+
+
+def test_searches_share_embedding_calls_and_one_query_per_filter(ordinances):
+    queries = [WORDS[0], WORDS[1]]
+    results = ordinances.search_ordinances_batch([
+        {"query": queries[0], "city": "Fresno", "max_results": 1},
+        {"query": queries[1], "city": "Fresno", "max_results": 3},
+        {"query": queries[0], "filter_conditions": {"city": "Austin"}},
+        {"query": queries[0], "city": "Fresno", "max_results": 2},
+    ])
+
+    # The distinct queries are embedded together, once
+    assert CountingEmbedding.calls == [queries]
+    # Two distinct filters, the Fresno searches share one query
+    assert ordinances.collection.queries == 2
+    assert [len(r) for r in results] == [1, 3, 2, 2]
+    assert {r["metadata"]["city"] for i in (0, 1, 3) for r in results[i]} == {"Fresno"}
+    assert {r["metadata"]["city"] for r in results[2]} == {"Austin"}
+    assert results[0] == results[3][:1]
+
+    # Cached query embeddings are not fetched again
+    ordinances.search_ordinances_batch([{"query": queries[1]}])
+    assert len(CountingEmbedding.calls) == 1
+
+
+def test_query_batch_streams_each_item_then_done(ordinances):
+    app.state.rag = OrdinanceRAG(ordinance_db=ordinances, dispatcher=LLMDispatcher(client=EchoClient()), top_k=2)
+    client = TestClient(app)
+    response = client.post("/query/batch", json={"items": [
+        {"query": "fire permit", "city": "Fresno"},
+        {"query": "unanswerable question"},
+        {"query": "fence height", "state": "TX"},
+    ]})
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+
+    assert lines[-1] == {"type": "done", "succeeded": 2, "failed": 1}
+    items = {line["index"]: line for line in lines[:-1]}
+    assert sorted(items) == [0, 1, 2]
+    assert items[0]["type"] == "result" and items[0]["answer"] == "Answer to fire permit"
+    assert {s["metadata"]["city"] for s in items[0]["sources"]} == {"Fresno"}
+    assert len(items[0]["sources"]) == 2
+    # A failing item is reported on its own line, the others still answer
+    assert items[1]["type"] == "error" and "model overloaded" in items[1]["error"]
+    assert items[2]["answer"] == "Answer to fence height"
+    assert {s["metadata"]["state"] for s in items[2]["sources"]} == {"TX"}
+
+    assert client.post("/query/batch", json={"items": []}).status_code == 400
@@ -21,22 +21,23 @@ async def test_single_query(rag: OrdinanceRAG, test: dict):
     try:
         if test['stream']:
             print("Response:")
-            async for chunk in await rag.aquery(
+            result = await rag.aquery(
                 query_str=test['query'],
                 state=test['state'],
                 city=test['city'],
                 stream=True
-            ):
+            )
+            async for chunk in result["generator"]:
                 print(chunk, end='', flush=True)
             print("\n")
         else:
-            response = await rag.aquery(
+            result = await rag.aquery(
                 query_str=test['query'],
                 state=test['state'],
                 city=test['city'],
                 stream=False
             )
-            print("Response:", response)
+            print("Response:", result["answer"])
             
         print("✓ Test passed")
         
@@ -0,0 +1,47 @@
+# test_rate_limit.py
+import asyncio
+import time
+
+from src.rate_limit import AdaptiveRateLimiter, TokenBucket
+
+
+def test_requests_are_paced_after_the_burst():
+    async def run():
+        limiter = AdaptiveRateLimiter(requests_per_second=20.0, tokens_per_minute=1e9)
+        start = time.monotonic()
+        await asyncio.gather(*[limiter.acquire() for _ in range(30)])
+        return time.monotonic() - start
+
+    # 20 go out at once, the other 10 wait for the bucket to refill
+    elapsed = asyncio.run(run())
+    assert 0.4 < elapsed < 1.0
+
+
+def test_429_halves_the_rate_and_success_recovers_it():
+    limiter = AdaptiveRateLimiter(requests_per_second=8.0, recovery_step=1.0)
+    delay = limiter.on_rate_limited({"retry-after": "2"})
+    assert delay == 2.0
+    assert limiter.requests_per_second == 4.0
+    limiter.on_success()
+    assert limiter.requests_per_second == 5.0
+
+
+def test_headers_lower_the_limits_and_pause_when_exhausted():
+    limiter = AdaptiveRateLimiter(requests_per_second=100.0, tokens_per_minute=1e6)
+    limiter.on_success({
+        "x-ratelimit-limit": "10",
+        "x-ratelimit-limit-tokens": "6000",
+        "x-ratelimit-remaining": "0",
+        "x-ratelimit-reset": "3"
+    })
+    assert limiter.requests_per_second == 10.0
+    assert limiter.tokens_per_minute == 6000.0
+    assert limiter.requests.wait_time(1) == 0.0
+    assert limiter._paused_until - time.monotonic() > 2.5
+
+
+def test_token_bucket_admits_oversized_requests_when_full():
+    bucket = TokenBucket(rate=100.0, capacity=50.0)
+    assert bucket.wait_time(500) == 0.0
+    bucket.take(500)
+    assert bucket.wait_time(1) > 4.0
@@ -0,0 +1,140 @@
+# test_sharding.py
+import math
+
+from src.sharding import create_collection, delete_collection, open_collection
+
+
+class MemoryCollection:
+    """Chroma collection stand-in with exact search over the stored embeddings"""
+
+    def __init__(self, name, metadata, embedding_function=None):
+        self.name = name
+        self.metadata = metadata
+        self.embedding_function = embedding_function
+        self.rows = {}
+        self.queries = 0
+
+    def upsert(self, ids, metadatas, documents=None, embeddings=None):
+        if embeddings is None and self.embedding_function is not None:
+            embeddings = self.embedding_function(documents)
+        for i, id_ in enumerate(ids):
+            self.rows[id_] = (embeddings[i], metadatas[i], documents[i] if documents else None)
+
+    def update(self, ids, metadatas):
+        for id_, metadata in zip(ids, metadatas):
+            embedding, _, document = self.rows[id_]
+            self.rows[id_] = (embedding, metadata, document)
+
+    def count(self):
+        return len(self.rows)
+
+    def _matches(self, metadata, where):
+        if not where:
+            return True
+        if "$and" in where:
+            return all(self._matches(metadata, c) for c in where["$and"])
+        if "$or" in where:
+            return any(self._matches(metadata, c) for c in where["$or"])
+        for key, value in where.items():
+            if isinstance(value, dict):
+                if "$in" in value and metadata.get(key) not in value["$in"]:
+                    return False
+                if "$eq" in value and metadata.get(key) != value["$eq"]:
+                    return False
+            elif metadata.get(key) != value:
+                return False
+        return True
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=()):
+        items = [(i, r) for i, r in sorted(self.rows.items()) if (ids is None or i in ids) and self._matches(r[1], where)]
+        items = items[offset or 0:]
+        if limit is not None:
+            items = items[:limit]
+        return {"ids": [i for i, _ in items], "metadatas": [r[1] for _, r in items], "documents": [r[2] for _, r in items]}
+
+    def query(self, query_embeddings, n_results, include=None, where=None):
+        self.queries += 1
+        result = {"ids": [], "distances": [], "metadatas": [], "documents": []}
+        for embedding in query_embeddings:
+            rows = sorted(
+                (math.dist(embedding, row[0]), id_, row)
+                for id_, row in self.rows.items() if self._matches(row[1], where)
+            )[:n_results]
+            result["ids"].append([id_ for _, id_, _ in rows])
+            result["distances"].append([d for d, _, _ in rows])
+            result["metadatas"].append([row[1] for _, _, row in rows])
+            result["documents"].append([row[2] for _, _, row in rows])
+        return result
+
+    def delete(self, ids=None, where=None):
+        for id_ in list(self.rows):
+            if (ids is None or id_ in ids) and self._matches(self.rows[id_][1], where):
+                del self.rows[id_]
+
+
+class MemoryClient:
+    def __init__(self):
+        self.collections = {}
+
+    def list_collections(self):
+        return list(self.collections)
+
+    def create_collection(self, name, embedding_function=None, metadata=None):
+        self.collections[name] = MemoryCollection(name, metadata, embedding_function)
+        return self.collections[name]
+
+    def get_collection(self, name, embedding_function=None):
+        if name not in self.collections:
+            raise ValueError(f"Collection {name} does not exist.")
+        return self.collections[name]
+
+    def get_or_create_collection(self, name, embedding_function=None, metadata=None):
+        return self.collections.get(name) or self.create_collection(name, embedding_function, metadata)
+
+    def delete_collection(self, name):
+        del self.collections[name]
+
+
+def _sections():
+    places = [("CA", "Fresno"), ("CA", "Oakland"), ("TX", "Austin")]
+    for i in range(12):
+        state, city = places[i % 3]
+        yield f"s{i}", [float(i), 0.0], {"state": state, "city": city}, f"section {i}"
+
+
+def _seeded(shard_by):
+    client = MemoryClient()
+    collection = create_collection(client, "ordinances_v1", None, {"hnsw:space": "l2"}, shard_by=shard_by)
+    ids, embeddings, metadatas, documents = zip(*_sections())
+    collection.upsert(ids=list(ids), embeddings=list(embeddings), metadatas=list(metadatas), documents=list(documents))
+    return client, collection
+
+
+def test_filtered_queries_only_search_matching_shards():
+    client, collection = _seeded("city")
+    assert collection.count() == 12
+    shards = {name: c for name, c in client.collections.items() if name.startswith("ordinances_v1__")}
+    assert len(shards) == 3
+
+    results = collection.query(query_embeddings=[[4.0, 0.0]], n_results=2, where={"$and": [{"state": "CA"}, {"city": "Oakland"}]})
+    assert results["ids"] == [["s4", "s1"]]
+    assert sum(c.queries for c in shards.values()) == 1
+
+    # A state filter reaches every city shard of that state, and only those
+    collection.query(query_embeddings=[[4.0, 0.0]], n_results=2, where={"state": "CA"})
+    assert sum(c.queries for c in shards.values()) == 3
+
+
+def test_unfiltered_queries_merge_shards_by_distance():
+    client, _ = _seeded("state")
+    collection = open_collection(client, "ordinances_v1")
+    results = collection.query(query_embeddings=[[5.2, 0.0], [0.0, 0.0]], n_results=3)
+    assert results["ids"] == [["s5", "s6", "s4"], ["s0", "s1", "s2"]]
+    assert results["distances"][0] == sorted(results["distances"][0])
+
+    # Paging walks the shards in order without repeating or losing sections
+    pages = [collection.get(limit=5, offset=offset)["ids"] for offset in (0, 5, 10)]
+    assert sorted(i for page in pages for i in page) == sorted(f"s{i}" for i in range(12))
+
+    delete_collection(client, "ordinances_v1")
+    assert client.collections == {}
@@ -0,0 +1,97 @@
+# test_tracing.py
+import json
+
+from fastapi.testclient import TestClient
+from llama_index.core import Settings
+from llama_index.core.callbacks import CallbackManager, CBEventType
+
+from src.app import app
+from src.llm_dispatcher import LLMDispatcher
+from src.rag import OrdinanceRAG
+from src.test_query_batch import EchoClient, ordinances  # noqa: F401 (fixture)
+from src.tracing import (
+    JsonlSpanExporter, SpanExporter, TracingCallbackHandler, _trace_id_for, current_request_id, new_request_id
+)
+
+
+class ListExporter(SpanExporter):
+    """Keeps exported spans in memory"""
+
+    def __init__(self):
+        self.spans = []
+        super().__init__(flush_interval=0.05)
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+
+def _record(handler: TracingCallbackHandler, request_id: str):
+    """Start and end one span as if serving request_id"""
+    token = current_request_id.set(request_id)
+    try:
+        event_id = handler.on_event_start(CBEventType.QUERY, event_id=request_id + "-span")
+        handler.on_event_end(CBEventType.QUERY, event_id=event_id)
+    finally:
+        current_request_id.reset(token)
+
+
+def test_sampling_is_decided_per_trace():
+    ids = [new_request_id() for _ in range(2000)]
+    half = TracingCallbackHandler(ListExporter(), sample_rate=0.5)
+    decisions = [half.sampled(_trace_id_for(i)) for i in ids]
+    # The same trace always gets the same decision
+    assert decisions == [half.sampled(_trace_id_for(i)) for i in ids]
+    assert 0.45 < sum(decisions) / len(ids) < 0.55
+    always = TracingCallbackHandler(ListExporter(), sample_rate=1.0)
+    never = TracingCallbackHandler(ListExporter(), sample_rate=0.0)
+    assert all(always.sampled(_trace_id_for(i)) for i in ids)
+    assert not any(never.sampled(_trace_id_for(i)) for i in ids)
+
+    # Only spans of sampled traces are exported
+    exporter = ListExporter()
+    handler = TracingCallbackHandler(exporter, sample_rate=0.5)
+    for request_id in ids[:200]:
+        _record(handler, request_id)
+    exporter.shutdown()
+    expected = {_trace_id_for(i) for i, sampled in zip(ids[:200], decisions) if sampled}
+    assert {span["trace_id"] for span in exporter.spans} == expected
+    assert len(exporter.spans) == len(expected)
+
+
+def test_query_spans_share_the_request_trace_in_the_jsonl_export(ordinances, tmp_path):  # noqa: F811
+    exporter = JsonlSpanExporter(str(tmp_path / "traces.jsonl"), flush_interval=0.05)
+    callback_manager = CallbackManager([TracingCallbackHandler(exporter)])
+    app.state.rag = OrdinanceRAG(
+        ordinance_db=ordinances,
+        dispatcher=LLMDispatcher(client=EchoClient()),
+        callback_manager=callback_manager
+    )
+    try:
+        client = TestClient(app)
+        response = client.post("/query", json={"query": "fire permit", "city": "Fresno"}, headers={"X-Request-ID": "req-42"})
+        generated = client.post("/query", json={"query": "fence height"})
+        exporter.shutdown()
+    finally:
+        Settings.callback_manager = CallbackManager()
+
+    assert response.status_code == 200 and response.json()["response"] == "Answer to fire permit"
+    assert response.headers["X-Request-ID"] == "req-42"
+    generated_id = generated.headers["X-Request-ID"]
+    assert len(generated_id) == 32 and generated_id != "req-42"
+
+    spans = [json.loads(line) for line in (tmp_path / "traces.jsonl").read_text().splitlines()]
+    by_trace = {}
+    for span in spans:
+        by_trace.setdefault(span["trace_id"], []).append(span)
+    # A client supplied ID is hashed into a trace ID, a generated one is used as is
+    assert set(by_trace) == {_trace_id_for("req-42"), generated_id}
+
+    traced = by_trace[_trace_id_for("req-42")]
+    names = {span["name"] for span in traced}
+    assert {"retrieve", "embed", "vector_query", "prompt_build", "llm"} <= names
+    assert {span["request_id"] for span in traced} == {"req-42"}
+    by_name = {span["name"]: span for span in traced}
+    assert by_name["retrieve"]["attributes"]["query"] == "fire permit"
+    assert by_name["embed"]["attributes"]["embedding_count"] == 1
+    assert by_name["llm"]["attributes"]["completion_bytes"] == len("Answer to fire permit")
+    assert all(span["end_time_unix_nano"] >= span["start_time_unix_nano"] for span in traced)
@@ -0,0 +1,331 @@
+# tracing.py
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+import httpx
+from llama_index.core.callbacks import CallbackManager, CBEventType, EventPayload
+from llama_index.core.callbacks.base_handler import BaseCallbackHandler
+
+# Request ID of the request being served, set by the app middleware. Spans
+# recorded while serving it share it as their trace ID.
+current_request_id: ContextVar[Optional[str]] = ContextVar("current_request_id", default=None)
+
+# Payload key callers can use to name a span more precisely than its event type
+SPAN_NAME = "span_name"
+
+_SPAN_NAMES = {
+    CBEventType.RETRIEVE: "retrieve",
+    CBEventType.EMBEDDING: "embed",
+    CBEventType.QUERY: "query",
+    CBEventType.TEMPLATING: "prompt_build",
+    CBEventType.LLM: "llm",
+}
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+def _trace_id_for(request_id: str) -> str:
+    """32 hex character trace ID, request IDs that already are one are kept"""
+    if len(request_id) == 32 and all(c in "0123456789abcdef" for c in request_id):
+        return request_id
+    return hashlib.sha256(request_id.encode()).hexdigest()[:32]
+
+
+def _span_id_for(event_id: str) -> str:
+    return event_id.replace("-", "")[:16]
+
+
+class SpanExporter:
+    """
+    Buffers finished spans and exports them in batches from a background thread.
+
+    Subclasses implement export(), which is never called on the event loop.
+    """
+
+    def __init__(self, batch_size: int = 256, flush_interval: float = 2.0, max_queue: int = 10000):
+        """
+        Args:
+            batch_size: Spans per export call
+            flush_interval: Seconds between exports of a partial batch
+            max_queue: Spans buffered before new ones are dropped
+        """
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue: "queue.Queue[Optional[Dict]]" = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, span: Dict):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def export(self, spans: List[Dict]):
+        raise NotImplementedError
+
+    def shutdown(self, timeout: float = 5.0):
+        """Flush the buffered spans and stop the export thread"""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        batch: List[Dict] = []
+        last_flush = time.monotonic()
+        while True:
+            try:
+                span = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                span = False
+            if span:
+                batch.append(span)
+            due = time.monotonic() - last_flush >= self.flush_interval
+            if batch and (span is None or len(batch) >= self.batch_size or due):
+                try:
+                    self.export(batch)
+                except Exception as e:
+                    print(f"Error exporting {len(batch)} spans: {str(e)}")
+                batch = []
+            if due or span is None:
+                last_flush = time.monotonic()
+            if span is None:
+                return
+
+
+class JsonlSpanExporter(SpanExporter):
+    """Appends one JSON span per line to a local file"""
+
+    def __init__(self, path: str, **kwargs):
+        self.path = path
+        super().__init__(**kwargs)
+
+    def export(self, spans: List[Dict]):
+        with open(self.path, "a") as f:
+            for span in spans:
+                f.write(json.dumps(span, default=str) + "\n")
+
+
+def _otlp_value(value: Any) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [_otlp_value(v) for v in value]}}
+    return {"stringValue": str(value)}
+
+
+class OtlpHttpSpanExporter(SpanExporter):
+    """Posts spans to an OTLP/HTTP collector using the JSON encoding"""
+
+    def __init__(self, endpoint: str, service_name: str = "ordinance-rag", **kwargs):
+        """
+        Args:
+            endpoint: Collector base URL, e.g. http://localhost:4318
+            service_name: Value of the service.name resource attribute
+        """
+        self.url = endpoint.rstrip("/")
+        if not self.url.endswith("/v1/traces"):
+            self.url += "/v1/traces"
+        self.service_name = service_name
+        self._client = httpx.Client(timeout=5.0)
+        super().__init__(**kwargs)
+
+    def _otlp_span(self, span: Dict) -> Dict:
+        otlp = {
+            "traceId": span["trace_id"],
+            "spanId": span["span_id"],
+            "name": span["name"],
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(span["start_time_unix_nano"]),
+            "endTimeUnixNano": str(span["end_time_unix_nano"]),
+            "attributes": [
+                {"key": key, "value": _otlp_value(value)}
+                for key, value in span["attributes"].items()
+            ],
+            "status": {"code": 2 if span["error"] else 1},
+        }
+        if span["parent_span_id"]:
+            otlp["parentSpanId"] = span["parent_span_id"]
+        return otlp
+
+    def export(self, spans: List[Dict]):
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [
+                    {"key": "service.name", "value": {"stringValue": self.service_name}}
+                ]},
+                "scopeSpans": [{
+                    "scope": {"name": "src.tracing"},
+                    "spans": [self._otlp_span(span) for span in spans]
+                }]
+            }]
+        }
+        response = self._client.post(self.url, json=payload)
+        response.raise_for_status()
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    Turns llama_index callback events into timed spans.
+
+    Spans recorded while serving a request share its request ID as trace ID,
+    and a trace is either sampled in full or not at all. Attributes are taken
+    from the event payloads: query text, document IDs and scores, prompt and
+    completion token counts, bytes and embedding sizes.
+    """
+
+    def __init__(self, exporter: SpanExporter, sample_rate: float = 1.0):
+        """
+        Args:
+            exporter: Destination of finished spans
+            sample_rate: Fraction of requests traced, between 0 and 1
+        """
+        super().__init__(event_starts_to_ignore=[], event_ends_to_ignore=[])
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self._open: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def sampled(self, trace_id: str) -> bool:
+        """Deterministic per trace, so every span of a request gets the same decision"""
+        if self.sample_rate >= 1.0:
+            return True
+        if self.sample_rate <= 0.0:
+            return False
+        return int(trace_id[:8], 16) / 0xFFFFFFFF < self.sample_rate
+
+    def on_event_start(
+        self,
+        event_type: CBEventType,
+        payload: Optional[Dict[str, Any]] = None,
+        event_id: str = "",
+        parent_id: str = "",
+        **kwargs: Any
+    ) -> str:
+        with self._lock:
+            parent = self._open.get(parent_id)
+        request_id = current_request_id.get()
+        if request_id is not None:
+            trace_id = _trace_id_for(request_id)
+        elif parent is not None:
+            trace_id = parent["trace_id"]
+        else:
+            trace_id = _trace_id_for(event_id)
+        if not self.sampled(trace_id):
+            return event_id
+
+        payload = payload or {}
+        span = {
+            "trace_id": trace_id,
+            "span_id": _span_id_for(event_id),
+            "parent_span_id": parent["span_id"] if parent is not None else None,
+            "name": payload.get(SPAN_NAME) or _SPAN_NAMES.get(event_type, event_type.value),
+            "request_id": request_id,
+            "start_time_unix_nano": time.time_ns(),
+            "attributes": {"event_type": event_type.value},
+            "error": False,
+        }
+        self._add_attributes(span["attributes"], payload)
+        with self._lock:
+            self._open[event_id] = span
+        return event_id
+
+    def on_event_end(
+        self,
+        event_type: CBEventType,
+        payload: Optional[Dict[str, Any]] = None,
+        event_id: str = "",
+        **kwargs: Any
+    ) -> None:
+        with self._lock:
+            span = self._open.pop(event_id, None)
+        if span is None:
+            return
+        span["end_time_unix_nano"] = time.time_ns()
+        span["duration_ms"] = (span["end_time_unix_nano"] - span["start_time_unix_nano"]) / 1e6
+        self._add_attributes(span["attributes"], payload or {})
+        if EventPayload.EXCEPTION in (payload or {}):
+            span["error"] = True
+        self.exporter.submit(span)
+
+    def start_trace(self, trace_id: Optional[str] = None) -> None:
+        pass
+
+    def end_trace(
+        self,
+        trace_id: Optional[str] = None,
+        trace_map: Optional[Dict[str, List[str]]] = None
+    ) -> None:
+        pass
+
+    @staticmethod
+    def _add_attributes(attributes: Dict[str, Any], payload: Dict[str, Any]):
+        for key, value in payload.items():
+            if key == EventPayload.NODES:
+                attributes["document_ids"] = [n.node.id_ for n in value]
+                attributes["scores"] = [float(n.score or 0.0) for n in value]
+                attributes["document_count"] = len(value)
+                attributes["document_bytes"] = sum(len(n.node.get_content().encode()) for n in value)
+            elif key == EventPayload.EMBEDDINGS:
+                attributes["embedding_count"] = len(value)
+                attributes["embedding_dim"] = len(value[0]) if value else 0
+            elif key == EventPayload.QUERY_STR:
+                attributes["query"] = value
+            elif key in (EventPayload.PROMPT, EventPayload.COMPLETION):
+                prefix = "prompt" if key == EventPayload.PROMPT else "completion"
+                attributes[f"{prefix}_bytes"] = len(str(value).encode())
+                attributes[f"{prefix}_tokens"] = len(str(value)) // 4
+            elif key == EventPayload.EXCEPTION:
+                attributes["exception"] = repr(value)
+            elif key == SPAN_NAME:
+                continue
+            elif isinstance(value, (str, int, float, bool)):
+                # Extra scalar attributes passed by the caller as plain string keys
+                attributes[str(key)] = value
+
+
+def build_callback_manager() -> CallbackManager:
+    """
+    Callback manager with the tracing handler configured from the environment.
+
+    TRACE_EXPORTER selects "jsonl" (TRACE_FILE, default traces.jsonl), "otlp"
+    (OTEL_EXPORTER_OTLP_ENDPOINT, default http://localhost:4318) or "none".
+    TRACE_SAMPLE_RATE sets the fraction of requests traced.
+    """
+    exporter_name = os.getenv("TRACE_EXPORTER", "none").lower()
+    if exporter_name == "jsonl":
+        exporter = JsonlSpanExporter(os.getenv("TRACE_FILE", "traces.jsonl"))
+    elif exporter_name == "otlp":
+        exporter = OtlpHttpSpanExporter(
+            os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4318"),
+            service_name=os.getenv("OTEL_SERVICE_NAME", "ordinance-rag")
+        )
+    else:
+        return CallbackManager()
+
+    handler = TracingCallbackHandler(
+        exporter,
+        sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+    )
+    print(f"Tracing {handler.sample_rate:.0%} of requests to {exporter_name}")
+    return CallbackManager([handler])
+
+
+def shutdown_tracing(callback_manager: CallbackManager):
+    """Flush the spans still buffered by the manager's tracing handlers"""
+    for handler in callback_manager.handlers:
+        if isinstance(handler, TracingCallbackHandler):
+            handler.exporter.shutdown()
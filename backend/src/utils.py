@@ -1,10 +1,19 @@
 import os
 
 
-def get_files_under_dir(dir_path):
+def get_files_under_dir(dir_path, extensions=('.xls', '.xlsx')):
     # check if path is directory
     if not os.path.isdir(dir_path):
         return None
-    # List all .xls files
-    xls_files = [f for f in os.listdir(dir_path) if f.endswith('.xls')]
-    return xls_files
+    # List the Excel exports, as paths usable by the caller
+    return sorted(
+        os.path.join(dir_path, f) for f in os.listdir(dir_path)
+        if f.endswith(tuple(extensions))
+    )
+
+
+def estimate_tokens(text: str) -> int:
+    # Rough token count for Llama-style tokenizers, about four characters per token
+    if not text:
+        return 0
+    return max(1, len(text) // 4)
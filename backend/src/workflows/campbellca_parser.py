@@ -3,14 +3,40 @@ from restack_ai.workflow import workflow, import_functions
 
 
 with import_functions():
-    from src.functions.crawl.crawl_campbellca import crawl_campbellca
+    from src.functions.crawl.crawl_campbellca import crawl_campbellca, CrawlCampbellcaInputParams, DEFAULT_URLS
     from src.functions.crawl.store_campbellca_to_db import store_campbellca_to_db, StoreCampbellToDbInputParams
 
 
+# Worst case of one document in crawl_campbellca: the first try and two
+# retries at the crawler's 30 second request timeout with their backoff,
+# then the PDF extraction of a large document
+DOCUMENT_TIMEOUT = timedelta(seconds=3 * 30 + 2) + timedelta(minutes=3)
+
+
 @workflow.defn(name="campbellca_parser")
 class campbellca_parser:
     @workflow.run
-    async def run(self):
-        campbell_data = await workflow.step(crawl_campbellca, start_to_close_timeout=timedelta(seconds=30))
+    async def run(self, input: dict = None):
+        """
+        Crawl Campbell document center pages and PDFs.
+
+        Input keys (all optional):
+            urls: Document center URLs to crawl
+            timeout_seconds: Limit of the crawl step, by default the worst
+                case of every URL fetched and extracted one after another
+        """
+        input = input or {}
+        urls = input.get("urls") or list(DEFAULT_URLS)
+        timeout = (
+            timedelta(seconds=float(input["timeout_seconds"])) if input.get("timeout_seconds")
+            else DOCUMENT_TIMEOUT * len(urls)
+        )
+        campbell_data = await workflow.step(
+            crawl_campbellca,
+            CrawlCampbellcaInputParams(urls=urls),
+            start_to_close_timeout=timeout,
+            # workflow.step caps the whole step at 2 minutes unless told otherwise
+            schedule_to_close_timeout=timeout
+        )
         stored_data = await workflow.step(store_campbellca_to_db, start_to_close_timeout=timedelta(seconds=30))
-        return campbell_data
\ No newline at end of file
+        return campbell_data
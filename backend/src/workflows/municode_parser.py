@@ -1,20 +1,136 @@
+import asyncio
 from datetime import timedelta
-from restack_ai.workflow import workflow, import_functions, log
+from restack_ai.workflow import workflow, import_functions, log, workflow_info
+from temporalio.common import RetryPolicy
 
 from src.utils import get_files_under_dir
 
 with import_functions():
     from src.functions.llm.parse_municode_entry import parse_municode_entry, ParseMunicodeEntryInputParams
+    from src.functions.index.collection_version import (
+        begin_collection_version, BeginCollectionVersionInputParams,
+        publish_collection_version, PublishCollectionVersionInputParams,
+        discard_collection_version, DiscardCollectionVersionInputParams
+    )
 
 
+DEFAULT_PATH = "data/raw_files"
+
+
+def all_attempts(per_attempt: timedelta, attempts: int) -> timedelta:
+    """
+    schedule_to_close_timeout covering every attempt of a step and the backoff between them.
+
+    workflow.step defaults it to 2 minutes, which would otherwise cut longer
+    steps and their retries short.
+    """
+    return per_attempt * attempts + timedelta(seconds=5 * 2 ** attempts)
+
 
 @workflow.defn(name="municode_parser")
 class municode_parser:
     @workflow.run
-    async def run(self, input: dict):
-        path = "../data/CaliforniaCityCACodeofOrdinancesEXPORT20220511.xlsx"
-        for path in get_files_under_dir(path):
-            first_data_source = await workflow.step(parse_municode_entry, ParseMunicodeEntryInputParams(path=path), start_to_close_timeout=timedelta(seconds=30))
+    async def run(self, input: dict = None):
+        """
+        Ingest every Municode Excel export under a directory.
+
+        One step per file runs concurrently, at most max_parallel at a time,
+        and each upserts its sections into the shared collection. A failed
+        file is retried on its own and reported without stopping the others.
+
+        With rebuild, collection_name is treated as an alias: the files go
+        into a new version of the collection, which replaces the live one
+        only if every file succeeded and the version passes validation. A
+        version with failed files is discarded right away.
+
+        Input keys (all optional):
+            path: Directory of exports, or a single export file
+            collection_name: Target collection
+            max_parallel: Files ingested at once
+            max_attempts: Tries per file
+            rebuild: Build a new version instead of updating the live one
+            smoke_query: Search the new version must answer before going live
+        """
+        input = input or {}
+        path = input.get("path", DEFAULT_PATH)
+        paths = get_files_under_dir(path)
+        if paths is None:
+            paths = [path]
+        alias = input.get("collection_name", "california_city_ordinances")
+        collection_name = alias
+        rebuild = bool(input.get("rebuild", False))
+        if rebuild:
+            started = await workflow.step(
+                begin_collection_version,
+                # Keyed by the run, a retried step reuses the version it reserved
+                BeginCollectionVersionInputParams(alias=alias, build_id=workflow_info().run_id),
+                start_to_close_timeout=timedelta(minutes=2)
+            )
+            collection_name = started["collection_name"]
+        slots = asyncio.Semaphore(int(input.get("max_parallel", 4)))
+        max_attempts = int(input.get("max_attempts", 3))
+        retry_policy = RetryPolicy(
+            initial_interval=timedelta(seconds=5),
+            backoff_coefficient=2.0,
+            maximum_attempts=max_attempts
+        )
+
+        async def ingest(file_path: str) -> dict:
+            async with slots:
+                try:
+                    return await workflow.step(
+                        parse_municode_entry,
+                        ParseMunicodeEntryInputParams(path=file_path, collection_name=collection_name),
+                        retry_policy=retry_policy,
+                        start_to_close_timeout=timedelta(minutes=30),
+                        schedule_to_close_timeout=all_attempts(timedelta(minutes=30), max_attempts)
+                    )
+                except Exception as e:
+                    log.error("municode file failed", extra={"path": file_path, "error": str(e)})
+                    return {"path": file_path, "error": str(e)}
+
+        files = await asyncio.gather(*[ingest(file_path) for file_path in paths])
+
+        succeeded = [f for f in files if "error" not in f]
+        for f in sorted(succeeded, key=lambda f: f["total_seconds"], reverse=True):
+            log.info("municode file ingested", extra=f)
+        summary = {
+            "collection_name": collection_name,
+            "files": files,
+            "succeeded": len(succeeded),
+            "failed": len(files) - len(succeeded),
+            "sections": sum(f["sections"] for f in succeeded),
+            "duplicates": sum(f.get("duplicates", 0) for f in succeeded),
+            "slowest_file_seconds": max((f["total_seconds"] for f in succeeded), default=0.0),
+            "sum_file_seconds": sum(f["total_seconds"] for f in succeeded)
+        }
 
-        returned_doc = await workflow.step(parse_municode_entry, ParseMunicodeEntryInputParams(path=path), start_to_close_timeout=timedelta(seconds=30))
-        return returned_doc
\ No newline at end of file
+        if rebuild:
+            if summary["failed"]:
+                # Publishing would replace the live corpus with a partial one
+                summary["published"] = False
+                await workflow.step(
+                    discard_collection_version,
+                    DiscardCollectionVersionInputParams(
+                        alias=alias,
+                        version=started["version"],
+                        failures=[f"{f['path']}: {f['error']}" for f in files if "error" in f]
+                    ),
+                    retry_policy=retry_policy,
+                    start_to_close_timeout=timedelta(minutes=10),
+                    schedule_to_close_timeout=all_attempts(timedelta(minutes=10), max_attempts)
+                )
+                return summary
+            summary["published"] = await workflow.step(
+                publish_collection_version,
+                PublishCollectionVersionInputParams(
+                    alias=alias,
+                    version=started["version"],
+                    written=summary["sections"],
+                    smoke_query=input.get("smoke_query", "building permit")
+                ),
+                retry_policy=retry_policy,
+                start_to_close_timeout=timedelta(minutes=10),
+                schedule_to_close_timeout=all_attempts(timedelta(minutes=10), max_attempts)
+            )
+        return summary
@@ -1,11 +1,23 @@
+import asyncio
 from datetime import timedelta
 from restack_ai.workflow import workflow, import_functions, log
+from temporalio.common import RetryPolicy
 
 with import_functions():
-    from src.functions.hn.search import hn_search
-    from src.functions.hn.schema import HnSearchInput
+    from src.functions.hn.search import hn_search, hn_mark_seen
+    from src.functions.hn.schema import HnMarkSeenInput, HnSearchInput
     from src.functions.llm.chat import llm_chat, FunctionInputParams
-    
+    from src.functions.crawl.crawl_urls import crawl_urls, CrawlUrlsInput
+
+# crawl_urls returns what it fetched by its deadline, the step timeout leaves
+# time for text extraction after it so finished pages are never lost
+CRAWL_DEADLINE_SECONDS = 45.0
+CRAWL_TIMEOUT = timedelta(seconds=CRAWL_DEADLINE_SECONDS + 30)
+# Three attempts of an llm_chat call and the backoff between them, workflow.step
+# would otherwise stop retrying after 2 minutes
+LLM_ATTEMPT_TIMEOUT = timedelta(seconds=120)
+LLM_TIMEOUT = LLM_ATTEMPT_TIMEOUT * 3 + timedelta(seconds=10)
+
 
 @workflow.defn(name="hn_workflow")
 class hn_workflow:
@@ -15,20 +27,41 @@ class hn_workflow:
         query = input["query"]
         count = input["count"]
         hn_results = await workflow.step(hn_search, HnSearchInput(query=query, count=count), start_to_close_timeout=timedelta(seconds=10))
-        urls = [hit['url'] for hit in hn_results['hits'] if 'url' in hit]
+        urls = list(dict.fromkeys(hit['url'] for hit in hn_results['hits'] if hit.get('url')))
 
+        # All pages are fetched concurrently in one step, failed and slow pages are left out
         crawled_contents = []
-        for url in urls:  # Use the extracted URLs
-            log.info("hn_result", extra={"url": url})
+        if urls:
+            try:
+                crawled_contents = await workflow.step(crawl_urls, CrawlUrlsInput(urls=urls, deadline_seconds=CRAWL_DEADLINE_SECONDS), start_to_close_timeout=CRAWL_TIMEOUT, schedule_to_close_timeout=CRAWL_TIMEOUT)
+            except Exception as e:
+                log.error("crawl failed, summarizing without page contents", extra={"error": str(e)})
+        log.info("hn_crawl", extra={"urls": len(urls), "crawled": len(crawled_contents)})
+
+        # Summaries run in parallel, bounded so one run cannot flood the llm_chat queue
+        slots = asyncio.Semaphore(int(input.get("max_parallel_summaries", 8)))
+        retry_policy = RetryPolicy(initial_interval=timedelta(seconds=2), maximum_attempts=3)
 
-        summaries = []
-        for content in crawled_contents:
+        async def summarize(page: dict):
             system_prompt = f"Provide a summary of the website for project found on Hacker news"
-            user_prompt = f"Summarize the following content: {content}"
-            summary = await workflow.step(llm_chat, FunctionInputParams(system_prompt=system_prompt, user_prompt=user_prompt), task_queue="llm_chat",start_to_close_timeout=timedelta(seconds=120))
-            summaries.append(summary)
+            user_prompt = f"Summarize the following content: {page['content']}"
+            async with slots:
+                try:
+                    summary = await workflow.step(llm_chat, FunctionInputParams(system_prompt=system_prompt, user_prompt=user_prompt), task_queue="llm_chat", retry_policy=retry_policy, start_to_close_timeout=LLM_ATTEMPT_TIMEOUT, schedule_to_close_timeout=LLM_TIMEOUT)
+                except Exception as e:
+                    log.error("summary failed", extra={"url": page["url"], "error": str(e)})
+                    return None
+            return {"url": page["url"], "summary": summary}
+
+        summaries = [s for s in await asyncio.gather(*[summarize(page) for page in crawled_contents]) if s]
 
         system_prompt = f"You are a personal assistant. Provide a summary of the latest hacker news and the summaries of the websites. Structure your response with the title of the project, then a short description and a list of actionable bullet points."
         user_prompt = f"Here is the latest hacker news data: {str(hn_results)} and summaries of the websites: {str(summaries)}"
 
-        return await workflow.step(llm_chat, FunctionInputParams(system_prompt=system_prompt,user_prompt=user_prompt), task_queue="llm_chat", start_to_close_timeout=timedelta(seconds=120))
\ No newline at end of file
+        digest = await workflow.step(llm_chat, FunctionInputParams(system_prompt=system_prompt,user_prompt=user_prompt), task_queue="llm_chat", retry_policy=retry_policy, start_to_close_timeout=LLM_ATTEMPT_TIMEOUT, schedule_to_close_timeout=LLM_TIMEOUT)
+
+        # Marked only once the digest exists, a failed or retried run gets the same stories again
+        if hn_results["hits"]:
+            seen = [{"objectID": hit["objectID"], "created_at_i": hit.get("created_at_i", 0)} for hit in hn_results["hits"]]
+            await workflow.step(hn_mark_seen, HnMarkSeenInput(query=query, hits=seen), retry_policy=retry_policy, start_to_close_timeout=timedelta(seconds=10))
+        return digest
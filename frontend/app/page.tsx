@@ -61,6 +61,8 @@ export default function Home() {
   const [selectedCity, setSelectedCity] = useState("Los Angeles"); // Default city
   const messagesRef = useRef<HTMLDivElement>(null);
   const formRef = useRef<HTMLFormElement>(null);
+  // Server-side chat session, remembers the conversation across requests
+  const sessionIdRef = useRef<string | null>(null);
 
   useEffect(() => {
     if (messagesRef.current) {
@@ -122,7 +124,7 @@ export default function Home() {
       const response = await fetch("http://localhost:8000/chat", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ message: regulatory }),
+        body: JSON.stringify({ message: regulatory, session_id: sessionIdRef.current }),
       });
 
       if (!response.body) throw new Error("No response body");
@@ -146,6 +148,9 @@ export default function Home() {
           const lines = chunk.split("\n").filter(line => line.trim() !== "");
           lines.forEach(line => {
             const parsed = JSON.parse(line);
+            if (parsed.session_id) {
+              sessionIdRef.current = parsed.session_id;
+            }
             if (parsed.content) {
               if (parsed.content !== "Assistant> ") {
                 newContent += parsed.content;